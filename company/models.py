@@ -44,9 +44,13 @@ class PersonModel(models.Model):
         return f"{self.name} | {self.tax_number}"
     
     def save(self, *args, **kwargs):
+        self.format_fields()
+        return super(PersonModel, self).save(*args, **kwargs)
+
+    def format_fields(self):
+        """Format fields before saving them"""
         self.name = self.name.upper()
         self.address = self.address.title()
-        return super(PersonModel, self).save(*args, **kwargs)
     
 
 class Company(PersonModel, SingletonModel):
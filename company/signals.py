@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from erp.models import TableVersion
+from .models import Company, FinancialYear
+from .utils import clear_cached_instance
+
+
+@receiver([post_save, post_delete], sender=Company)
+@receiver([post_save, post_delete], sender=FinancialYear)
+def bump_singleton_version(sender, **kwargs):
+    """Get the company or the current year again in every process after they change"""
+    TableVersion.bump(sender)
+    # This process gets them again right away, even if it's rolled back.
+    clear_cached_instance(sender)
+    transaction.on_commit(lambda: clear_cached_instance(sender))
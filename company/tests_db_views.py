@@ -1,10 +1,14 @@
 import datetime
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.db.models import F
 from django.test import TestCase, tag
 from django.urls import reverse
+from unittest.mock import patch
 
+from erp.models import TableVersion
 from .models import Company, FinancialYear
+from .utils import get_company, get_current_year
 from utils.base_tests import BackBaseTest
 
 # Create your tests here.
@@ -161,6 +165,31 @@ class CompanyTestCase(BackBaseTest):
         company = Company.objects.first()
         self.assertEqual(company.tax_number, "20361382480")
 
+    def test_cached_company_and_current_year(self):
+        get_company(), get_current_year()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_company(), self.company)
+            self.assertEqual(get_current_year(), self.financial_year)
+
+        # Other process changes the company, without touching this process.
+        # It's got again once the version is checked.
+        Company.objects.filter(pk=self.company.pk).update(name="OTHER PROCESS")
+        TableVersion.objects.filter(table="company.company").update(
+            version=F("version") + 1)
+        with patch("company.utils.VERSION_CHECK_INTERVAL", 0):
+            self.assertEqual(get_company().name, "OTHER PROCESS")
+            # The version is the same, so only it is read
+            with self.assertNumQueries(1):
+                get_company()
+
+        # Saving them gets them again
+        self.company.name = "New name"
+        self.company.save()
+        self.financial_year.current = False
+        self.financial_year.save()
+        self.assertEqual(get_company().name, "NEW NAME")
+        self.assertIsNone(get_current_year())
+
     def test_company_year_webpage_get(self):
         self.check_page_get_response(
             "/company/year",
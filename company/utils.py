@@ -0,0 +1,61 @@
+"""Utils for company app"""
+import time
+from django.db.models import Subquery
+
+from erp.models import TableVersion
+from .models import Company, FinancialYear
+
+
+# Seconds an instance is used before checking the version of its table again
+VERSION_CHECK_INTERVAL = 1
+# Instances kept by this process: {model label: (table state, checked at, instance)}
+_cached_instances = {}
+
+
+def get_cached_instance(model, queryset):
+    """
+    Get an instance kept in this process while the version of its table doesn't
+    change. Versions are read from the DB at most once per interval, so saving
+    the instance in a process invalidates it in the others after that.
+    The instance is shared, so it must not be changed.
+    Parameters:
+    - queryset: Queryset whose first row is the instance.
+    Returns:
+    - Model instance or None.
+    """
+    label = model._meta.label_lower
+    cached = _cached_instances.get(label)
+    now = time.monotonic()
+    if cached is not None:
+        if now - cached[1] < VERSION_CHECK_INTERVAL:
+            return cached[2]
+        # The modification time tells apart versions of rolled back transactions.
+        state = TableVersion.get_state(model)
+        if cached[0] == state:
+            _cached_instances[label] = (state, now, cached[2])
+            return cached[2]
+
+    # The instance is got with the version of its table in one query.
+    versions = TableVersion.objects.filter(table=label)
+    instance = queryset.annotate(
+        table_version=Subquery(versions.values("version")[:1]),
+        table_modified_at=Subquery(versions.values("modified_at")[:1]),
+    ).first()
+    # Without instance the state is unknown, so it's checked again.
+    state = (str(instance.table_version or 0), instance.table_modified_at
+        ) if instance is not None else None
+    _cached_instances[label] = (state, now, instance)
+    return instance
+
+def clear_cached_instance(model):
+    """Forget the instance of a model kept by this process"""
+    _cached_instances.pop(model._meta.label_lower, None)
+
+def get_company():
+    """Get the cached company. Returns None if it isn't created yet."""
+    return get_cached_instance(Company, Company.objects.all())
+
+def get_current_year():
+    """Get the cached current financial year. Returns None if it isn't set."""
+    return get_cached_instance(FinancialYear,
+        FinancialYear.objects.filter(current=True))
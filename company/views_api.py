@@ -1,16 +1,19 @@
 """API views for Company app"""
 from rest_framework import generics
 
+from erp.utils_api import ConditionalGetMixin
 from .models import FinancialYear
 from .serializers import FinancialYearSerializer 
 
-class CompanyYearAPI(generics.ListAPIView):
+class CompanyYearAPI(ConditionalGetMixin, generics.ListAPIView):
     """Show list of created years"""
     queryset = FinancialYear.objects.all()
     serializer_class = FinancialYearSerializer
+    versioned_models = [FinancialYear]
     
 
-class DetailCompanyYearAPI(generics.RetrieveUpdateDestroyAPIView):
+class DetailCompanyYearAPI(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """CRUD API of specific year"""
     queryset = FinancialYear.objects.all()
-    serializer_class = FinancialYearSerializer
\ No newline at end of file
+    serializer_class = FinancialYearSerializer
+    versioned_models = [FinancialYear]
\ No newline at end of file
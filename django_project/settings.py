@@ -134,4 +134,12 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # User accounts settings
 AUTH_USER_MODEL = "accounts.CustomUser"
 
+# Uploaded files, I.E. massive uploads waiting to be imported
+MEDIA_ROOT = BASE_DIR / "media"
+
+# API settings. Lists are paginated only when a page is requested.
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "erp.utils_api.PagePagination",
+}
+
 # My settings
@@ -6,4 +6,4 @@ class ErpConfig(AppConfig):
     name = "erp"
 
     def ready(self):
-        import erp.signals 
\ No newline at end of file
+        import erp.signals
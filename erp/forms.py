@@ -5,7 +5,7 @@ from django.db.models import Q
 from django.forms import inlineformset_factory
 from django.core.exceptions import ValidationError
 
-from company.models import Company
+from company.utils import get_company
 from .models import (CompanyClient, Supplier, PaymentMethod, PaymentTerm,
     PointOfSell, DocumentType, SaleInvoice, SaleInvoiceLine, SaleReceipt)
 from .validators import validate_is_digit, validate_file_extension
@@ -27,7 +27,7 @@ class CclientForm(forms.ModelForm):
 
     def clean_tax_number(self):
         tax_number = self.cleaned_data.get("tax_number")
-        company = Company.objects.only("tax_number").first()
+        company = get_company()
         
         if tax_number == company.tax_number:
             raise ValidationError(
@@ -51,7 +51,7 @@ class SupplierForm(forms.ModelForm):
 
     def clean_tax_number(self):
         tax_number = self.cleaned_data.get("tax_number")
-        company = Company.objects.only("tax_number").first()
+        company = get_company()
         
         if tax_number == company.tax_number:
             raise ValidationError(
@@ -130,7 +130,7 @@ class SaleInvoiceForm(forms.ModelForm):
         self.fields["point_of_sell"].queryset = PointOfSell.objects.filter(disabled=False)
 
         # Define sender as the company
-        sender = Company.objects.first()
+        sender = get_company()
         if sender:
             self.fields["sender"].initial = sender
             self.fields["sender"].disabled = True
@@ -282,7 +282,7 @@ class SaleReceiptForm(forms.ModelForm):
         self.fields["point_of_sell"].queryset = PointOfSell.objects.filter(disabled=False)
 
         # Define sender as the company
-        sender = Company.objects.first()
+        sender = get_company()
         if sender:
             self.fields["sender"].initial = sender
             self.fields["sender"].disabled = True
@@ -0,0 +1,984 @@
+"""Bulk import engines for massive uploads in ERP app"""
+import pandas as pd
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db import connection, models
+from django.db.models import Q
+
+from company.models import Company, PersonModel
+from company.utils import get_company, get_current_year
+from .models import (SaleInvoice, SaleInvoiceLine, SaleReceipt, ClientCurrentAccount,
+    PointOfSell, DocumentType, CompanyClient, Supplier, PaymentMethod, PaymentTerm,
+    ClientBalanceSnapshot, TableVersion, SaleReceiptSummary, SalesCube, ClientStats,
+    SALES_CUBE_AMOUNTS, BATCH_SIZE)
+from .search import index_persons
+from .utils import (list_file_errors, get_dataframe_rows, get_related_objects,
+    replace_related_objects, get_model_fields_name, get_objects_by_subfield,
+    get_missing_object_message, get_suspected_invalid_cells)
+
+
+# Related columns of a file: (column, model, subfield, value_function).
+# The order is the one used to report a missing object in a row.
+INVOICE_RELATED_FIELDS = (
+    ("point_of_sell", PointOfSell, "pos_number", lambda x: x.zfill(5)),
+    ("sender", Company, "tax_number", None),
+    ("recipient", CompanyClient, "tax_number", None),
+    ("type", DocumentType, "code", lambda x: x.zfill(3)),
+    ("payment_method", PaymentMethod, "pay_method", lambda x: x.capitalize()),
+    ("payment_term", PaymentTerm, "pay_term", None),
+)
+RECEIPT_RELATED_FIELDS = (
+    ("point_of_sell", PointOfSell, "pos_number", lambda x: x.zfill(5)),
+    ("sender", Company, "tax_number", None),
+    ("recipient", CompanyClient, "tax_number", None),
+    ("ri_type", DocumentType, "code", lambda x: x.zfill(3)),
+    ("ri_pos", PointOfSell, "pos_number", lambda x: x.zfill(5)),
+)
+
+
+class FileError(ValueError):
+    """
+    Errors of the rows of an imported file. The message has a line per error,
+    as the upload pages show them, and errors keeps them by row.
+    Parameters:
+    - errors: {row index: [(column or None, message, line of the message)]}, as
+    returned by get_row_error.
+    """
+    def __init__(self, errors):
+        super().__init__("\n".join(line for index in sorted(errors)
+            for _, _, line in errors[index]))
+        self.errors = errors
+
+
+def get_row_error(index, message, column=None, line=None):
+    """
+    Get an error of a file's row.
+    Parameters:
+    - index: Index of the row in the file.
+    - message: Error message.
+    - column: Column of the error. None if it's the row's error.
+    - line: Line of the error in FileError's message. By default it's
+    "Row N, column: message", or "Row N: message" without column.
+    Returns:
+    - Tuple: (column, message, line)
+    """
+    if line is None:
+        line = (list_file_errors(ValidationError({column: message}), index)
+            if column else f"Row {index + 2}: {message}")
+    return (column, message, line)
+
+
+def get_file_importer(kind):
+    """
+    Get a new importer for a kind of massive upload and the format of its file.
+    Parameters:
+    - kind: client, supplier, sale_invoice or sale_receipt.
+    Returns:
+    - Tuple: (importer, number of columns, date column)
+    """
+    if kind in ("client", "supplier"):
+        person_model = CompanyClient if kind == "client" else Supplier
+        person_fields = get_model_fields_name(PersonModel)
+        return PersonImporter(person_fields, person_model), 5, None
+    elif kind == "sale_invoice":
+        document_fields = get_model_fields_name(SaleInvoice, "collected",
+            "total_amount", "collected_amount", "outstanding_balance")
+        line_fields = get_model_fields_name(SaleInvoiceLine, "total_amount",
+            "sale_invoice"
+        )
+        total_fields = document_fields + line_fields
+        return SaleInvoiceImporter(total_fields), 12, "issue_date"
+    elif kind == "sale_receipt":
+        document_fields = get_model_fields_name(SaleReceipt, "related_invoice")
+        document_fields += ["ri_type", "ri_pos", "ri_number"]
+        return SaleReceiptImporter(document_fields), 10, "issue_date"
+    raise ValueError(f"{kind} files can't be imported.")
+
+def get_document_key(*numbers):
+    """
+    Get the complete number of a document as a tuple, I.E. (type, pos, number)
+    for invoices or (pos, number) for receipts.
+    """
+    widths = (3, 5, 8)[-len(numbers):]
+    return tuple(number.zfill(width) for number, width in zip(numbers, widths))
+
+def get_existing_document_dates(model, keys, group_lookups):
+    """
+    Get the issue dates of the documents in the DB that could be repeated or be
+    the previous document of one in the file, using one query.
+    Parameters:
+    - model: SaleInvoice or SaleReceipt.
+    - keys: Complete numbers of the file's documents. See get_document_key.
+    - group_lookups: Lookups of every key element but the number.
+    Returns:
+    - Dict: {complete number: issue_date}
+    """
+    # Get the range of numbers of each group (type and/or pos) in the file.
+    number_ranges = {}
+    for *group, number in keys:
+        if not number.isdigit():
+            continue
+        previous_number = str(max(int(number) - 1, 0)).zfill(8)
+        first, last = number_ranges.get(tuple(group), (previous_number, number))
+        number_ranges[tuple(group)] = (
+            min(first, previous_number), max(last, number)
+        )
+    if not number_ranges:
+        return {}
+
+    query = Q()
+    for group, number_range in number_ranges.items():
+        query |= Q(number__range=number_range, **dict(zip(group_lookups, group)))
+    documents = model.objects.filter(query).values_list(
+        *group_lookups, "number", "issue_date"
+    )
+    return {tuple(document[:-1]): document[-1] for document in documents}
+
+
+class BulkImporter:
+    """
+    Base importer of standarized dataframes. Related objects are got with one
+    query per model and rows are validated in memory, so they can be saved with
+    bulk_create. Errors are raised as ValueError with the same row messages as
+    a row by row import.
+    """
+    related_fields = ()
+    # Columns checked before importing the file: (column, model of the field)
+    checked_fields = ()
+    # Columns of the key that can't be repeated in a file: (column, zfill width)
+    key_columns = ()
+    # Error of a repeated key and its column, None if the key has many columns
+    repeated_message = "{key} is repeated in file."
+    repeated_column = None
+    # Models whose cached responses are invalidated after saving rows
+    changed_models = ()
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.index = {field: fields.index(field) for field in fields}
+        # Objects of the related columns, kept between chunks and checks:
+        # {column: {formatted value: object}}
+        self.related_objects = {}
+        # Oldest current account movement saved since the last commit_changes
+        self.first_movement_date = None
+        # Clients stats changes of the movements saved, as ClientStats.sum_changes
+        self.client_stats = {}
+        # Rows of the file saved in the DB
+        self.saved_rows = 0
+
+    def import_file(self, chunks):
+        """
+        Import every dataframe chunk of a file and save the rows that are still
+        pending. It must be called inside a transaction.
+        """
+        for df in chunks:
+            self.import_dataframe(df)
+        self.save()
+        self.commit_changes()
+
+    def add_movements(self, current_accounts):
+        """
+        Keep the oldest date of current account movements saved in bulk and
+        sum them by client, to add them to the clients stats once.
+        """
+        ClientStats.sum_changes([(current_account.get_stats_values(), 1)
+            for current_account in current_accounts], self.client_stats)
+        dates = [current_account.date for current_account in current_accounts]
+        if self.first_movement_date is not None:
+            dates.append(self.first_movement_date)
+        self.first_movement_date = min(dates, default=None)
+
+    def commit_changes(self):
+        """
+        Invalidate the balance snapshots and cached responses changed by the
+        saved rows, once per transaction, as bulk_create doesn't send signals.
+        """
+        if self.first_movement_date is not None:
+            ClientBalanceSnapshot.invalidate(self.first_movement_date)
+            self.first_movement_date = None
+        if self.client_stats:
+            ClientStats.add_totals(self.client_stats)
+            self.client_stats = {}
+        TableVersion.bump(*self.changed_models)
+
+    def check_file(self, chunks):
+        """
+        Check every chunk of a file with vectorized validations before writing
+        anything in the DB, so wrong files are rejected at once.
+        Raises:
+        - ValueError: With all the errors of the file, sorted by row.
+        """
+        current_year = get_current_year()
+        self.current_year = int(current_year.year) if current_year else None
+        self.checked_keys = set()
+        self.last_checked_key = None
+        # Issue dates of the file's documents: {complete number: issue_date}
+        self.checked_dates = {}
+
+        # Errors of the file: {row index: [errors as get_row_error]}
+        self.file_errors = {}
+        for df in chunks:
+            self.check_related_columns(df)
+            self.check_field_columns(df)
+            self.check_rows(df)
+            self.check_repeated_keys(df)
+        if self.file_errors:
+            raise FileError(self.file_errors)
+
+    def add_file_error(self, index, message, column=None, line=None):
+        """Add an error of a row to the file's errors, as get_row_error"""
+        self.file_errors.setdefault(index, []).append(
+            get_row_error(index, message, column, line))
+
+    def check_related_columns(self, df):
+        """Check that the related values of the dataframe exist in the DB"""
+        get_related_objects(self.related_fields, self.related_objects,
+            lambda column: df[column].astype(str).unique())
+        for column, _, _, value_function in self.related_fields:
+            values = df[column].astype(str)
+            if value_function:
+                values = values.map(value_function)
+            missing = ~values.isin(self.related_objects[column].keys())
+            for index in df.index[missing]:
+                self.add_file_error(index, "This value doesn't exist in the records.",
+                    column, get_missing_object_message(column, index))
+
+    def check_field_columns(self, df):
+        """
+        Check the columns of the model fields. Suspected cells are found for
+        the whole column and then confirmed with the field's validation.
+        """
+        for column, model in self.checked_fields:
+            field = model._meta.get_field(column)
+            values = df[column].astype(str)
+
+            if isinstance(field, models.DateField):
+                values = values.str[0:10]
+                dates = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+                suspected = dates.isna() | (dates.dt.year != self.current_year)
+            else:
+                suspected = get_suspected_invalid_cells(values, field)
+
+            for index in df.index[suspected]:
+                try:
+                    if isinstance(field, models.DateField):
+                        self.check_date(field, values[index])
+                    else:
+                        field.clean(values[index], None)
+                except ValidationError as ve:
+                    for message in ve.messages:
+                        self.add_file_error(index, message, column)
+
+    def check_date(self, field, value):
+        """
+        Validate a date as its field does, using the current year got once
+        instead of a query per cell.
+        """
+        value = field.to_python(value)
+        if self.current_year is None:
+            raise ValidationError("First you have to set the current financial year.")
+        if value.year != self.current_year:
+            raise ValidationError("The selected date is not within the current year.")
+
+    def check_rows(self, df):
+        """Check the rules of the importer's rows. By default there aren't any."""
+        pass
+
+    def check_documents(self, df, keys, model, group_lookups):
+        """
+        Check the documents of the dataframe as their model's clean does, with
+        one query per chunk: they don't exist in the DB, their point of sell is
+        enabled and they aren't older than the previous document, looking for
+        it in the file or in the DB.
+        Parameters:
+        - df: Dataframe of the chunk.
+        - keys: Complete numbers of the documents by row index. See
+        get_document_key.
+        - model: SaleInvoice or SaleReceipt.
+        - group_lookups: Lookups of every key element but the number.
+        """
+        document = model._meta.verbose_name.split()[-1]
+        existing_dates = get_existing_document_dates(model, keys.tolist(),
+            group_lookups)
+        issue_dates = pd.to_datetime(df["issue_date"].astype(str).str[0:10],
+            format="%Y-%m-%d", errors="coerce")
+
+        for index, key in keys.items():
+            *group, number = key
+            if key in existing_dates:
+                self.add_file_error(index, f"{self.get_key_label(key)} already "
+                    f"exists or repeated in file.")
+            pos = self.related_objects["point_of_sell"].get(group[-1])
+            if pos and pos.disabled:
+                self.add_file_error(index,
+                    "You cannot include a disabled point of sell.", "general")
+
+            # Wrong dates are reported by check_field_columns.
+            if pd.isna(issue_dates[index]):
+                continue
+            issue_date = issue_dates[index].date()
+            if number.isdigit() and int(number) > 1:
+                previous_key = (*group, str(int(number) - 1).zfill(8))
+                previous_date = self.checked_dates.get(
+                    previous_key, existing_dates.get(previous_key))
+                if previous_date and issue_date < previous_date:
+                    self.add_file_error(index, "Issue date can't be older than "
+                        f"previous {document}.", "general")
+            self.checked_dates[key] = issue_date
+
+    def get_row_keys(self, df):
+        """
+        Get the keys of the dataframe's rows that can't be repeated. Rows with
+        blank key columns are skipped, as they are reported as blank.
+        """
+        keys = pd.Series("", index=df.index)
+        blank = pd.Series(False, index=df.index)
+        for column, width in self.key_columns:
+            values = df[column].astype(str)
+            blank |= values == ""
+            keys = keys + "-" + values.str.zfill(width)
+        return keys[~blank].str[1:]
+
+    def get_existing_keys(self, keys):
+        """
+        Get the keys that already exist in the DB. By default they are checked
+        while importing.
+        """
+        return ()
+
+    def check_repeated_keys(self, df):
+        """Check that the keys of the dataframe are not repeated in the file"""
+        keys = self.get_row_keys(df)
+        self.checked_keys.update(self.get_existing_keys(keys.unique()))
+        repeated = keys.duplicated() | keys.isin(self.checked_keys)
+        for index, key in keys[repeated].items():
+            self.add_file_error(index, self.repeated_message.format(key=key),
+                self.repeated_column)
+        self.checked_keys.update(keys)
+
+    def get_rows(self, df):
+        """Get the dataframe's rows and all the objects of their related columns"""
+        rows = list(get_dataframe_rows(df, self.fields))
+        get_related_objects(self.related_fields, self.related_objects,
+            lambda column: [row[self.index[column]] for _, row in rows])
+        return rows
+
+    def replace_related_objects(self, row, index):
+        """Replace the related values of a row with their objects"""
+        return replace_related_objects(
+            self.related_fields, self.related_objects, self.fields, row, index
+        )
+
+    def validate(self, instance, index, exclude, clean=None):
+        """
+        Execute validators before saving, and raise FileError with the errors of
+        the row if exists.
+        Parameters:
+        - instance: Model instance to validate.
+        - index: Index of the row in the file.
+        - exclude: Fields that are not validated, I.E. objects got from the DB.
+        - clean: Optional. Function that replaces the model's clean method.
+        """
+        errors = {}
+        try:
+            instance.clean_fields(exclude=exclude)
+        except ValidationError as ve:
+            errors = ve.update_error_dict(errors)
+        if clean:
+            try:
+                clean()
+            except ValidationError as ve:
+                errors = ve.update_error_dict(errors)
+        if errors:
+            # Errors of the whole row are shown as the general column's.
+            raise FileError({index: [
+                get_row_error(index, message, "general" if field == "__all__" else field)
+                for field, messages in ValidationError(errors).message_dict.items()
+                for message in messages
+            ]})
+
+    def check_date_correlation(self, instance, previous_key, document):
+        """
+        Check that the document is not older than the previous one, looking for
+        it in the file or in the DB.
+        """
+        previous_date = self.file_dates.get(
+            previous_key, self.existing_dates.get(previous_key)
+        )
+        if previous_date:
+            if not isinstance(instance.issue_date, date):
+                raise ValidationError("issue_date has a wrong type or format.")
+            if instance.issue_date < previous_date:
+                raise ValidationError(
+                    f"Issue date can't be older than previous {document}."
+                )
+
+
+class PersonImporter(BulkImporter):
+    """
+    Import clients or suppliers. Tax numbers are checked with one query per
+    chunk and persons are saved in bulk, with the opening current account of
+    each client.
+    """
+    checked_fields = (
+        ("tax_number", PersonModel),
+        ("name", PersonModel),
+        ("address", PersonModel),
+        ("email", PersonModel),
+        ("phone", PersonModel),
+    )
+    key_columns = (("tax_number", 0),)
+    repeated_message = "This tax number already exists."
+    repeated_column = "tax_number"
+
+    def __init__(self, fields, model):
+        super().__init__(fields)
+        self.changed_models = (model,)
+        self.model = model
+        self.company = None
+        # Persons waiting to be saved
+        self.persons = []
+        # Tax numbers of the file's persons
+        self.file_tax_numbers = set()
+
+    def get_existing_keys(self, keys):
+        """Get the tax numbers of the file that already exist in the DB"""
+        return get_objects_by_subfield(self.model, "tax_number", keys).keys()
+
+    def check_rows(self, df):
+        """Check that the tax numbers of the file aren't the company's"""
+        if self.company is None:
+            self.company = get_company()
+        if self.company is None:
+            return
+        company_rows = df["tax_number"].astype(str) == self.company.tax_number
+        for index in df.index[company_rows]:
+            self.add_file_error(index,
+                "The tax number you're trying to add belongs to the company.",
+                "tax_number")
+
+    def import_dataframe(self, df):
+        """Validate all the rows of the dataframe and save them"""
+        if self.company is None:
+            self.company = get_company()
+        rows = list(get_dataframe_rows(df, self.fields))
+        self.existing_tax_numbers = self.get_existing_keys(
+            [row[self.index["tax_number"]] for _, row in rows]
+        )
+        for index, row in rows:
+            self.persons.append(self.create_person(row, index))
+        self.save()
+
+    def create_person(self, row, index):
+        """Create and validate a new person from a row"""
+        new_person = self.model(
+            tax_number = row[self.index["tax_number"]],
+            name = row[self.index["name"]],
+            address = row[self.index["address"]],
+            email = row[self.index["email"]],
+            phone = row[self.index["phone"]],
+        )
+        self.validate(new_person, index, exclude=[],
+            clean=lambda: self.clean_person(new_person)
+        )
+        self.file_tax_numbers.add(new_person.tax_number)
+
+        # Format fields as PersonModel.save does, as bulk_create doesn't call it.
+        new_person.format_fields()
+        return new_person
+
+    def clean_person(self, person):
+        """
+        Check that the tax number is unique, as full_clean does, but comparing
+        with the tax numbers got in memory. The company's tax number is
+        rejected by check_file.
+        """
+        if (person.tax_number in self.existing_tax_numbers or
+            person.tax_number in self.file_tax_numbers):
+            raise ValidationError({"tax_number": 
+                self.model._meta.get_field("tax_number").error_messages["unique"]
+            })
+
+    def save(self):
+        """Save the validated persons and the current accounts of clients"""
+        self.model.objects.bulk_create(self.persons, batch_size=BATCH_SIZE)
+        index_persons(self.model, self.persons)
+        # Clients' current accounts are created by a signal in a single save.
+        if self.model is CompanyClient:
+            ClientCurrentAccount.objects.bulk_create([
+                ClientCurrentAccount(
+                    client = person,
+                    date = self.company.creation_date,
+                ) for person in self.persons
+            ], batch_size=BATCH_SIZE)
+        self.saved_rows += len(self.persons)
+        self.persons = []
+
+
+class SaleInvoiceImporter(BulkImporter):
+    """
+    Import sale invoices and their lines. The rows are grouped into invoices in
+    memory and the invoices, lines and current accounts are saved in bulk.
+    """
+    related_fields = INVOICE_RELATED_FIELDS
+    checked_fields = (
+        ("issue_date", SaleInvoice),
+        ("number", SaleInvoice),
+        ("description", SaleInvoiceLine),
+        ("taxable_amount", SaleInvoiceLine),
+        ("not_taxable_amount", SaleInvoiceLine),
+        ("vat_amount", SaleInvoiceLine),
+    )
+    key_columns = (("type", 3), ("point_of_sell", 5), ("number", 8))
+    repeated_message = "Invoice {key} already exists or repeated in file."
+    changed_models = (SaleInvoice,)
+
+    def __init__(self, fields):
+        super().__init__(fields)
+        # Invoices waiting to be saved: [(invoice, [lines])]
+        self.invoices = []
+        # Invoices created in this file and not saved: {complete number: issue_date}
+        self.file_dates = {}
+        self.last_invoice = self.last_invoice_key = None
+        # Sales cube changes of the saved invoices, as SalesCube.sum_changes
+        self.cube_cells = {}
+        # Invoice's info of the last row checked, to compare it with its lines
+        self.last_checked_info = None
+
+    def import_dataframe(self, df):
+        """
+        Validate all the rows of the dataframe and save their invoices, except
+        the last one, as its lines could continue in the next chunk.
+        """
+        rows = self.get_rows(df)
+        self.existing_dates = get_existing_document_dates(
+            SaleInvoice, [self.get_row_key(row) for _, row in rows],
+            ["type__code", "point_of_sell__pos_number"]
+        )
+
+        for index, row in rows:
+            invoice_key = self.get_row_key(row)
+            row = self.replace_related_objects(row, index)
+
+            # Control if it's new invoice or line
+            if self.last_invoice is None or self.last_invoice_key != invoice_key:
+                self.last_invoice = self.create_invoice(row, index, invoice_key)
+                self.last_invoice_key = invoice_key
+                self.invoices.append((self.last_invoice, []))
+            # Control that invoice's info for new line is consistent
+            else:
+                self.check_invoice_consistency(self.last_invoice, row, index)
+
+            self.invoices[-1][1].append(self.create_line(row, index))
+
+        if self.invoices:
+            pending_invoice = self.invoices.pop()
+            self.save()
+            # Saved invoices are found in the DB by the next chunk's query.
+            self.invoices = [pending_invoice]
+            self.file_dates = {self.last_invoice_key: self.last_invoice.issue_date}
+
+    def check_rows(self, df):
+        """
+        Check that the lines of each invoice have the same invoice's info, and
+        the invoices of the dataframe as SaleInvoice.clean does.
+        """
+        keys = super().get_row_keys(df)
+        first_rows = self.get_first_rows(keys)
+
+        # Info of each row and the info of its invoice's first row
+        value_functions = {column: value_function
+            for column, _, _, value_function in self.related_fields}
+        info = pd.DataFrame(index=keys.index)
+        for column in ("issue_date", "recipient", "payment_method", "payment_term"):
+            values = df.loc[keys.index, column].astype(str)
+            if column == "issue_date":
+                values = values.str[0:10]
+            elif value_functions[column]:
+                values = values.map(value_functions[column])
+            info[column] = values
+        invoice_info = info[first_rows].reindex(info.index)
+        if len(info) and not first_rows.iloc[0]:
+            # The first line continues the last invoice of the previous chunk.
+            invoice_info.iloc[0] = self.last_checked_info
+        invoice_info = invoice_info.ffill()
+        if len(info):
+            self.last_checked_info = invoice_info.iloc[-1]
+
+        mismatched = (info != invoice_info).any(axis=1) & ~first_rows
+        for index in info.index[mismatched]:
+            self.add_file_error(index,
+                f"Your invoice's information doesn't match with row {index + 1}.")
+
+        self.check_documents(df, keys[first_rows].str.split("-").map(tuple),
+            SaleInvoice, ["type__code", "point_of_sell__pos_number"])
+
+    def get_key_label(self, key):
+        """Get the type and number of an invoice, as shown in its errors"""
+        type_code, pos_number, number = key
+        document_type = self.related_objects["type"].get(type_code)
+        return (f"Invoice {document_type.type if document_type else type_code} "
+            f"{pos_number}-{number}")
+
+    def get_first_rows(self, keys):
+        """
+        Get which rows start an invoice, as the rows of the same invoice are
+        consecutive lines.
+        """
+        return keys != keys.shift(fill_value=self.last_checked_key)
+
+    def get_row_keys(self, df):
+        """Get the complete number of the first row of each invoice"""
+        keys = super().get_row_keys(df)
+        first_rows = self.get_first_rows(keys)
+        if len(keys):
+            self.last_checked_key = keys.iloc[-1]
+        return keys[first_rows]
+
+    def get_row_key(self, row):
+        """Get the complete number of the row's invoice"""
+        return get_document_key(row[self.index["type"]],
+            row[self.index["point_of_sell"]], row[self.index["number"]])
+
+    def create_invoice(self, row, index, invoice_key):
+        """Create and validate a new invoice from a row"""
+        new_invoice = SaleInvoice(
+            issue_date = row[self.index["issue_date"]][0:10],
+            type = row[self.index["type"]],
+            point_of_sell = row[self.index["point_of_sell"]],
+            number = row[self.index["number"]],
+            sender = row[self.index["sender"]],
+            recipient = row[self.index["recipient"]],
+            payment_method = row[self.index["payment_method"]],
+            payment_term = row[self.index["payment_term"]],
+        )
+
+        # Related fields are excluded as they were got from the DB.
+        self.validate(new_invoice, index,
+            exclude=[field for field, *_ in self.related_fields],
+            clean=lambda: self.clean_invoice(new_invoice, invoice_key)
+        )
+
+        # Complete numbers with 0, as bulk_create doesn't call save()
+        new_invoice.number = new_invoice.number.zfill(8)
+        if invoice_key in self.existing_dates or invoice_key in self.file_dates:
+            raise FileError({index: [get_row_error(index,
+                f"Invoice {new_invoice.type.type} "
+                f"{new_invoice.point_of_sell.pos_number}-"
+                f"{new_invoice.number} already exists or "
+                f"repeated in file."
+            )]})
+        self.file_dates[invoice_key] = new_invoice.issue_date
+        return new_invoice
+
+    def clean_invoice(self, invoice, invoice_key):
+        """
+        Check date and number correlation and disabled pos as SaleInvoice.clean
+        does, but comparing with the invoices got in memory.
+        """
+        type_code, pos_number, number = invoice_key
+        if number.isdigit() and int(number) > 1:
+            previous_key = (type_code, pos_number, str(int(number) - 1).zfill(8))
+            self.check_date_correlation(invoice, previous_key, "invoice")
+        if invoice.point_of_sell.disabled:
+            raise ValidationError("You cannot include a disabled point of sell.")
+
+    def check_invoice_consistency(self, invoice, row, index):
+        """Check that the invoice's info of a new line matches its invoice"""
+        if (
+        str(invoice.issue_date) != row[self.index["issue_date"]][0:10] or
+        invoice.recipient != row[self.index["recipient"]] or
+        invoice.payment_method != row[self.index["payment_method"]] or
+        invoice.payment_term != row[self.index["payment_term"]]):
+            raise FileError({index: [get_row_error(index,
+                f"Your invoice's information doesn't match with row {index + 1}."
+            )]})
+
+    def create_line(self, row, index):
+        """Create and validate a new invoice line from a row"""
+        new_line = SaleInvoiceLine(
+            description = row[self.index["description"]],
+            taxable_amount = row[self.index["taxable_amount"]],
+            not_taxable_amount = row[self.index["not_taxable_amount"]],
+            vat_amount = row[self.index["vat_amount"]],
+            # Total amount is added to don't raise validation error
+            # in clean_fields(), then it's calculated below.
+            total_amount = "0",
+        )
+        self.validate(new_line, index, exclude=["sale_invoice"])
+
+        # Get total amount field, as bulk_create doesn't call save()
+        new_line.total_amount = (new_line.taxable_amount +
+            new_line.not_taxable_amount + new_line.vat_amount)
+        return new_line
+
+    def save(self):
+        """Save the validated invoices, their lines and clients' current accounts"""
+        invoices = []
+        for invoice, lines in self.invoices:
+            # Lines don't update the total, as bulk_create doesn't call save()
+            invoice.total_amount = round(sum(line.total_amount for line in lines), 2)
+            invoices.append(invoice)
+        SaleInvoice.objects.bulk_create(invoices, batch_size=BATCH_SIZE)
+
+        new_lines = []
+        new_current_accounts = []
+        for invoice, lines in self.invoices:
+            for line in lines:
+                line.sale_invoice = invoice
+            new_lines.extend(lines)
+            new_current_accounts.append(ClientCurrentAccount(
+                invoice = invoice,
+                date = invoice.issue_date,
+                client = invoice.recipient,
+                amount = invoice.total_amount,
+            ))
+        SaleInvoiceLine.objects.bulk_create(new_lines, batch_size=BATCH_SIZE)
+        SalesCube.sum_changes([
+            (invoice.get_cube_key(), 1, {field: sum(getattr(line, field)
+                for line in lines) for field in SALES_CUBE_AMOUNTS})
+            for invoice, lines in self.invoices
+        ], self.cube_cells)
+        ClientCurrentAccount.objects.bulk_create(
+            new_current_accounts, batch_size=BATCH_SIZE
+        )
+        self.add_movements(new_current_accounts)
+        self.saved_rows += len(new_lines)
+        self.invoices = []
+
+    def commit_changes(self):
+        """Add the saved invoices to the sales cube, once per transaction"""
+        if self.cube_cells:
+            SalesCube.add_cells(self.cube_cells)
+            self.cube_cells = {}
+        super().commit_changes()
+
+
+class SaleReceiptImporter(BulkImporter):
+    """
+    Import sale receipts. Related invoices are got with one composite key query
+    and receipts' amounts are validated against totals accumulated in memory.
+    Receipts and current accounts are saved in bulk and the collected status is
+    updated once per related invoice.
+    """
+    related_fields = RECEIPT_RELATED_FIELDS
+    checked_fields = (
+        ("issue_date", SaleReceipt),
+        ("number", SaleReceipt),
+        ("description", SaleReceipt),
+        ("total_amount", SaleReceipt),
+    )
+    key_columns = (("point_of_sell", 5), ("number", 8))
+    repeated_message = "Receipt {key} already exists or repeated in file."
+    # Collected amounts of the invoices are updated too.
+    changed_models = (SaleReceipt, SaleInvoice)
+
+    def __init__(self, fields):
+        super().__init__(fields)
+        # Receipts waiting to be saved
+        self.receipts = []
+        # Related invoices of the checked rows, with the receipts of the file
+        self.checked_invoices = {}
+
+    def import_dataframe(self, df):
+        """Validate all the rows of the dataframe and save them"""
+        rows = self.get_rows(df)
+        # Related invoices include the receipts saved from previous chunks.
+        self.related_invoices = self.get_related_invoices(
+            {self.get_related_invoice_key(row) for _, row in rows}
+        )
+        self.existing_dates = get_existing_document_dates(
+            SaleReceipt, [self.get_row_key(row) for _, row in rows],
+            ["point_of_sell__pos_number"]
+        )
+
+        # Receipts created in this chunk: {complete number: issue_date}
+        self.file_dates = {}
+        for index, row in rows:
+            receipt_key = self.get_row_key(row)
+            invoice_key = self.get_related_invoice_key(row)
+            row = self.replace_related_objects(row, index)
+            self.receipts.append(
+                self.create_receipt(row, index, receipt_key, invoice_key)
+            )
+
+        self.save()
+
+    def check_rows(self, df):
+        """
+        Check that the related invoices exist and the receipts' amounts fit in
+        them, including the receipts of the file, and the receipts of the
+        dataframe as SaleReceipt.clean does.
+        """
+        invoice_keys = pd.Series([get_document_key(*numbers) for numbers in
+            df[["ri_type", "ri_pos", "ri_number"]].astype(str).values.tolist()],
+            index=df.index, dtype=object)
+        self.checked_invoices.update(self.get_related_invoices(
+            set(invoice_keys) - self.checked_invoices.keys()))
+
+        for index, invoice_key in invoice_keys.items():
+            invoice = self.checked_invoices.get(invoice_key)
+            if invoice is None:
+                self.add_file_error(index,
+                    "The related invoice doesn't exist in the records.",
+                    line=(f"The related invoice in row {index + 2} "
+                        f"doesn't exist in the records."))
+                continue
+            try:
+                total_amount = Decimal(str(df.at[index, "total_amount"]))
+            except InvalidOperation:
+                total_amount = None
+            # Wrong amounts are reported by check_field_columns.
+            if total_amount is None or not total_amount.is_finite():
+                continue
+            if total_amount > invoice.total_amount:
+                self.add_file_error(index, "Receipt total amount cannot be "
+                    "higher than invoice total amount.", "general")
+            elif (invoice.collected_amount + invoice.file_collected_amount +
+                total_amount > invoice.total_amount):
+                self.add_file_error(index, "The sum of your receipts cannot be "
+                    "higher than invoice total amount.", "general")
+            invoice.file_collected_amount += total_amount
+
+        keys = super().get_row_keys(df)
+        self.check_documents(df, keys.str.split("-").map(tuple), SaleReceipt,
+            ["point_of_sell__pos_number"])
+
+    def get_key_label(self, key):
+        """Get the number of a receipt, as shown in its errors"""
+        return "Receipt {}-{}".format(*key)
+
+    def get_row_key(self, row):
+        """Get the complete number of the row's receipt"""
+        return get_document_key(
+            row[self.index["point_of_sell"]], row[self.index["number"]]
+        )
+
+    def get_related_invoice_key(self, row):
+        """Get the complete number of the row's related invoice"""
+        return get_document_key(row[self.index["ri_type"]],
+            row[self.index["ri_pos"]], row[self.index["ri_number"]])
+
+    def get_related_invoices(self, invoice_keys):
+        """
+        Get the related invoices of the file in one query.
+        Returns:
+        - Dict: {(type code, pos number, number): invoice}
+        """
+        # Each key uses 3 query parameters
+        invoice_keys = list(invoice_keys)
+        batch_size = (connection.features.max_query_params or 999) // 3
+
+        related_invoices = {}
+        for start in range(0, len(invoice_keys), batch_size):
+            query = Q()
+            for type_code, pos_number, number in invoice_keys[start:start + batch_size]:
+                query |= Q(type__code=type_code, point_of_sell__pos_number=pos_number,
+                    number=number)
+            invoices = SaleInvoice.objects.filter(query).select_related(
+                "type", "point_of_sell")
+            for invoice in invoices:
+                # Sum of the receipts of the file
+                invoice.file_collected_amount = 0
+                related_invoices[(invoice.type.code,
+                    invoice.point_of_sell.pos_number, invoice.number)] = invoice
+        return related_invoices
+
+    def create_receipt(self, row, index, receipt_key, invoice_key):
+        """Create and validate a new receipt from a row"""
+        # Get related invoice
+        try:
+            related_invoice = self.related_invoices[invoice_key]
+        except KeyError:
+            raise FileError({index: [get_row_error(index,
+                "The related invoice doesn't exist in the records.", line=(
+                    f"The related invoice in row {index + 2} "
+                    f"doesn't exist in the records."
+                )
+            )]})
+
+        new_receipt = SaleReceipt(
+            issue_date = row[self.index["issue_date"]][0:10],
+            point_of_sell = row[self.index["point_of_sell"]],
+            number = row[self.index["number"]],
+            sender = row[self.index["sender"]],
+            recipient = row[self.index["recipient"]],
+            description = row[self.index["description"]],
+            total_amount = row[self.index["total_amount"]],
+            related_invoice = related_invoice,
+        )
+        # Related fields are excluded as they were got from the DB.
+        self.validate(new_receipt, index,
+            exclude=["point_of_sell", "sender", "recipient", "related_invoice"],
+            clean=lambda: self.clean_receipt(new_receipt, receipt_key)
+        )
+
+        # Complete numbers with 0, as bulk_create doesn't call save()
+        new_receipt.number = new_receipt.number.zfill(8)
+        if receipt_key in self.existing_dates or receipt_key in self.file_dates:
+            raise FileError({index: [get_row_error(index,
+                f"Receipt {new_receipt.point_of_sell.pos_number}-"
+                f"{new_receipt.number} already exists or "
+                f"repeated in file."
+            )]})
+        self.file_dates[receipt_key] = new_receipt.issue_date
+        related_invoice.file_collected_amount += new_receipt.total_amount
+        return new_receipt
+
+    def clean_receipt(self, receipt, receipt_key):
+        """
+        Check date and number correlation, total amount and disabled pos as
+        SaleReceipt.clean does, but comparing with the data got in memory.
+        """
+        pos_number, number = receipt_key
+        if number.isdigit() and int(number) > 1:
+            previous_key = (pos_number, str(int(number) - 1).zfill(8))
+            self.check_date_correlation(receipt, previous_key, "receipt")
+
+        # Check that total amount is equal o lower than total amount of invoice,
+        # including the receipts of the file.
+        invoice = receipt.related_invoice
+        if not isinstance(receipt.total_amount, str):
+            if receipt.total_amount > invoice.total_amount:
+                raise ValidationError(
+                    "Receipt total amount cannot be higher than invoice total amount."
+                )
+            if (invoice.collected_amount + invoice.file_collected_amount +
+                receipt.total_amount > invoice.total_amount):
+                raise ValidationError(
+                    "The sum of your receipts cannot be higher than invoice total "
+                    "amount."
+                )
+        if receipt.point_of_sell.disabled:
+            raise ValidationError("You cannot include a disabled point of sell.")
+
+    def save(self):
+        """
+        Save the validated receipts and clients' current accounts, then update
+        the collected status of each related invoice.
+        """
+        SaleReceipt.objects.bulk_create(self.receipts, batch_size=BATCH_SIZE)
+        SaleReceiptSummary.add([(receipt.get_summary_values(), 1)
+            for receipt in self.receipts])
+        new_current_accounts = ClientCurrentAccount.objects.bulk_create([
+            ClientCurrentAccount(
+                receipt = receipt,
+                date = receipt.issue_date,
+                client = receipt.recipient,
+                amount = -receipt.total_amount,
+            ) for receipt in self.receipts
+        ], batch_size=BATCH_SIZE)
+        self.add_movements(new_current_accounts)
+
+        invoices = {receipt.related_invoice.pk: receipt.related_invoice
+            for receipt in self.receipts}.values()
+        for invoice in invoices:
+            # Add the receipts of the file to the amount saved in the DB
+            updates = SaleInvoice.get_collected_updates(invoice.file_collected_amount)
+            invoice.collected_amount = updates["collected_amount"]
+            invoice.collected = updates["collected"]
+        SaleInvoice.objects.bulk_update(invoices, ["collected_amount", "collected"],
+            batch_size=BATCH_SIZE)
+        self.saved_rows += len(self.receipts)
+        self.receipts = []
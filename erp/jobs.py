@@ -0,0 +1,179 @@
+"""Background import jobs for massive uploads in ERP app"""
+import os, socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .importers import get_file_importer
+from .models import ImportJob
+from .utils import read_standarized_chunks
+
+
+# Local queue of jobs. SQLite allows one writer at a time, so jobs are run one
+# by one instead of blocking each other.
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import_job")
+# Jobs beat at least once per chunk of their file, so jobs without a beat for
+# longer were left by a stopped process.
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+
+def get_worker():
+    """Get the host and process id of the current process, as host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def is_worker_alive(worker):
+    """
+    Check if the process of a worker is still running. Processes of other hosts
+    can't be checked, so they're considered alive.
+    """
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but it belongs to another user.
+        pass
+    return True
+
+def beat(job):
+    """
+    Update the heartbeat of a running job and of the jobs waiting for it in the
+    queue of the same process.
+    """
+    ImportJob.objects.filter(worker=job.worker,
+        status__in=["pending", "running"]).update(updated_at=timezone.now())
+
+def beat_chunks(job, chunks):
+    """Yield the chunks of a job's file, beating before each one"""
+    for df in chunks:
+        beat(job)
+        yield df
+
+def submit_import_job(job):
+    """Queue the import of a job once its creation is committed"""
+    job.worker = get_worker()
+    job.save(update_fields=["worker", "updated_at"])
+    transaction.on_commit(lambda: executor.submit(run_import_job, job.pk))
+
+def skip_rows(chunks, rows):
+    """Yield the chunks of a file without its first rows"""
+    for df in chunks:
+        if rows >= len(df):
+            rows -= len(df)
+            continue
+        yield df.iloc[rows:]
+        rows = 0
+
+def run_import_job(job_pk):
+    """
+    Import the file of a job. Each chunk of the file is committed in its own
+    transaction with rows_processed, as a checkpoint. If the job fails, its
+    file is kept and a retry continues after the rows already imported.
+    """
+    job = ImportJob.objects.get(pk=job_pk)
+    job.status = "running"
+    job.worker = get_worker()
+    job.started_at = timezone.now()
+    job.save(update_fields=["status", "worker", "started_at", "updated_at"])
+    # Rows imported by previous runs of the job
+    skipped_rows = job.rows_processed
+
+    try:
+        importer, columns_len, date_column = get_file_importer(job.kind)
+        with job.file.open("rb") as file:
+            try:
+                chunks = read_standarized_chunks(file, columns_len,
+                    importer.fields, date_column)
+            except ValueError:
+                raise ValueError(
+                    "The columns in your file don't match the required format."
+                )
+            # Reject wrong files before writing any row
+            importer.check_file(beat_chunks(job, skip_rows(chunks, skipped_rows)))
+            chunks = read_standarized_chunks(file, columns_len, importer.fields,
+                date_column)
+            for df in beat_chunks(job, skip_rows(chunks, skipped_rows)):
+                with transaction.atomic():
+                    importer.import_dataframe(df)
+                    importer.commit_changes()
+                    save_checkpoint(job, skipped_rows + importer.saved_rows)
+            with transaction.atomic():
+                importer.save()
+                importer.commit_changes()
+                save_checkpoint(job, skipped_rows + importer.saved_rows)
+        job.status = "done"
+        # Errors of a previous run or of a job failed as stale are cleared.
+        job.errors = ""
+    except ValueError as e:
+        job.status = "failed"
+        job.errors = str(e)
+    except Exception as e:
+        # Unexpected errors would leave the job running forever otherwise.
+        job.status = "failed"
+        job.errors = f"Unexpected error: {e}"
+    finally:
+        # Only the checkpoints committed are kept.
+        job.rows_processed = ImportJob.objects.values_list(
+            "rows_processed", flat=True).get(pk=job.pk)
+        if job.status == "done":
+            # Uploaded files are only needed until they are imported.
+            job.file.delete(save=False)
+        elif job.rows_processed:
+            job.errors += (f"\nThe first {job.rows_processed} rows of the file "
+                "were imported. Retry the import to continue after them.")
+        job.finished_at = timezone.now()
+        job.save(update_fields=["file", "status", "rows_processed", "errors",
+            "finished_at", "updated_at"])
+        if not connection.in_atomic_block:
+            # Each worker thread opens its own connection.
+            connection.close()
+
+def save_checkpoint(job, rows_processed):
+    """
+    Save the rows of the file imported by a job. It must be called in the
+    transaction of the rows, so they are committed together.
+    """
+    ImportJob.objects.filter(pk=job.pk).update(rows_processed=rows_processed,
+        updated_at=timezone.now())
+
+def retry_import_job(job):
+    """
+    Queue again a failed job, to import the rows of its file after the ones
+    imported by its previous runs. Stale jobs are failed first, so they can be
+    retried too.
+    Raises:
+    - ValueError: If the job isn't failed or its file was deleted.
+    """
+    fail_stale_jobs()
+    job.refresh_from_db()
+    if job.status != "failed" or not job.file:
+        raise ValueError("Only failed imports can be retried.")
+    job.status = "pending"
+    job.errors = ""
+    job.finished_at = None
+    job.save(update_fields=["status", "errors", "finished_at", "updated_at"])
+    submit_import_job(job)
+
+def fail_stale_jobs():
+    """
+    Mark as failed the jobs left pending or running by a stopped process, as
+    the queue is kept in memory and they won't be run again. A job is stale if
+    its process isn't running or it hasn't beaten for STALE_JOB_TIMEOUT.
+    Returns:
+    - Int: Number of failed jobs.
+    """
+    jobs = ImportJob.objects.filter(status__in=["pending", "running"])
+    stale_time = timezone.now() - STALE_JOB_TIMEOUT
+    stale_pks = [job.pk for job in jobs.only("worker", "updated_at")
+        if job.updated_at < stale_time or not is_worker_alive(job.worker)]
+    # Jobs finished meanwhile are kept.
+    return jobs.filter(pk__in=stale_pks).update(
+        status="failed",
+        errors="The import was interrupted. Retry it to continue after the "
+            "rows already imported.",
+        finished_at=timezone.now(),
+    )
@@ -0,0 +1,16 @@
+"""Command to fail the import jobs left by a stopped process"""
+from django.core.management.base import BaseCommand
+
+from erp.jobs import fail_stale_jobs, STALE_JOB_TIMEOUT
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark as failed the pending or running import jobs whose process "
+        f"stopped or that haven't made progress for {STALE_JOB_TIMEOUT}. Run it "
+        "after restarting the server."
+    )
+
+    def handle(self, *args, **options):
+        failed = fail_stale_jobs()
+        self.stdout.write(f"ImportJob: {failed} interrupted jobs failed.")
@@ -0,0 +1,67 @@
+"""Command to rebuild or verify the amounts saved in invoices"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from erp.models import SaleInvoice, SaleInvoiceLine, PurchaseInvoiceLine
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculate again the total amount of sale and purchase invoices from "
+        "their lines and the collected amount of sale invoices from their "
+        "receipts, or only check them with --verify."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true",
+            help="Show the invoices whose amounts don't match their lines or receipts.")
+
+    def handle(self, *args, **options):
+        wrong_invoices = 0
+        for line_model in [SaleInvoiceLine, PurchaseInvoiceLine]:
+            invoice_model = line_model._meta.get_field(
+                line_model.invoice_field).related_model
+            invoices = invoice_model.objects.all()
+
+            if options["verify"]:
+                mismatches = invoices.annotate(
+                    lines_total=line_model.get_invoice_total()
+                ).exclude(total_amount=F("lines_total"))
+                for invoice in mismatches:
+                    self.stdout.write(
+                        f"{invoice_model.__name__} {invoice}: saved "
+                        f"{invoice.total_amount}, lines {invoice.lines_total}"
+                    )
+                    wrong_invoices += 1
+            else:
+                with transaction.atomic():
+                    updated = invoices.update(
+                        total_amount=line_model.get_invoice_total()
+                    )
+                self.stdout.write(
+                    f"{invoice_model.__name__}: {updated} totals rebuilt."
+                )
+
+        # Collected status depends on the rebuilt totals, so it's updated after them.
+        if options["verify"]:
+            mismatches = SaleInvoice.objects.annotate(
+                receipts_total=SaleInvoice.get_receipts_total()
+            ).exclude(collected_amount=F("receipts_total"))
+            for invoice in mismatches:
+                self.stdout.write(
+                    f"SaleInvoice {invoice}: collected {invoice.collected_amount}, "
+                    f"receipts {invoice.receipts_total}"
+                )
+                wrong_invoices += 1
+        else:
+            with transaction.atomic():
+                updated = SaleInvoice.objects.update(
+                    **SaleInvoice.get_collected_updates()
+                )
+            self.stdout.write(f"SaleInvoice: {updated} collected amounts rebuilt.")
+
+        if wrong_invoices:
+            raise CommandError(f"{wrong_invoices} invoices have a wrong amount.")
+        elif options["verify"]:
+            self.stdout.write("All invoice amounts match their lines and receipts.")
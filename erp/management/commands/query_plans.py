@@ -0,0 +1,195 @@
+"""Command to compare the query plans of the hot queries with and without indexes"""
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from company.models import Company
+from erp.models import (ClientCurrentAccount, CompanyClient, DocumentType,
+    PaymentMethod, PaymentTerm, PointOfSell, SaleInvoice, SaleReceipt)
+
+
+# Models whose indexes are compared
+INDEXED_MODELS = [ClientCurrentAccount, SaleInvoice, SaleReceipt]
+# Number of clients of the seeded movements
+SEED_CLIENTS = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a dataset, then show the query plan and time of the ERP hot "
+        "queries without and with the indexes of erp.models. Every change is "
+        "rolled back at the end. Only SQLite is supported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000,
+            help="Number of current account movements. Invoices and receipts "
+            "are a quarter of it.")
+        parser.add_argument("--repeat", type=int, default=3,
+            help="Times each query is run to get its time.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Query plans can only be compared in SQLite.")
+        if options["rows"] < 4:
+            raise CommandError("At least 4 rows are needed.")
+
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} movements...")
+            queries = self.seed(options["rows"])
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            after = {name: self.measure(qs, options["repeat"])
+                for name, qs in queries.items()}
+            self.drop_indexes()
+            before = {name: self.measure(qs, options["repeat"])
+                for name, qs in queries.items()}
+
+            for name in queries:
+                self.stdout.write(f"\n{name}")
+                for label, (plan, seconds) in [("Before", before[name]),
+                    ("After", after[name])]:
+                    self.stdout.write(f"  {label} ({seconds * 1000:.2f} ms):")
+                    for line in plan.splitlines():
+                        self.stdout.write(f"    {line}")
+            # The seeded rows and the dropped indexes are never saved.
+            transaction.set_rollback(True)
+
+    def measure(self, queryset, repeat):
+        """Get the query plan of a queryset and its best time"""
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            seconds.append(time.perf_counter() - start)
+        return queryset.explain(), min(seconds)
+
+    def drop_indexes(self):
+        """Drop the indexes declared in the models' Meta"""
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(
+                        f"DROP INDEX {connection.ops.quote_name(index.name)}")
+            cursor.execute("ANALYZE")
+
+    def seed(self, rows):
+        """
+        Insert the rows with recursive queries, as they are too many to be
+        created with the ORM.
+        Returns:
+        - Dict: {description: queryset of the hot query}
+        """
+        company = Company.objects.first() or Company.objects.create(
+            tax_number="99999999999", name="BENCHMARK", address="Benchmark",
+            email="benchmark@benchmark.com", phone="0",
+            creation_date=datetime.date(2000, 1, 1),
+            closing_date=datetime.date(2000, 12, 31),
+        )
+        # Codes not used yet avoid repeated complete numbers.
+        pos = PointOfSell.objects.create(pos_number=self.get_free_code(
+            PointOfSell.objects.values_list("pos_number", flat=True), 5))
+        doc_type = DocumentType.objects.create(code=self.get_free_code(
+            DocumentType.objects.values_list("code", flat=True), 3),
+            type="B", description="BENCHMARK")
+        pay_method, _ = PaymentMethod.objects.get_or_create(pay_method="Benchmark")
+        pay_term, _ = PaymentTerm.objects.get_or_create(pay_term="0")
+        clients = CompanyClient.objects.bulk_create([
+            CompanyClient(tax_number=f"X{number:010}", name="BENCHMARK",
+                address="Benchmark", email="benchmark@benchmark.com", phone="0")
+            for number in range(SEED_CLIENTS)
+        ])
+        first_client = min(client.pk for client in clients)
+
+        documents = rows // 4
+        date = "date('2024-01-01', '+' || (n % 365) || ' days')"
+        client = f"{first_client} + n % {SEED_CLIENTS}"
+        self.insert_series(SaleInvoice, documents, {
+            "issue_date": date,
+            "number": "printf('%08d', n)",
+            "type": doc_type.pk,
+            "point_of_sell": pos.pk,
+            "sender": company.pk,
+            "recipient": client,
+            "payment_method": pay_method.pk,
+            "payment_term": pay_term.pk,
+            "collected": "n % 3 = 0",
+            "total_amount": "n % 1000 + 0.5",
+            "collected_amount": 0,
+        })
+        first_invoice = SaleInvoice.objects.filter(type=doc_type).order_by(
+            "pk").values_list("pk", flat=True)[0]
+        self.insert_series(SaleReceipt, documents, {
+            "issue_date": date,
+            "number": "printf('%08d', n)",
+            "point_of_sell": pos.pk,
+            "related_invoice": f"{first_invoice} + n - 1",
+            "sender": company.pk,
+            "recipient": client,
+            "description": "'Benchmark'",
+            "total_amount": "n % 1000 + 0.5",
+        })
+        self.insert_series(ClientCurrentAccount, rows, {
+            "date": date,
+            "client": client,
+            "amount": "n % 2000 - 999.5",
+        })
+
+        cutoff = datetime.date(2024, 6, 30)
+        return {
+            "Balance of a client up to a cutoff":
+                ClientCurrentAccount.objects.filter(client=first_client,
+                    date__lte=cutoff).values("client").annotate(
+                        balance=Sum("amount")).order_by(),
+            "Balances of all clients in a month":
+                ClientCurrentAccount.objects.filter(
+                    date__gt=datetime.date(2024, 5, 31), date__lte=cutoff
+                ).values("client").annotate(balance=Sum("amount"),
+                    movements=Count("id")).order_by(),
+            "Oldest uncollected invoices of a year":
+                SaleInvoice.objects.filter(collected=False, issue_date__range=(
+                    datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))
+                ).order_by("issue_date")[:10],
+            "Previous invoice of a complete number":
+                SaleInvoice.objects.filter(type=doc_type, point_of_sell=pos,
+                    number=f"{documents // 2:08}"),
+            "Receipts sum of an invoice":
+                SaleReceipt.objects.filter(related_invoice=first_invoice
+                    ).values("related_invoice").annotate(
+                        total=Sum("total_amount")).order_by(),
+            "Previous receipt of a complete number":
+                SaleReceipt.objects.filter(point_of_sell=pos,
+                    number=f"{documents // 2:08}"),
+        }
+
+    def insert_series(self, model, count, values):
+        """
+        Insert count rows in the table of a model.
+        Parameters:
+        - values: Dict of {field: SQL expression}, where n is the row number.
+        """
+        columns = ", ".join(connection.ops.quote_name(
+            model._meta.get_field(field).column) for field in values)
+        # Percent signs are escaped, as they are used by query parameters.
+        expressions = ", ".join(str(expression).replace("%", "%%")
+            for expression in values.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} "
+                f"({columns}) WITH RECURSIVE series(n) AS (SELECT 1 UNION ALL "
+                f"SELECT n + 1 FROM series WHERE n < %s) "
+                f"SELECT {expressions} FROM series",
+                [count]
+            )
+
+    def get_free_code(self, used_codes, length):
+        """Get the lowest code of a length that isn't used"""
+        used_codes = set(used_codes)
+        for number in range(10 ** length):
+            code = str(number).zfill(length)
+            if code not in used_codes:
+                return code
+        raise CommandError("There are no free codes to seed the documents.")
@@ -0,0 +1,24 @@
+"""Command to rebuild the full-text search index of clients and suppliers"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from erp.models import CompanyClient, Supplier
+from erp.search import has_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Index again all the clients and suppliers, I.E. after they were "
+        "changed without sending signals. Only SQLite has the index."
+    )
+
+    def handle(self, *args, **options):
+        if not has_search_index():
+            self.stdout.write("The DB searches persons without an index.")
+            return
+        for model in [CompanyClient, Supplier]:
+            with transaction.atomic():
+                rebuild_search_index(model)
+            self.stdout.write(
+                f"{model.__name__}: {model.objects.count()} persons indexed."
+            )
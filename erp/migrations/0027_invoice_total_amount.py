@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_total_amount(apps, schema_editor):
+    """Save the sum of the lines of the existing invoices"""
+    for invoice_model, line_model, invoice_field in [
+        ("SaleInvoice", "SaleInvoiceLine", "sale_invoice"),
+        ("PurchaseInvoice", "PurchaseInvoiceLine", "purchase_invoice"),
+    ]:
+        lines_sum = apps.get_model("erp", line_model).objects.filter(
+            **{invoice_field: OuterRef("pk")}).order_by().values(
+                invoice_field).annotate(total=Sum("total_amount")).values("total")
+        apps.get_model("erp", invoice_model).objects.update(
+            total_amount=Coalesce(Subquery(lines_sum), Decimal(0))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0026_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='total_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='total_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.RunPython(populate_total_amount, migrations.RunPython.noop),
+    ]
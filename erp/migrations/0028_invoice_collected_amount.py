@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+import django.db.models.expressions
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_collected_amount(apps, schema_editor):
+    """Save the sum of the receipts of the existing sale invoices"""
+    receipts_sum = apps.get_model("erp", "SaleReceipt").objects.filter(
+        related_invoice=OuterRef("pk")).order_by().values(
+            "related_invoice").annotate(total=Sum("total_amount")).values("total")
+    apps.get_model("erp", "SaleInvoice").objects.update(
+        collected_amount=Coalesce(Subquery(receipts_sum), Decimal(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0027_invoice_total_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='collected_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='outstanding_balance',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('total_amount'), '-', models.F('collected_amount')), output_field=models.DecimalField(decimal_places=2, max_digits=15)),
+        ),
+        migrations.RunPython(populate_collected_amount, migrations.RunPython.noop),
+    ]
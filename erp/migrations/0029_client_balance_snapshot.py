@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0028_invoice_collected_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('movements', models.PositiveIntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='erp.companyclient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'client'), name='unique_client_balance_snapshot')],
+            },
+        ),
+    ]
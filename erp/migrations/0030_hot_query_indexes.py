@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0010_alter_financialyear_year'),
+        ('erp', '0029_client_balance_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientcurrentaccount',
+            index=models.Index(fields=['client', 'date', 'amount'], name='client_ca_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientcurrentaccount',
+            index=models.Index(fields=['date', 'client', 'amount'], name='client_ca_date_client_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleinvoice',
+            index=models.Index(condition=models.Q(('collected', False)), fields=['issue_date'], name='sale_invoice_uncollected_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salereceipt',
+            index=models.Index(fields=['related_invoice', 'total_amount'], name='sale_receipt_invoice_idx'),
+        ),
+    ]
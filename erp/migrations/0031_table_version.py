@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_table_versions(apps, schema_editor):
+    """Create the versions of the tables used by cached responses"""
+    apps.get_model("erp", "TableVersion").objects.bulk_create([
+        apps.get_model("erp", "TableVersion")(table=table) for table in [
+            "erp.companyclient", "erp.supplier", "erp.pointofsell",
+            "erp.documenttype", "erp.saleinvoice", "erp.salereceipt",
+        ]
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0030_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_table_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0010_alter_financialyear_year'),
+        ('erp', '0031_table_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='companyclient',
+            index=models.Index(fields=['name'], name='company_client_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleinvoice',
+            index=models.Index(fields=['-issue_date', 'type', 'point_of_sell', '-number'], name='sale_invoice_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salereceipt',
+            index=models.Index(fields=['-issue_date', 'point_of_sell', '-number'], name='sale_receipt_ordering_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+PERSON_MODELS = ["CompanyClient", "Supplier"]
+# Columns of the index when it was created, as erp.search can change later
+SEARCH_COLUMNS = "name, address, tax_number"
+
+
+def create_person_search_indexes(apps, schema_editor):
+    """Create the full-text index of clients and suppliers, only in SQLite"""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for model in PERSON_MODELS:
+        table = apps.get_model("erp", model)._meta.db_table
+        # Short prefixes are indexed to search while typing.
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_search "
+            f"USING fts5({SEARCH_COLUMNS}, prefix='2 3', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {table}_search (rowid, {SEARCH_COLUMNS}) "
+            f"SELECT id, {SEARCH_COLUMNS} FROM {table}"
+        )
+
+def drop_person_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for model in PERSON_MODELS:
+        table = apps.get_model("erp", model)._meta.db_table
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0032_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_person_search_indexes,
+            drop_person_search_indexes),
+    ]
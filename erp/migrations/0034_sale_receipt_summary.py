@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_receipt_summaries(apps, schema_editor):
+    """Summarize the existing sale receipts by month and point of sell"""
+    summary_model = apps.get_model("erp", "SaleReceiptSummary")
+    summary_model.objects.bulk_create([
+        summary_model(month=row["month"], point_of_sell_id=row["point_of_sell"],
+            count=row["count"], total_amount=row["total_amount"])
+        for row in apps.get_model("erp", "SaleReceipt").objects.annotate(
+            month=TruncMonth("issue_date")).values("month", "point_of_sell"
+            ).annotate(count=Count("id"), total_amount=Sum("total_amount")
+            ).order_by()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0033_person_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleReceiptSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('point_of_sell', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receipt_summaries', to='erp.pointofsell')),
+            ],
+            options={
+                'ordering': ['month', 'point_of_sell'],
+                'constraints': [models.UniqueConstraint(fields=('month', 'point_of_sell'), name='unique_sale_receipt_summary')],
+            },
+        ),
+        migrations.RunPython(populate_receipt_summaries, migrations.RunPython.noop),
+    ]
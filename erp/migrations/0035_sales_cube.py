@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+AMOUNTS = ["taxable_amount", "not_taxable_amount", "vat_amount", "total_amount"]
+DIMENSIONS = ["recipient", "type", "point_of_sell", "payment_method"]
+
+
+def populate_sales_cube(apps, schema_editor):
+    """Sum the existing sale invoices and lines by month and dimensions"""
+    cells = {}
+    for row in apps.get_model("erp", "SaleInvoice").objects.annotate(
+        month=TruncMonth("issue_date")).values("month", *DIMENSIONS).annotate(
+        invoices=Count("id")).order_by():
+        cells[(row.pop("month"), *[row.pop(field) for field in DIMENSIONS])] = row
+    for row in apps.get_model("erp", "SaleInvoiceLine").objects.annotate(
+        month=TruncMonth("sale_invoice__issue_date")).values("month", *[
+            f"sale_invoice__{field}" for field in DIMENSIONS]).annotate(
+        **{field: Sum(field) for field in AMOUNTS}).order_by():
+        cells[(row.pop("month"), *[row.pop(f"sale_invoice__{field}")
+            for field in DIMENSIONS])].update(row)
+
+    cube_model = apps.get_model("erp", "SalesCube")
+    cube_model.objects.bulk_create([
+        cube_model(month=month, client_id=client, type_id=doc_type,
+            point_of_sell_id=pos, payment_method_id=pay_method, **totals)
+        for (month, client, doc_type, pos, pay_method), totals in cells.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0034_sale_receipt_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesCube',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('invoices', models.IntegerField(default=0)),
+                ('taxable_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('not_taxable_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('vat_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_cube', to='erp.companyclient')),
+                ('payment_method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_cube', to='erp.paymentmethod')),
+                ('point_of_sell', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_cube', to='erp.pointofsell')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_cube', to='erp.documenttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'month'], name='sales_cube_client_idx')],
+                'constraints': [models.UniqueConstraint(fields=('month', 'client', 'type', 'point_of_sell', 'payment_method'), name='unique_sales_cube_cell')],
+            },
+        ),
+        migrations.RunPython(populate_sales_cube, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:03
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_client_stats(apps, schema_editor):
+    """Sum the existing current account movements of each client"""
+    is_invoice = Q(invoice__isnull=False)
+    stats_model = apps.get_model("erp", "ClientStats")
+    stats_model.objects.bulk_create([
+        stats_model(client_id=row.pop("client"), **row)
+        for row in apps.get_model("erp", "ClientCurrentAccount").objects.exclude(
+            invoice=None, receipt=None).values("client").annotate(
+                total_sales=Coalesce(Sum("amount", filter=is_invoice), Decimal(0)),
+                transactions=Count("id", filter=is_invoice),
+                balance=Sum("amount"),
+                last_activity=Max("date"),
+            ).order_by()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0035_sales_cube'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientStats',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='erp.companyclient')),
+                ('total_sales', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('transactions', models.IntegerField(default=0)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('last_activity', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-total_sales', 'client'], name='client_stats_sales_idx'), models.Index(fields=['-transactions', 'client'], name='client_stats_transactions_idx'), models.Index(fields=['-balance', 'client'], name='client_stats_balance_idx'), models.Index(fields=['-last_activity', 'client'], name='client_stats_activity_idx')],
+            },
+        ),
+        migrations.RunPython(populate_client_stats, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,32 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Sum, Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Sum, Q, F, OuterRef, Subquery,
+    ExpressionWrapper, Count, Max)
+from django.db.models.functions import Coalesce, Greatest, Round, TruncMonth
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 
 from .validators import (validate_is_digit, validate_in_current_year, 
     validate_invoices_date_number_correlation, validate_receipt_date_number_correlation,
-    validate_receipt_total_amount, validate_not_disabled_pos)
+    validate_receipt_total_amount, validate_not_disabled_pos, validate_file_extension)
 from company.models import PersonModel, Company
 
+
+# Max number of instances saved per query by bulk_create and bulk_update
+BATCH_SIZE = 500
+# Fields of a sale invoice that make its sales cube cell
+SALES_CUBE_FIELDS = ["issue_date", "recipient_id", "type_id", "point_of_sell_id",
+    "payment_method_id"]
+# Amounts of the lines summed by the sales cube
+SALES_CUBE_AMOUNTS = ["taxable_amount", "not_taxable_amount", "vat_amount",
+    "total_amount"]
+
 # Create your models here.
 class CurrentAccountModel(models.Model):
     """Base model for a person's current account"""
@@ -36,11 +52,41 @@ class CommercialDocumentModel(models.Model):
         return f"{self.issue_date} | {self.point_of_sell}-{self.number}"
     
     def save(self, *args, **kwargs):
+        self.format_fields()
+        return super(CommercialDocumentModel, self).save(*args, **kwargs)
+
+    def format_fields(self):
+        """Format fields before saving them"""
         # Complete numbers with 0
         self.number = self.number.zfill(8)
-        return super(CommercialDocumentModel, self).save(*args, **kwargs)
     
 
+class InvoiceModel(CommercialDocumentModel):
+    """Base model for invoices, which keep the sum of their lines"""
+    # Updated by the lines when they are saved or deleted
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0,
+        db_index=True)
+
+    class Meta:
+        abstract = True
+
+    # Fields updated in the DB by other models, which mustn't be saved again
+    derived_fields = ["total_amount"]
+
+    def save(self, *args, **kwargs):
+        # Don't overwrite the totals of an existing invoice with old values
+        if (not self._state.adding and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")):
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated 
+                and field.name not in self.derived_fields]
+        return super(InvoiceModel, self).save(*args, **kwargs)
+
+    def total_lines_sum(self):
+        """Get the sum of all invoice's line"""
+        return self.total_amount
+
+
 class CommercialDocumentLineModel(models.Model):
     """Base model for commercial documents lines"""
     description = models.CharField(max_length=280)
@@ -55,16 +101,68 @@ class CommercialDocumentLineModel(models.Model):
     def __str__(self):
         return f"{self.description} | $ {self.total_amount}"
     
+    # Name of the line's invoice field
+    invoice_field = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the saved total, so the invoice is updated with the difference
+        instance.saved_total_amount = instance.__dict__.get("total_amount")
+        return instance
+
     def save(self, *args, **kwargs):
         # Get total amount field
         self.total_amount = (self.taxable_amount + self.not_taxable_amount +
             self.vat_amount)
-        return super(CommercialDocumentLineModel, self).save(*args, **kwargs)
+        saved_total_amount = getattr(self, "saved_total_amount", None)
+        adding = self._state.adding
+        super(CommercialDocumentLineModel, self).save(*args, **kwargs)
+
+        if adding:
+            self.update_invoice_total(self.total_amount)
+        elif saved_total_amount is not None:
+            self.update_invoice_total(self.total_amount - saved_total_amount)
+        else:
+            self.update_invoice_total()
+        self.saved_total_amount = self.total_amount
+
+    @classmethod
+    def get_invoice_total(cls):
+        """Get the sum of the lines of an invoice, as an expression of its query"""
+        return Coalesce(Subquery(
+            cls.objects.filter(**{cls.invoice_field: OuterRef("pk")}).order_by(
+                ).values(cls.invoice_field).annotate(total=Sum("total_amount")
+                ).values("total")
+        ), Decimal(0))
+
+    def update_invoice_total(self, amount=None):
+        """
+        Add an amount to the total of the line's invoice. Without amount, the
+        total is calculated again from all its lines.
+        """
+        invoice = self._meta.get_field(self.invoice_field)
+        invoices = invoice.related_model.objects.filter(
+            pk=getattr(self, invoice.attname)
+        )
+        if amount is None:
+            invoices.update(total_amount=self.get_invoice_total())
+            if invoice.is_cached(self):
+                getattr(self, invoice.name).refresh_from_db(fields=["total_amount"])
+        elif amount:
+            invoices.update(total_amount=F("total_amount") + amount)
+            # Keep the loaded invoice updated too
+            if invoice.is_cached(self):
+                getattr(self, invoice.name).total_amount += amount
 
 
 class CompanyClient(PersonModel):
     """Create a company's client"""
-    pass
+    class Meta:
+        # Documents are searched by the start of their client's name.
+        indexes = [
+            models.Index(fields=["name"], name="company_client_name_idx"),
+        ]
 
 class Supplier(PersonModel):
     """Create a company's supplier"""
@@ -79,10 +177,275 @@ class ClientCurrentAccount(CurrentAccountModel):
         blank=True, null=True)
     receipt = models.ForeignKey("SaleReceipt", on_delete=models.CASCADE,
         blank=True, null=True)
+
+    class Meta:
+        # Amount is included, so balances are summed without reading the table.
+        indexes = [
+            # Balances of a client up to a date
+            models.Index(fields=["client", "date", "amount"],
+                name="client_ca_client_date_idx"),
+            # Balances of all clients in a date range
+            models.Index(fields=["date", "client", "amount"],
+                name="client_ca_date_client_idx"),
+        ]
     
     def __str__(self):
         return f"{self.client}: $ {self.amount}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the saved client and date, so their snapshots are invalidated too
+        instance.saved_client_id = instance.__dict__.get("client_id")
+        instance.saved_date = instance.__dict__.get("date")
+        # Keep the saved values of the client's stats, so they're moved with changes
+        instance.saved_stats = instance.get_stats_values()
+        return instance
+
+    def get_stats_values(self):
+        """
+        Get the values that the client's stats are built from.
+        Returns:
+        - Tuple: (client id, it's an invoice, amount, date or None if it isn't
+        a document, as the opening movement)
+        """
+        is_document = (self.__dict__.get("invoice_id") is not None
+            or self.__dict__.get("receipt_id") is not None)
+        return (self.__dict__.get("client_id"),
+            self.__dict__.get("invoice_id") is not None,
+            self.__dict__.get("amount"),
+            self.__dict__.get("date") if is_document else None)
+
+
+class ClientBalanceSnapshot(models.Model):
+    """
+    Client's current account balance at the end of a month. Snapshots are
+    created when a balance is requested and deleted when a movement on or
+    before their date changes.
+    """
+    client = models.ForeignKey(CompanyClient, on_delete=models.CASCADE,
+        related_name="balance_snapshots")
+    date = models.DateField()
+    balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    # Number of current account movements up to the date
+    movements = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date", "client"],
+                name="unique_client_balance_snapshot"),
+        ]
+
+    def __str__(self):
+        return f"{self.client} {self.date}: $ {self.balance}"
+
+    @classmethod
+    def invalidate(cls, from_date, clients=None):
+        """
+        Delete the snapshots affected by a movement on from_date.
+        Parameters:
+        - from_date: Date of the created, edited or deleted movement.
+        - clients: Ids of the movements' clients. All clients if it's None.
+        """
+        snapshots = cls.objects.filter(date__gte=from_date)
+        if clients is not None:
+            snapshots = snapshots.filter(client__in=clients)
+        snapshots.delete()
+
+
+class ClientStats(models.Model):
+    """
+    Totals of a client's current account: sales, number of invoices, balance
+    and date of the last document. Rows are updated by the current account
+    signals and the importers, so clients are ranked by reading their indexes.
+    Clients get their row with their first document.
+    """
+    client = models.OneToOneField(CompanyClient, on_delete=models.CASCADE,
+        primary_key=True, related_name="stats")
+    total_sales = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    transactions = models.IntegerField(default=0)
+    balance = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    last_activity = models.DateField(blank=True, null=True)
+
+    class Meta:
+        # Client is the tie breaker, so rankings can be paginated by keyset.
+        indexes = [
+            models.Index(fields=["-total_sales", "client"],
+                name="client_stats_sales_idx"),
+            models.Index(fields=["-transactions", "client"],
+                name="client_stats_transactions_idx"),
+            models.Index(fields=["-balance", "client"],
+                name="client_stats_balance_idx"),
+            models.Index(fields=["-last_activity", "client"],
+                name="client_stats_activity_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.client_id}: $ {self.total_sales}"
+
+    @classmethod
+    def add(cls, changes):
+        """
+        Add current account movements to the stats of their clients, or
+        subtract them.
+        Parameters:
+        - changes: List of (movement stats values, 1 or -1), as
+        ClientCurrentAccount.get_stats_values.
+        """
+        cls.add_totals(cls.sum_changes(changes))
+
+    @classmethod
+    def sum_changes(cls, changes, totals=None):
+        """
+        Sum movements by client, so they're added with a query per file.
+        Parameters:
+        - changes: List of (movement stats values, 1 or -1).
+        - totals: Totals to add the changes to, as returned by this method.
+        Returns:
+        - Dict: {client id: {total_sales, transactions, balance, last_activity,
+        removed}}. Removed is the latest date of their removed documents.
+        """
+        to_decimal = cls._meta.get_field("balance").to_python
+        to_date = cls._meta.get_field("last_activity").to_python
+        totals = {} if totals is None else totals
+        for (client_id, is_invoice, amount, date), sign in changes:
+            client_totals = totals.setdefault(client_id, {"total_sales": Decimal(0),
+                "transactions": 0, "balance": Decimal(0), "last_activity": None,
+                "removed": None})
+            amount = sign * to_decimal(amount or 0)
+            client_totals["balance"] += amount
+            if is_invoice:
+                client_totals["total_sales"] += amount
+                client_totals["transactions"] += sign
+            if date is None:
+                continue
+            field = "last_activity" if sign > 0 else "removed"
+            date = to_date(date)
+            client_totals[field] = max(date, client_totals[field] or date)
+        return totals
+
+    @classmethod
+    def add_totals(cls, totals):
+        """
+        Add the totals of sum_changes to the stats. Clients without documents,
+        as the ones just created, don't get a row.
+        """
+        removed = {client_id: client_totals.pop("removed")
+            for client_id, client_totals in totals.items()}
+        removed = {client_id: date for client_id, date in removed.items() if date}
+        totals = {client_id: client_totals for client_id, client_totals
+            in totals.items() if any(client_totals.values())}
+
+        if len(totals) == 1:
+            # Single changes are added in the DB, as they come from signals.
+            client_id, client_totals = next(iter(totals.items()))
+            last_activity = client_totals.pop("last_activity")
+            # Amounts are rounded, so they're equal to the values of keyset cursors.
+            updates = {field: Round(F(field) + value, 2) if field != "transactions"
+                else F(field) + value for field, value in client_totals.items()}
+            if last_activity is not None:
+                updates["last_activity"] = Greatest(
+                    Coalesce("last_activity", models.Value(last_activity)),
+                    models.Value(last_activity))
+            updated = cls.objects.filter(client=client_id).update(**updates)
+            if not updated:
+                try:
+                    # In a savepoint, as other process could create the row first
+                    with transaction.atomic():
+                        cls.objects.create(client_id=client_id, **client_totals,
+                            last_activity=last_activity)
+                except IntegrityError:
+                    cls.objects.filter(client=client_id).update(**updates)
+        elif totals:
+            # Changes of a file are added to the existing stats in bulk.
+            existing = cls.objects.in_bulk(totals.keys())
+            new_totals = {}
+            for client_id, client_totals in totals.items():
+                row = existing.get(client_id)
+                if row is None:
+                    new_totals[client_id] = client_totals
+                    continue
+                for field in ["total_sales", "transactions", "balance"]:
+                    setattr(row, field, getattr(row, field) + client_totals[field])
+                if client_totals["last_activity"] is not None:
+                    row.last_activity = max(client_totals["last_activity"],
+                        row.last_activity or client_totals["last_activity"])
+            cls.objects.bulk_update(existing.values(), ["total_sales",
+                "transactions", "balance", "last_activity"], batch_size=BATCH_SIZE)
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create([cls(client_id=client_id, **client_totals)
+                        for client_id, client_totals in new_totals.items()
+                    ], batch_size=BATCH_SIZE)
+            except IntegrityError:
+                # Other process created some rows meanwhile, so they're added
+                # one by one.
+                for client_id, client_totals in new_totals.items():
+                    cls.add_totals({client_id: client_totals | {"removed": None}})
+
+        if removed:
+            cls.update_last_activity(removed)
+
+    @classmethod
+    def update_last_activity(cls, removed):
+        """
+        Get again the last activity of clients whose latest document could be
+        removed. It's the first document of the client's movements by date.
+        Parameters:
+        - removed: Dict {client id: latest date of their removed documents}.
+        """
+        last_documents = ClientCurrentAccount.objects.filter(
+            Q(invoice__isnull=False) | Q(receipt__isnull=False),
+            client=OuterRef("client")).order_by("-date").values("date")[:1]
+        cls.objects.filter(reduce(or_, [
+            Q(client=client_id, last_activity__lte=date)
+            for client_id, date in removed.items()
+        ])).update(last_activity=Subquery(last_documents))
+
+    @classmethod
+    def move(cls, movements):
+        """
+        Move the values of movements saved with bulk_update from their saved
+        stats to the new ones.
+        """
+        changes = []
+        for movement in movements:
+            stats = movement.get_stats_values()
+            saved_stats = getattr(movement, "saved_stats", None)
+            if saved_stats == stats:
+                continue
+            if saved_stats is not None:
+                changes.append((saved_stats, -1))
+            changes.append((stats, 1))
+            movement.saved_stats = stats
+        cls.add(changes)
+
+    @classmethod
+    def rebuild(cls, clients=None):
+        """
+        Build again the stats from the saved current accounts.
+        Parameters:
+        - clients: Ids of the clients to build. All clients if it's None.
+        """
+        stats = cls.objects.all()
+        # Opening movements aren't documents and their amount is 0.
+        movements = ClientCurrentAccount.objects.exclude(invoice=None, receipt=None)
+        if clients is not None:
+            stats = stats.filter(client__in=clients)
+            movements = movements.filter(client__in=clients)
+        is_invoice = Q(invoice__isnull=False)
+        # Stats are never read half built.
+        with transaction.atomic():
+            stats.delete()
+            cls.objects.bulk_create([
+                cls(client_id=row.pop("client"), **row) for row in movements.values("client").annotate(
+                    total_sales=Coalesce(Sum("amount", filter=is_invoice), Decimal(0)),
+                    transactions=Count("id", filter=is_invoice),
+                    balance=Sum("amount"),
+                    last_activity=Max("date"),
+                ).order_by()
+            ], batch_size=BATCH_SIZE)
+
 
 class SupplierCurrentAccount(CurrentAccountModel):
     """Track suppliers's current account"""
@@ -107,9 +470,13 @@ class PointOfSell(models.Model):
     disabled = models.BooleanField(default=False)
 
     def save(self, *args, **kwargs):
+        self.format_fields()
+        return super(PointOfSell, self).save(*args, **kwargs)
+
+    def format_fields(self):
+        """Format fields before saving them"""
         # Fill numbers with 0
         self.pos_number = self.pos_number.zfill(5)
-        return super(PointOfSell, self).save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.pos_number}"
@@ -134,11 +501,14 @@ class DocumentType(models.Model):
         return f"{self.code} | {self.type}"
     
     def save(self, *args, **kwargs):
-        # Format fields
+        self.format_fields()
+        return super(DocumentType, self).save(*args, **kwargs)
+
+    def format_fields(self):
+        """Format fields before saving them"""
         self.code = self.code.zfill(3)
         self.type = self.type.upper()
         self.description = self.description.upper()
-        return super(DocumentType, self).save(*args, **kwargs)
 
 
 class PaymentMethod(models.Model):
@@ -164,7 +534,7 @@ class PaymentTerm(models.Model):
         return f"{self.pay_term} days"
 
 
-class SaleInvoice(CommercialDocumentModel):
+class SaleInvoice(InvoiceModel):
     """Create a sale invoice"""
     type = models.ForeignKey(DocumentType, on_delete=models.PROTECT)
     point_of_sell = models.ForeignKey(PointOfSell, on_delete=models.PROTECT)
@@ -174,27 +544,82 @@ class SaleInvoice(CommercialDocumentModel):
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.RESTRICT)
     payment_term = models.ForeignKey(PaymentTerm, on_delete=models.RESTRICT)
     collected = models.BooleanField(default=False)
+    # Updated by the receipts when they are saved or deleted
+    collected_amount = models.DecimalField(max_digits=15, decimal_places=2,
+        default=0)
+    outstanding_balance = models.GeneratedField(
+        expression=F("total_amount") - F("collected_amount"),
+        output_field=models.DecimalField(max_digits=15, decimal_places=2),
+        db_persist=True, db_index=True,
+    )
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=["point_of_sell", "number", "type"],
                 name="unique_sale_invoice_complete_number"),
         ]
+        # Complete numbers are searched with the unique constraint's index.
+        indexes = [
+            # Uncollected invoices are a small part of all invoices.
+            models.Index(fields=["issue_date"], condition=Q(collected=False),
+                name="sale_invoice_uncollected_idx"),
+            # Pages of the invoices list are read in its ordering.
+            models.Index(fields=["-issue_date", "type", "point_of_sell",
+                "-number"], name="sale_invoice_ordering_idx"),
+        ]
         ordering = ["-issue_date", "type", "point_of_sell", "-number" ]
 
+    derived_fields = ["total_amount", "collected_amount", "collected"]
+
     def get_absolute_url(self):
         """Get object webpage"""
         return reverse("erp:sales_invoice", args=[self.pk])
-    
-    def total_lines_sum(self):
-        """Get the sum of all invoice's line"""
-        total_sum = self.s_invoice_lines.aggregate(
-            lines_sum=Sum("total_amount")
-        )["lines_sum"]
-        return round(total_sum, 2)
+
+    @staticmethod
+    def get_receipts_total():
+        """Get the sum of the receipts of an invoice, as an expression of its query"""
+        return Coalesce(Subquery(
+            SaleReceipt.objects.filter(related_invoice=OuterRef("pk")).order_by(
+                ).values("related_invoice").annotate(total=Sum("total_amount")
+                ).values("total")
+        ), Decimal(0))
+
+    @classmethod
+    def get_collected_updates(cls, amount=None):
+        """
+        Get the expressions that add an amount to the collected amount of an
+        invoice and update its collected status, without aggregating receipts.
+        Without amount, the collected amount is calculated again from all the
+        receipts.
+        """
+        if amount is None:
+            receipts_total = cls.get_receipts_total()
+            return {
+                "collected_amount": receipts_total,
+                "collected": ExpressionWrapper(Q(total_amount=receipts_total),
+                    output_field=models.BooleanField()),
+            }
+        return {
+            "collected_amount": F("collected_amount") + amount,
+            # Expressions use the values before the update.
+            "collected": ExpressionWrapper(Q(outstanding_balance=amount),
+                output_field=models.BooleanField()),
+        }
+
+    def add_collected_amount(self, amount=None):
+        """
+        Add a receipt's amount to the amount collected of the invoice. Without
+        amount, it's calculated again from all its receipts.
+        """
+        SaleInvoice.objects.filter(pk=self.pk).update(
+            **self.get_collected_updates(amount))
+        self.refresh_from_db(fields=["collected_amount", "outstanding_balance",
+            "collected"])
     
     def update_current_account(self):
         """Update client's current account"""
+        # Get the total updated by the lines
+        self.refresh_from_db(fields=["total_amount"])
         ClientCurrentAccount.objects.update_or_create(
             invoice = self, defaults= {
                 "date": self.issue_date,
@@ -202,6 +627,42 @@ class SaleInvoice(CommercialDocumentModel):
                 "amount": self.total_lines_sum()
             }    
         )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the saved sales cube cell, so its totals are moved with changes
+        instance.saved_cube_key = instance.get_cube_key()
+        return instance
+
+    def get_cube_key(self):
+        """
+        Get the sales cube cell of the invoice.
+        Returns:
+        - Tuple: (issue date, client id, type id, POS id, payment method id)
+        """
+        return tuple(self.__dict__.get(field) for field in SALES_CUBE_FIELDS)
+
+    @classmethod
+    def bulk_update_current_accounts(cls, invoices):
+        """
+        Update the date and client of the current account movements of invoices
+        saved with bulk_update, with one query.
+        """
+        invoices = {invoice.pk: invoice for invoice in invoices}
+        movements = list(ClientCurrentAccount.objects.filter(
+            invoice__in=invoices.keys()))
+        dates = [movement.date for movement in movements]
+        for movement in movements:
+            movement.date = invoices[movement.invoice_id].issue_date
+            movement.client_id = invoices[movement.invoice_id].recipient_id
+            dates.append(movement.date)
+        ClientCurrentAccount.objects.bulk_update(movements, ["date", "client"],
+            batch_size=BATCH_SIZE)
+        # Signals aren't sent by bulk_update.
+        if dates:
+            ClientBalanceSnapshot.invalidate(min(dates))
+        ClientStats.move(movements)
       
     def __str__(self):
         return f"{self.type.type} {self.point_of_sell}-{self.number}"
@@ -217,6 +678,19 @@ class SaleInvoiceLine(CommercialDocumentLineModel):
     """Product/service detail of the sale invoice"""
     sale_invoice = models.ForeignKey(SaleInvoice, on_delete=models.CASCADE,
         related_name="s_invoice_lines")
+    invoice_field = "sale_invoice"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the saved invoice and amounts, so the sales cube is updated
+        instance.saved_cube_values = instance.get_cube_values()
+        return instance
+
+    def get_cube_values(self):
+        """Get the invoice and the amounts that the line adds to the sales cube"""
+        return (self.__dict__.get("sale_invoice_id"),
+            *[self.__dict__.get(field) for field in SALES_CUBE_AMOUNTS])
 
 class SaleReceipt(CommercialDocumentModel):
     """Create a sale receipt"""
@@ -235,8 +709,31 @@ class SaleReceipt(CommercialDocumentModel):
                 name="unique_sale_receipt_complete_number"
             ),
         ]
+        # Receipts of an invoice are summed without reading the table.
+        indexes = [
+            models.Index(fields=["related_invoice", "total_amount"],
+                name="sale_receipt_invoice_idx"),
+            # Pages of the receipts list are read in its ordering.
+            models.Index(fields=["-issue_date", "point_of_sell", "-number"],
+                name="sale_receipt_ordering_idx"),
+        ]
         ordering = ["-issue_date", "point_of_sell", "-number"]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the saved invoice and amount, so they are updated with the changes
+        instance.saved_related_invoice_id = instance.__dict__.get("related_invoice_id")
+        instance.saved_total_amount = instance.__dict__.get("total_amount")
+        # Keep the saved summary row and amount, so the summaries are updated
+        instance.saved_summary = instance.get_summary_values()
+        return instance
+
+    def get_summary_values(self):
+        """Get the values that the receipts summary is built from"""
+        return (self.__dict__.get("issue_date"),
+            self.__dict__.get("point_of_sell_id"), self.__dict__.get("total_amount"))
+
     def get_absolute_url(self):
         """Get object webpage"""
         return reverse("erp:receivables_receipt", args=[self.pk])
@@ -252,7 +749,282 @@ class SaleReceipt(CommercialDocumentModel):
         validate_not_disabled_pos(self)
 
 
-class PurchaseInvoice(CommercialDocumentModel):
+class SaleReceiptSummary(models.Model):
+    """
+    Count and total amount of the sale receipts of a month and point of sell.
+    Rows are updated by the receipt signals and the receipts importer, so the
+    overview reads them instead of every receipt.
+    """
+    # First day of the month
+    month = models.DateField()
+    point_of_sell = models.ForeignKey(PointOfSell, on_delete=models.CASCADE,
+        related_name="receipt_summaries")
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["month", "point_of_sell"],
+                name="unique_sale_receipt_summary"),
+        ]
+        ordering = ["month", "point_of_sell"]
+
+    def __str__(self):
+        return f"{self.month:%m/%Y} {self.point_of_sell}: {self.count} receipts"
+
+    @classmethod
+    def add(cls, changes):
+        """
+        Add receipts to the summaries, or subtract them.
+        Parameters:
+        - changes: List of ((issue date, POS id, total amount), 1 or -1).
+        """
+        # Values of receipts not saved yet could be strings.
+        to_date = cls._meta.get_field("month").to_python
+        to_decimal = cls._meta.get_field("total_amount").to_python
+        rows = {}
+        for (issue_date, pos_id, total_amount), sign in changes:
+            key = (to_date(issue_date).replace(day=1), pos_id)
+            count, total = rows.get(key, (0, Decimal(0)))
+            rows[key] = (count + sign, total + sign * to_decimal(total_amount))
+
+        for (month, pos_id), (count, total) in rows.items():
+            if not count and not total:
+                continue
+            summary = cls.objects.filter(month=month, point_of_sell=pos_id)
+            updates = {"count": F("count") + count,
+                "total_amount": F("total_amount") + total}
+            updated = summary.update(**updates)
+            if not updated:
+                try:
+                    # In a savepoint, as other process could create the row first
+                    with transaction.atomic():
+                        cls.objects.create(month=month, point_of_sell_id=pos_id,
+                            count=count, total_amount=total)
+                except IntegrityError:
+                    summary.update(**updates)
+            elif count < 0:
+                # Rows left without receipts are deleted, as rebuild does.
+                cls.objects.filter(month=month, point_of_sell=pos_id,
+                    count=0).delete()
+
+    @classmethod
+    def rebuild(cls, month=None):
+        """
+        Build again the summaries from the saved receipts.
+        Parameters:
+        - month: Date of the month of the summaries to build. All months if it's
+        None.
+        """
+        summaries = cls.objects.all()
+        receipts = SaleReceipt.objects.all()
+        if month is not None:
+            month = cls._meta.get_field("month").to_python(month)
+            summaries = summaries.filter(month=month.replace(day=1))
+            receipts = receipts.filter(issue_date__year=month.year,
+                issue_date__month=month.month)
+        # Summaries are never read half built.
+        with transaction.atomic():
+            summaries.delete()
+            cls.objects.bulk_create([
+                cls(month=row["month"], point_of_sell_id=row["point_of_sell"],
+                    count=row["count"], total_amount=row["total_amount"])
+                for row in receipts.annotate(
+                    month=TruncMonth("issue_date")).values("month", "point_of_sell"
+                    ).annotate(count=Count("id"), total_amount=Sum("total_amount")
+                    ).order_by()
+            ], batch_size=BATCH_SIZE)
+
+
+class SalesCube(models.Model):
+    """
+    Monthly totals of the sale invoices lines of each client, doc type, point of
+    sell and payment method. Rows are updated by the invoices and lines signals
+    and by the invoices importer, so sales are summed without reading lines.
+    """
+    # First day of the month
+    month = models.DateField()
+    client = models.ForeignKey(CompanyClient, on_delete=models.CASCADE,
+        related_name="sales_cube")
+    type = models.ForeignKey(DocumentType, on_delete=models.CASCADE,
+        related_name="sales_cube")
+    point_of_sell = models.ForeignKey(PointOfSell, on_delete=models.CASCADE,
+        related_name="sales_cube")
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE,
+        related_name="sales_cube")
+    invoices = models.IntegerField(default=0)
+    taxable_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    not_taxable_amount = models.DecimalField(max_digits=17, decimal_places=2,
+        default=0)
+    vat_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["month", "client", "type",
+                "point_of_sell", "payment_method"], name="unique_sales_cube_cell"),
+        ]
+        indexes = [
+            # Sales of a client by month
+            models.Index(fields=["client", "month"], name="sales_cube_client_idx"),
+        ]
+
+    # Attributes of the cube keys, after the month
+    cube_dimensions = ["client_id", "type_id", "point_of_sell_id",
+        "payment_method_id"]
+
+    def __str__(self):
+        return f"{self.month:%m/%Y} {self.client_id}: $ {self.total_amount}"
+
+    @classmethod
+    def add(cls, changes):
+        """
+        Add invoices and amounts to the cells of the cube, or subtract them.
+        Parameters:
+        - changes: List of (invoice cube key, invoices, {amount field: amount}).
+        """
+        cls.add_cells(cls.sum_changes(changes))
+
+    @classmethod
+    def sum_changes(cls, changes, cells=None):
+        """
+        Sum changes by cell, so they're added with a query per file.
+        Parameters:
+        - changes: List of (invoice cube key, invoices, {amount field: amount}).
+        - cells: Cells to add the changes to, as returned by this method.
+        Returns:
+        - Dict: {(month, *dimensions): {invoices, amount fields}}
+        """
+        to_date = cls._meta.get_field("month").to_python
+        cells = {} if cells is None else cells
+        for key, invoices, amounts in changes:
+            issue_date, *dimensions = key
+            cell = (to_date(issue_date).replace(day=1), *dimensions)
+            totals = cells.setdefault(cell, dict.fromkeys(SALES_CUBE_AMOUNTS,
+                Decimal(0)) | {"invoices": 0})
+            totals["invoices"] += invoices
+            for field, amount in amounts.items():
+                totals[field] += cls._meta.get_field(field).to_python(amount or 0)
+        return cells
+
+    @classmethod
+    def add_cells(cls, cells):
+        """Add the totals of sum_changes to the cells of the cube"""
+        cells = {
+            (month, *dimensions): totals for (month, *dimensions), totals
+            in cells.items() if any(totals.values())
+        }
+        if len(cells) == 1:
+            # Single changes are added in the DB, as they come from signals.
+            (month, *dimensions), totals = next(iter(cells.items()))
+            cell = {"month": month, **dict(zip(cls.cube_dimensions, dimensions))}
+            updates = {field: F(field) + value for field, value in totals.items()}
+            updated = cls.objects.filter(**cell).update(**updates)
+            if not updated:
+                try:
+                    # In a savepoint, as other process could create the cell first
+                    with transaction.atomic():
+                        cls.objects.create(**cell, **totals)
+                except IntegrityError:
+                    cls.objects.filter(**cell).update(**updates)
+        elif cells:
+            # Changes of a file are added to the existing cells in bulk.
+            existing = cls.objects.filter(reduce(or_, [
+                Q(month=month, **dict(zip(cls.cube_dimensions, dimensions)))
+                for month, *dimensions in cells
+            ]))
+            existing = {(row.month, *[getattr(row, field)
+                for field in cls.cube_dimensions]): row for row in existing}
+            new_cells = {}
+            for key, totals in cells.items():
+                row = existing.get(key)
+                if row is None:
+                    new_cells[key] = totals
+                    continue
+                for field, value in totals.items():
+                    setattr(row, field, getattr(row, field) + value)
+            cls.objects.bulk_update(existing.values(), ["invoices",
+                *SALES_CUBE_AMOUNTS], batch_size=BATCH_SIZE)
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create([cls(month=month, **dict(zip(
+                        cls.cube_dimensions, dimensions)), **totals)
+                        for (month, *dimensions), totals in new_cells.items()
+                    ], batch_size=BATCH_SIZE)
+            except IntegrityError:
+                # Other process created some cells meanwhile, so they're added
+                # one by one.
+                for key, totals in new_cells.items():
+                    cls.add_cells({key: totals})
+
+    @classmethod
+    def move_invoices(cls, invoices):
+        """
+        Move the totals of invoices whose cube cell changed from their saved
+        cell, with one query for all their lines.
+        """
+        moved = {invoice.pk: invoice for invoice in invoices
+            if getattr(invoice, "saved_cube_key", None) is not None
+            and invoice.saved_cube_key != invoice.get_cube_key()}
+        if not moved:
+            return
+        totals = {row["sale_invoice"]: row for row in SaleInvoiceLine.objects.filter(
+            sale_invoice__in=moved.keys()).values("sale_invoice").annotate(
+                **{field: Sum(field) for field in SALES_CUBE_AMOUNTS}).order_by()}
+        changes = []
+        for pk, invoice in moved.items():
+            amounts = {field: totals.get(pk, {}).get(field) or 0
+                for field in SALES_CUBE_AMOUNTS}
+            changes.append((invoice.saved_cube_key, -1,
+                {field: -amount for field, amount in amounts.items()}))
+            changes.append((invoice.get_cube_key(), 1, amounts))
+            invoice.saved_cube_key = invoice.get_cube_key()
+        cls.add(changes)
+
+    @classmethod
+    def rebuild(cls, month=None, client=None):
+        """
+        Build again the cells of the cube from the saved invoices and lines.
+        Parameters:
+        - month: Date of the month of the cells to build. All months if it's None.
+        - client: Id of the client of the cells to build. All clients if it's None.
+        """
+        cells_filter = {}
+        invoices_filter = {}
+        if month is not None:
+            month = cls._meta.get_field("month").to_python(month)
+            cells_filter["month"] = month.replace(day=1)
+            invoices_filter.update(issue_date__year=month.year,
+                issue_date__month=month.month)
+        if client is not None:
+            cells_filter["client"] = client
+            invoices_filter["recipient"] = client
+        dimensions = ["recipient", "type", "point_of_sell", "payment_method"]
+        cells = {}
+        for row in SaleInvoice.objects.filter(**invoices_filter).annotate(
+            month=TruncMonth("issue_date")).values("month", *dimensions).annotate(
+            invoices=Count("id")).order_by():
+            cells[(row.pop("month"), *[row.pop(field) for field in dimensions])] = row
+        for row in SaleInvoiceLine.objects.filter(**{f"sale_invoice__{lookup}": value
+            for lookup, value in invoices_filter.items()}).annotate(
+            month=TruncMonth("sale_invoice__issue_date")).values("month", *[
+                f"sale_invoice__{field}" for field in dimensions]).annotate(
+            **{field: Sum(field) for field in SALES_CUBE_AMOUNTS}).order_by():
+            key = (row.pop("month"), *[row.pop(f"sale_invoice__{field}")
+                for field in dimensions])
+            cells[key].update(row)
+        # Cells are never read half built.
+        with transaction.atomic():
+            cls.objects.filter(**cells_filter).delete()
+            cls.objects.bulk_create([
+                cls(month=month, client_id=client, type_id=doc_type,
+                    point_of_sell_id=pos, payment_method_id=pay_method, **totals)
+                for (month, client, doc_type, pos, pay_method), totals
+                in cells.items()
+            ], batch_size=BATCH_SIZE)
+
+
+class PurchaseInvoice(InvoiceModel):
     """Record a purchase invoice"""
     # POS is different from Sale invoice, as dif suppliers have dif POS.
     type = models.ForeignKey(DocumentType, on_delete=models.PROTECT)
@@ -278,6 +1050,7 @@ class PurchaseInvoiceLine(CommercialDocumentLineModel):
     """Product/service detail of the purchase invoice"""
     purchase_invoice = models.ForeignKey(PurchaseInvoice, on_delete=models.CASCADE,
         related_name="p_invoice_lines")
+    invoice_field = "purchase_invoice"
 
 
 class PurchaseReceipt(CommercialDocumentModel):
@@ -303,3 +1076,93 @@ class PurchaseReceipt(CommercialDocumentModel):
     
     def __str__(self):
         return f"{self.point_of_sell}-{self.number}"
+
+
+class ImportJob(models.Model):
+    """Massive upload of a file that is imported in background"""
+    KINDS = [
+        ("client", "Clients"),
+        ("supplier", "Suppliers"),
+        ("sale_invoice", "Sale invoices"),
+        ("sale_receipt", "Sale receipts"),
+    ]
+    STATUSES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    kind = models.CharField(max_length=12, choices=KINDS)
+    file = models.FileField(upload_to="import_jobs/", validators=[
+        validate_file_extension
+    ])
+    status = models.CharField(max_length=7, choices=STATUSES, default="pending")
+    # Rows of the file committed in the DB
+    rows_processed = models.PositiveIntegerField(default=0)
+    errors = models.TextField(blank=True)
+    # Host and process id of the process that runs the job
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Heartbeat of the job, updated while it's waiting or running
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} | {self.status}"
+
+    def throughput(self):
+        """Get the processed rows per second"""
+        if not self.started_at:
+            return 0
+        seconds = ((self.finished_at or timezone.now()) - self.started_at
+            ).total_seconds()
+        return round(self.rows_processed / seconds, 2) if seconds else 0
+
+
+class TableVersion(models.Model):
+    """
+    Version of a model's table, increased every time its rows are saved or
+    deleted. Responses built from the table are valid while it doesn't change.
+    Versions are read from the DB, so a change made by any process is seen by
+    the others. It's one indexed query, cheaper than building the response.
+    """
+    table = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} | {self.version}"
+
+    @classmethod
+    def bump(cls, *models):
+        """Increase the version of the tables of some models with one query"""
+        tables = {model._meta.label_lower for model in models}
+        now = timezone.now()
+        updated = cls.objects.filter(table__in=tables).update(
+            version=F("version") + 1, modified_at=now)
+        if updated < len(tables):
+            # Tables without version yet. The existing ones are ignored.
+            cls.objects.bulk_create([
+                cls(table=table, version=1, modified_at=now) for table in tables
+            ], ignore_conflicts=True)
+
+    @classmethod
+    def get_state(cls, *models):
+        """
+        Get the versions of the tables of some models with one query.
+        Returns:
+        - Tuple: (versions joined in models order, last modification or None)
+        """
+        tables = [model._meta.label_lower for model in models]
+        saved = {version.table: (version.version, version.modified_at)
+            for version in cls.objects.filter(table__in=tables)}
+        # {table: (version, modified_at)}, tables without version yet are 0.
+        versions = {table: saved.get(table, (0, None)) for table in tables}
+        etag = "-".join(str(versions[table][0]) for table in tables)
+        last_modified = max((modified_at for _, modified_at in versions.values()
+            if modified_at is not None), default=None)
+        return etag, last_modified
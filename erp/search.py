@@ -0,0 +1,97 @@
+"""Full-text search index of clients and suppliers"""
+import re
+from django.db import connection
+from django.db.models import Case, Q, When
+
+
+# Columns of the index and their weight in the rank
+SEARCH_COLUMNS = (("name", 10.0), ("address", 1.0), ("tax_number", 5.0))
+# Max number of persons returned by a search
+MAX_RESULTS = 50
+# Shorter words match most persons, so they are not searched
+MIN_TERM_LENGTH = 2
+
+
+def get_search_table(model):
+    """Get the name of the search index table of a person model"""
+    return f"{model._meta.db_table}_search"
+
+def has_search_index():
+    """Check if the DB supports the FTS5 index. Other DBs search with LIKE."""
+    return connection.vendor == "sqlite"
+
+def rebuild_search_index(model):
+    """Index again all the persons of a model"""
+    columns = ", ".join(column for column, _ in SEARCH_COLUMNS)
+    table = get_search_table(model)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(
+            f"INSERT INTO {table} (rowid, {columns}) "
+            f"SELECT id, {columns} FROM {model._meta.db_table}"
+        )
+
+def index_persons(model, persons):
+    """Add or replace persons in the search index of their model"""
+    if not has_search_index() or not persons:
+        return
+    columns = [column for column, _ in SEARCH_COLUMNS]
+    table = get_search_table(model)
+    with connection.cursor() as cursor:
+        # Persons are replaced by their rowid, which is their pk.
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {table} (rowid, {', '.join(columns)}) "
+            f"VALUES (%s{', %s' * len(columns)})",
+            [
+                [person.pk] + [getattr(person, column) for column in columns]
+                for person in persons
+            ]
+        )
+
+def unindex_persons(model, pks):
+    """Remove persons from the search index of their model"""
+    if not has_search_index() or not pks:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {get_search_table(model)} "
+            f"WHERE rowid IN ({', '.join(['%s'] * len(pks))})", list(pks)
+        )
+
+def get_search_terms(query):
+    """Get the words of a search, without the characters used by FTS5 queries"""
+    return [term for term in re.findall(r"\w+", query)
+        if len(term) >= MIN_TERM_LENGTH]
+
+def search_persons(model, query, limit=MAX_RESULTS):
+    """
+    Search persons whose name, address or tax number have words starting with
+    every word of the query. Matches in the name are ranked first.
+    Returns:
+    - Queryset of persons, ordered by rank.
+    """
+    terms = get_search_terms(query)
+    if not terms:
+        return model.objects.none()
+
+    if not has_search_index():
+        search = Q()
+        for term in terms:
+            search &= (Q(name__icontains=term) | Q(address__icontains=term) |
+                Q(tax_number__startswith=term))
+        return model.objects.filter(search).order_by("name")[:limit]
+
+    match = " ".join(f'"{term}"*' for term in terms)
+    weights = ", ".join(str(weight) for _, weight in SEARCH_COLUMNS)
+    table = get_search_table(model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH %s "
+            f"ORDER BY bm25({table}, {weights}) LIMIT %s", [match, limit]
+        )
+        pks = [row[0] for row in cursor.fetchall()]
+    if not pks:
+        return model.objects.none()
+    # Keep the rank of the index
+    rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(pks)])
+    return model.objects.filter(pk__in=pks).order_by(rank)
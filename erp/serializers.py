@@ -1,37 +1,63 @@
 """Serializers for ERP app"""
+from functools import lru_cache
 from rest_framework import serializers
 
-from company.models import Company
+from company.utils import get_company
 from .models import (CompanyClient, Supplier, PaymentMethod, PaymentTerm,
-    PointOfSell, DocumentType, SaleInvoice, SaleReceipt)
+    PointOfSell, DocumentType, SaleInvoice, SaleReceipt, ImportJob, ClientStats)
+
+
+# Max number of field combinations whose serializer class is kept
+DYNAMIC_SERIALIZERS_CACHE_SIZE = 256
+
 
 class baseDynamicSerializer(serializers.ModelSerializer):
     """Create a dynamic serializer model where it only adds the 
-    fields I need of each instance.
+    fields I need of each instance. Use get_dynamic_serializer to get the
+    serializer class of a list of fields.
     """
     display_name = serializers.SerializerMethodField()
 
-    def __init__(self, *args, **kwargs):
-        
-        # Delete fields in case then I have another parameter
-        fields = kwargs.pop('fields', None)
-
-        super(baseDynamicSerializer, self).__init__(*args, **kwargs)
-        
-        # Add fields in Meta class
-        if fields is not None:
-            self.Meta.fields = fields
-
     def get_display_name(self, instance):
         return str(instance)
 
+@lru_cache(maxsize=DYNAMIC_SERIALIZERS_CACHE_SIZE)
+def build_dynamic_serializer(serializer_class, fields):
+    """
+    Build a subclass of a dynamic serializer with its own Meta, so the shared
+    Meta is never changed. Classes are cached by (serializer, fields).
+    Parameters:
+    - fields: Tuple of valid field names.
+    """
+    meta = type("Meta", (serializer_class.Meta,), {"fields": list(fields)})
+    return type(serializer_class.__name__, (serializer_class,), {"Meta": meta})
+
+def get_dynamic_serializer(serializer_class, fields):
+    """
+    Get the cached serializer class that only has the picked fields.
+    Parameters:
+    - fields: List of field names, as requested in the query params.
+    Returns:
+    - Serializer class.
+    """
+    # Same fields in the same order share the class
+    fields = tuple(dict.fromkeys(field.strip() for field in fields if field.strip()))
+    model = serializer_class.Meta.model
+    valid_fields = {field.name for field in model._meta.get_fields()} | set(
+        serializer_class._declared_fields)
+    wrong_fields = [field for field in fields if field not in valid_fields]
+    if wrong_fields or not fields:
+        raise serializers.ValidationError(
+            {"fields": f"Invalid fields: {', '.join(wrong_fields) or '(empty)'}."})
+    return build_dynamic_serializer(serializer_class, fields)
+
 class CClientSerializer(serializers.ModelSerializer):
     class Meta:
         model = CompanyClient
         fields = "__all__"
 
     def validate_tax_number(self, value):
-        company = Company.objects.only("tax_number").first()
+        company = get_company()
         
         if value == company.tax_number:
             raise serializers.ValidationError(
@@ -53,7 +79,7 @@ class SupplierSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
     def validate_tax_number(self, value):
-        company = Company.objects.only("tax_number").first()
+        company = get_company()
         
         if value == company.tax_number:
             raise serializers.ValidationError(
@@ -108,6 +134,8 @@ class SaleInvoicesSerializer(serializers.ModelSerializer):
     class Meta:
         model = SaleInvoice
         fields = "__all__"
+        # Amounts and status are updated by the invoice's lines and receipts
+        read_only_fields = ["total_amount", "collected_amount", "collected"]
 
     def get_display_name(self, instance):
         return str(instance)
@@ -131,4 +159,100 @@ class SaleReceiptsDynamicSerializer(baseDynamicSerializer):
     """
     class Meta:
         model = SaleReceipt
-        fields = []
\ No newline at end of file
+        fields = []
+
+class SaleInvoiceSearchSerializer(serializers.ModelSerializer):
+    """
+    Serialize sale invoices with their related fields flattened, as the search
+    page shows them. Related objects must be got with select_related.
+    """
+    type = serializers.CharField(source="type.type")
+    point_of_sell = serializers.CharField(source="point_of_sell.pos_number")
+    recipient = serializers.CharField(source="recipient.tax_number")
+    recipient_name = serializers.CharField(source="recipient.name")
+    display_name = serializers.CharField(source="__str__")
+
+    class Meta:
+        model = SaleInvoice
+        fields = ["id", "issue_date", "type", "point_of_sell", "number",
+            "recipient", "recipient_name", "collected", "display_name"]
+
+class SaleReceiptSearchSerializer(serializers.ModelSerializer):
+    """
+    Serialize sale receipts with their related fields flattened, as the search
+    page shows them. Related objects must be got with select_related.
+    """
+    point_of_sell = serializers.CharField(source="point_of_sell.pos_number")
+    recipient = serializers.CharField(source="recipient.tax_number")
+    recipient_name = serializers.CharField(source="recipient.name")
+    related_invoice_info = serializers.CharField(source="related_invoice.__str__")
+    display_name = serializers.CharField(source="__str__")
+
+    class Meta:
+        model = SaleReceipt
+        fields = ["id", "issue_date", "point_of_sell", "number", "recipient",
+            "recipient_name", "related_invoice", "related_invoice_info",
+            "display_name"]
+
+class SaleInvoiceLineBatchSerializer(serializers.Serializer):
+    """Check the structure of a line of an invoice created in a batch"""
+    description = serializers.CharField(max_length=280)
+    taxable_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    not_taxable_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    vat_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+
+class SaleInvoiceBatchSerializer(serializers.Serializer):
+    """
+    Check the structure of an invoice created in a batch, with its lines. Related
+    fields are the values of the import files, I.E. codes and tax numbers, and
+    they are checked by the importer.
+    """
+    issue_date = serializers.DateField()
+    type = serializers.CharField(max_length=3, help_text="Document type code.")
+    point_of_sell = serializers.CharField(max_length=5)
+    number = serializers.CharField(max_length=8)
+    sender = serializers.CharField(max_length=11, required=False,
+        help_text="Company tax number. By default, the company's.")
+    recipient = serializers.CharField(max_length=11, help_text="Client tax number.")
+    payment_method = serializers.CharField(max_length=50)
+    payment_term = serializers.CharField(max_length=3)
+    lines = SaleInvoiceLineBatchSerializer(many=True, allow_empty=False)
+
+
+class ClientStatsSerializer(serializers.ModelSerializer):
+    """
+    Serialize the stats of clients with their names and tax numbers. Clients
+    must be got with select_related.
+    """
+    tax_number = serializers.CharField(source="client.tax_number")
+    name = serializers.CharField(source="client.name")
+
+    class Meta:
+        model = ClientStats
+        fields = ["client", "tax_number", "name", "total_sales", "transactions",
+            "balance", "last_activity"]
+
+class SalesCubeSerializer(serializers.Serializer):
+    """Sums of the sales cube. Only the grouped dimensions are shown."""
+    year = serializers.IntegerField(required=False)
+    month = serializers.DateField(required=False)
+    client = serializers.IntegerField(required=False)
+    type = serializers.IntegerField(required=False)
+    point_of_sell = serializers.IntegerField(required=False)
+    payment_method = serializers.IntegerField(required=False)
+    invoices = serializers.IntegerField()
+    taxable_amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+    not_taxable_amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+    vat_amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+    total_amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    throughput = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ["id", "kind", "file", "status", "rows_processed", "errors",
+            "throughput", "created_at", "started_at", "finished_at"]
+        read_only_fields = ["status", "rows_processed", "errors", "created_at",
+            "started_at", "finished_at"]
+        extra_kwargs = {"file": {"write_only": True}}
@@ -1,5 +1,271 @@
-# services.py
-from django.db.models import Sum
-from .models import SaleInvoice, SaleReceipt
+"""Services that build the data of the overview pages"""
+from dateutil.relativedelta import relativedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.core.cache import cache
+from django.db.models import (Case, CharField, Count, F, Q, Sum, Value, When,
+    Window)
+from django.db.models.functions import ExtractYear, RowNumber
 
-# TODO
\ No newline at end of file
+from .models import (SaleInvoice, SaleReceipt, CompanyClient, PointOfSell,
+    DocumentType, TableVersion, SaleReceiptSummary, SalesCube, ClientStats,
+    SALES_CUBE_AMOUNTS)
+from .utils import get_clients_balance, get_financial_calendar_dates
+
+
+# Tables whose changes invalidate the cached dashboards
+DASHBOARD_MODELS = [SaleInvoice, SaleReceipt, CompanyClient, PointOfSell,
+    DocumentType]
+DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Number of documents of each top list
+TOP_DOCUMENTS = 10
+# {list name: (only uncollected invoices, ordering)}
+TOP_LISTS = {
+    "by_date": (False, [F("issue_date").desc()]),
+    "by_amount": (False, [F("total_amount").desc(), F("issue_date").desc()]),
+    "by_uncollected_newest": (True, [F("issue_date").desc()]),
+    "by_uncollected_oldest": (True, [F("issue_date").asc()]),
+}
+RECEIPT_TOP_LISTS = {
+    "by_date": (False, [F("issue_date").desc()]),
+    "by_amount": (False, [F("total_amount").desc(), F("issue_date").desc()]),
+}
+CUTOFF_STATUSES = ["current", "previous"]
+# Rankings of the clients stats: {name: (ordering of its index, filter)}
+CLIENT_RANKINGS = {
+    "sales": (["-total_sales", "client"], Q(transactions__gt=0)),
+    "transactions": (["-transactions", "client"], Q(transactions__gt=0)),
+    "balance": (["-balance", "client"], Q()),
+    "activity": (["-last_activity", "client"], Q(last_activity__isnull=False)),
+}
+# Number of clients of each list of the clients overview
+TOP_CLIENTS = 10
+# Dimensions the sales cube can be grouped by: {name: expression or None if
+# it's a field of the cube}
+SALES_CUBE_DIMENSIONS = {
+    "year": ExtractYear("month"),
+    "month": None,
+    "client": None,
+    "type": None,
+    "point_of_sell": None,
+    "payment_method": None,
+}
+
+
+def get_sales_dashboard(year_type, financial_year):
+    """
+    Get the sales overview of the current and previous cutoff years. It's cached
+    until an invoice, receipt, client, POS or doc type is saved or deleted, as
+    the key has the versions of their tables, read from the DB.
+    Parameters:
+    - year_type: "financial" or "calendar".
+    - financial_year: Current financial year, as an int.
+    Returns:
+    - Tuple: (cutoff years as get_financial_calendar_dates,
+    {cutoff status: {count, count_uncollected, uncollected_amount, top lists}})
+    """
+    cutoff_years = get_financial_calendar_dates(year_type, financial_year)
+    versions, _ = TableVersion.get_state(*DASHBOARD_MODELS)
+    # Dates are in the key, as the closing date of the company can change.
+    key = "sales_dashboard:" + ":".join([year_type, str(financial_year)] + [
+        str(cutoff_date) for cutoff_year in cutoff_years
+        for cutoff_date in cutoff_year.values()] + [versions])
+
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = build_sales_dashboard(cutoff_years)
+        cache.set(key, dashboard, DASHBOARD_CACHE_TIMEOUT)
+    return cutoff_years, dashboard
+
+def build_sales_dashboard(cutoff_years):
+    """
+    Get the counts of both cutoff years with one grouped query, and their top
+    lists with one query that ranks the invoices with window functions.
+    """
+    periods = {
+        status: Q(issue_date__range=(cutoff_year["start"], cutoff_year["end"]))
+        for status, cutoff_year in zip(CUTOFF_STATUSES, cutoff_years)
+    }
+    invoices = SaleInvoice.objects.filter(reduce(or_, periods.values()))
+
+    counts = invoices.aggregate(**{
+        name: Count("id", filter=period) for status, period in periods.items()
+        for name, period in [
+            (f"{status}_count", period),
+            (f"{status}_uncollected", period & Q(collected=False)),
+        ]
+    })
+    dashboard = {
+        status: {
+            "count": counts[f"{status}_count"],
+            "count_uncollected": counts[f"{status}_uncollected"],
+            "uncollected_amount": sum(client["global_balance"]
+                for client in get_clients_balance(cutoff_year["end"])),
+        } for status, cutoff_year in zip(CUTOFF_STATUSES, cutoff_years)
+    }
+
+    top_documents = get_top_documents(
+        invoices.select_related("type", "point_of_sell"), periods, TOP_LISTS)
+    for status in CUTOFF_STATUSES:
+        dashboard[status].update(top_documents[status])
+    return dashboard
+
+def get_receivables_dashboard(year_type, financial_year):
+    """
+    Get the receivables overview of the current and previous cutoff years.
+    Counts and totals are read from the receipts summaries by month.
+    Parameters:
+    - year_type: "financial" or "calendar".
+    - financial_year: Current financial year, as an int.
+    Returns:
+    - Tuple: (cutoff years as get_financial_calendar_dates,
+    {cutoff status: {count, total_amount, accumulated_amount, top lists}})
+    """
+    cutoff_years = get_financial_calendar_dates(year_type, financial_year)
+    months = list(SaleReceiptSummary.objects.values("month").annotate(
+        count=Sum("count"), total_amount=Sum("total_amount")).order_by("month"))
+
+    periods = {
+        status: Q(issue_date__range=(cutoff_year["start"], cutoff_year["end"]))
+        for status, cutoff_year in zip(CUTOFF_STATUSES, cutoff_years)
+    }
+    top_documents = get_top_documents(
+        SaleReceipt.objects.select_related("point_of_sell").filter(
+            reduce(or_, periods.values())), periods, RECEIPT_TOP_LISTS)
+
+    dashboard = {}
+    for status, cutoff_year in zip(CUTOFF_STATUSES, cutoff_years):
+        count, total_amount = sum_receipts(months, cutoff_year["start"],
+            cutoff_year["end"])
+        dashboard[status] = {
+            "count": count,
+            "total_amount": total_amount,
+            "accumulated_amount": sum_receipts(months, None, cutoff_year["end"])[1],
+            **top_documents[status],
+        }
+    return cutoff_years, dashboard
+
+def sum_receipts(months, start, end):
+    """
+    Sum the receipts of a date range. Months in the range are read from their
+    summaries, and only the days of months partly in the range from receipts.
+    Parameters:
+    - months: List of dicts {month, count, total_amount} of the summaries.
+    - start: First date of the range, or None to sum from the first receipt.
+    - end: Last date of the range.
+    Returns:
+    - Tuple: (count, total amount)
+    """
+    count, total_amount = 0, Decimal(0)
+    partial_ranges = []
+    for month in months:
+        first_day = month["month"]
+        last_day = first_day + relativedelta(months=1, days=-1)
+        if first_day > end or (start is not None and last_day < start):
+            continue
+        if (start is None or first_day >= start) and last_day <= end:
+            count += month["count"]
+            total_amount += month["total_amount"]
+        else:
+            partial_ranges.append(Q(issue_date__range=(
+                max(start or first_day, first_day), min(end, last_day))))
+
+    if partial_ranges:
+        partial = SaleReceipt.objects.filter(reduce(or_, partial_ranges)
+            ).aggregate(count=Count("id"), total_amount=Sum("total_amount"))
+        count += partial["count"]
+        total_amount += partial["total_amount"] or 0
+    return count, total_amount
+
+def get_top_documents(documents, periods, top_lists):
+    """
+    Rank the documents of each period in every top list with window functions,
+    and get only the ranked rows with one query.
+    Parameters:
+    - periods: Dict of {period name: Q of its documents}.
+    - top_lists: Dict of {list name: (only uncollected documents, ordering)}.
+    Returns:
+    - Dict: {period name: {list name: documents ordered by rank}}
+    """
+    ranked = documents.annotate(
+        period=Case(*[When(period, then=Value(name))
+            for name, period in periods.items()], output_field=CharField())
+    ).annotate(**{
+        name: Window(RowNumber(),
+            partition_by=[F("period"), F("collected")] if uncollected
+                else [F("period")],
+            order_by=ordering + [F("pk").desc()])
+        for name, (uncollected, ordering) in top_lists.items()
+    }).filter(reduce(or_, [
+        Q(**{f"{name}__lte": TOP_DOCUMENTS}) & (Q(collected=False)
+            if uncollected else Q())
+        for name, (uncollected, _) in top_lists.items()
+    ]))
+
+    top_documents = {period: {name: [] for name in top_lists} for period in periods}
+    for document in ranked:
+        for name, (uncollected, _) in top_lists.items():
+            rank = getattr(document, name)
+            if rank <= TOP_DOCUMENTS and not (uncollected and document.collected):
+                top_documents[document.period][name].append((rank, document))
+    return {
+        period: {name: [document for _, document in sorted(lists[name],
+            key=lambda row: row[0])] for name in top_lists}
+        for period, lists in top_documents.items()
+    }
+
+def get_clients_dashboard():
+    """
+    Get the clients overview from the clients stats. Totals are summed from a
+    row per client and lists are read in the order of the stats indexes.
+    Returns:
+    - Dict: {total_sales, total_receivables, uncollected_amount, by_last_added,
+    by_amount, by_transactions}
+    """
+    totals = ClientStats.objects.aggregate(total_sales=Sum("total_sales"),
+        uncollected_amount=Sum("balance"))
+    total_sales = totals["total_sales"] or Decimal(0)
+    uncollected_amount = totals["uncollected_amount"] or Decimal(0)
+    return {
+        "total_sales": total_sales,
+        # Receipts are the movements subtracted from the sales
+        "total_receivables": total_sales - uncollected_amount,
+        "uncollected_amount": uncollected_amount,
+        "by_last_added": CompanyClient.objects.order_by("-pk")[:TOP_CLIENTS],
+        **{name: get_clients_ranking(ranking).values("client__id", "client__name",
+            "client__tax_number", "total_sales", "transactions")[:TOP_CLIENTS]
+            for name, ranking in [("by_amount", "sales"),
+                ("by_transactions", "transactions")]},
+    }
+
+def get_clients_ranking(ranking):
+    """
+    Get the clients stats ordered by a ranking of CLIENT_RANKINGS. The order is
+    the one of its index, so top and next pages are read without sorting.
+    Returns:
+    - ClientStats queryset, with their clients.
+    """
+    ordering, ranking_filter = CLIENT_RANKINGS[ranking]
+    return ClientStats.objects.select_related("client").filter(
+        ranking_filter).order_by(*ordering)
+
+def get_sales_cube(group_by=(), **filters):
+    """
+    Sum the sales cube by some of its dimensions. It reads only the monthly
+    cells, so its cost doesn't depend on the number of invoice lines.
+    Parameters:
+    - group_by: Names of SALES_CUBE_DIMENSIONS.
+    - filters: Lookups of SalesCube, I.E. month__year__in=[2024, 2025].
+    Returns:
+    - Queryset of dicts: {dimensions, invoices, amounts}, ordered by dimensions.
+    """
+    group_by = list(group_by)
+    return SalesCube.objects.filter(**filters).values(
+        *[name for name in group_by if SALES_CUBE_DIMENSIONS[name] is None],
+        **{name: SALES_CUBE_DIMENSIONS[name] for name in group_by
+            if SALES_CUBE_DIMENSIONS[name] is not None},
+    ).annotate(
+        invoices=Sum("invoices"),
+        **{amount: Sum(amount) for amount in SALES_CUBE_AMOUNTS},
+    ).order_by(*group_by)
@@ -1,11 +1,45 @@
-from django.db.models.signals import post_save, post_delete
+from decimal import Decimal
+from django.db.models import Sum
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 
-from .models import (CompanyClient, SaleInvoice, ClientCurrentAccount, Company,
-    SaleReceipt)
-from .utils import update_invoice_collected_status
+from .models import (CompanyClient, SaleInvoice, ClientCurrentAccount,
+    SaleReceipt, SaleInvoiceLine, PurchaseInvoiceLine, ClientBalanceSnapshot,
+    PointOfSell, DocumentType, TableVersion, Supplier, PaymentMethod, PaymentTerm,
+    SaleReceiptSummary, SalesCube, SALES_CUBE_FIELDS, SALES_CUBE_AMOUNTS,
+    ClientStats)
+from company.utils import get_company
+from .search import index_persons, unindex_persons
 
 
+# Values kept by from_db that the signals compare with the saved instance
+SAVED_ATTRIBUTES = {
+    ClientCurrentAccount: ["saved_client_id", "saved_date", "saved_stats"],
+    SaleInvoice: ["saved_cube_key"],
+    SaleInvoiceLine: ["saved_cube_values"],
+    SaleReceipt: ["saved_related_invoice_id", "saved_total_amount",
+        "saved_summary"],
+}
+
+
+@receiver(pre_save, sender=ClientCurrentAccount)
+@receiver(pre_save, sender=SaleInvoice)
+@receiver(pre_save, sender=SaleInvoiceLine)
+@receiver(pre_save, sender=SaleReceipt)
+def load_saved_values(sender, instance, raw=False, **kwargs):
+    """
+    Get the saved values of an instance that wasn't loaded from the DB, I.E.
+    built with the pk of an existing row, so its old values are moved too.
+    """
+    attributes = SAVED_ATTRIBUTES[sender]
+    if raw or instance.pk is None or all(
+        getattr(instance, attribute, None) is not None for attribute in attributes):
+        return
+    saved_instance = sender.objects.filter(pk=instance.pk).first()
+    if saved_instance is not None:
+        for attribute in attributes:
+            setattr(instance, attribute, getattr(saved_instance, attribute))
+
 @receiver(post_save, sender=CompanyClient)
 def create_current_account(sender, instance, created, **kwargs):
     """
@@ -14,9 +48,57 @@ def create_current_account(sender, instance, created, **kwargs):
     if created:
         ClientCurrentAccount.objects.create(
             client = instance,
-            date = Company.objects.first().creation_date   
+            date = get_company().creation_date   
         )
 
+@receiver(post_save, sender=CompanyClient)
+@receiver(post_save, sender=Supplier)
+def index_person(sender, instance, **kwargs):
+    """Update the search index of clients or suppliers"""
+    index_persons(sender, [instance])
+
+@receiver(post_delete, sender=CompanyClient)
+@receiver(post_delete, sender=Supplier)
+def unindex_person(sender, instance, **kwargs):
+    """Remove a deleted client or supplier from the search index"""
+    unindex_persons(sender, [instance.pk])
+
+@receiver(post_save, sender=ClientCurrentAccount)
+@receiver(post_delete, sender=ClientCurrentAccount)
+def invalidate_balance_snapshots(sender, instance, **kwargs):
+    """Delete the client's balance snapshots changed by a current account movement"""
+    ClientBalanceSnapshot.invalidate(instance.date, [instance.client_id])
+    # The movement could be moved from other client or date
+    saved_client_id = getattr(instance, "saved_client_id", None)
+    saved_date = getattr(instance, "saved_date", None)
+    if saved_client_id is not None and saved_date is not None and (
+        saved_client_id != instance.client_id or saved_date != instance.date):
+        ClientBalanceSnapshot.invalidate(saved_date, [saved_client_id])
+    instance.saved_client_id = instance.client_id
+    instance.saved_date = instance.date
+
+@receiver(post_save, sender=ClientCurrentAccount)
+def update_client_stats(sender, instance, created, **kwargs):
+    """Add a created movement to its client's stats, or move an edited one"""
+    if created:
+        ClientStats.add([(instance.get_stats_values(), 1)])
+        instance.saved_stats = instance.get_stats_values()
+    elif getattr(instance, "saved_stats", None) is None:
+        # The saved movement wasn't found, so any client could be changed.
+        ClientStats.rebuild()
+        instance.saved_stats = instance.get_stats_values()
+    else:
+        ClientStats.move([instance])
+
+@receiver(post_delete, sender=ClientCurrentAccount)
+def subtract_client_stats(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted movement from its client's stats"""
+    # Stats of a deleted client are deleted with it.
+    if isinstance(origin, CompanyClient) or getattr(origin, "model", None) is CompanyClient:
+        return
+    ClientStats.add([(getattr(instance, "saved_stats", None)
+        or instance.get_stats_values(), -1)])
+
 @receiver(post_save, sender=SaleReceipt)
 def update_current_account(sender, instance, created, **kwargs):
     """Update current account after doing a CRUD operation with a receipt"""
@@ -28,10 +110,152 @@ def update_current_account(sender, instance, created, **kwargs):
         }    
     )
 
-@receiver([post_save, post_delete], sender=SaleReceipt)
-def update_collected_invoice(sender, instance, **kwargs):
-    """Update invoice collected status after doing a CRUD operation with a receipt"""
-    # Check and update invoice's collected attribute
+@receiver(post_save, sender=SaleReceipt)
+def update_collected_invoice(sender, instance, created, **kwargs):
+    """Update invoice collected amount after creating or editing a receipt"""
     invoice = instance.related_invoice
-    invoice.collected = update_invoice_collected_status(invoice)
-    invoice.save()
\ No newline at end of file
+    saved_invoice_id = getattr(instance, "saved_related_invoice_id", None)
+    saved_total_amount = getattr(instance, "saved_total_amount", None)
+
+    if created:
+        invoice.add_collected_amount(instance.total_amount)
+    elif saved_invoice_id is None or saved_total_amount is None:
+        # Receipt wasn't loaded from the DB, so the amount is calculated again.
+        invoice.add_collected_amount()
+    elif saved_invoice_id != invoice.pk:
+        SaleInvoice.objects.get(pk=saved_invoice_id).add_collected_amount(
+            -saved_total_amount)
+        invoice.add_collected_amount(instance.total_amount)
+    elif instance.total_amount != saved_total_amount:
+        invoice.add_collected_amount(instance.total_amount - saved_total_amount)
+
+    instance.saved_related_invoice_id = invoice.pk
+    instance.saved_total_amount = instance.total_amount
+
+@receiver(post_delete, sender=SaleReceipt)
+def subtract_collected_invoice(sender, instance, **kwargs):
+    """Subtract a deleted receipt from its invoice's collected amount"""
+    saved_invoice_id = getattr(instance, "saved_related_invoice_id", None)
+    saved_total_amount = getattr(instance, "saved_total_amount", None)
+    if saved_invoice_id is None or saved_total_amount is None:
+        instance.related_invoice.add_collected_amount()
+    elif saved_invoice_id != instance.related_invoice_id:
+        # The receipt was removed from the invoice saved in the DB
+        SaleInvoice.objects.get(pk=saved_invoice_id).add_collected_amount(
+            -saved_total_amount)
+    else:
+        instance.related_invoice.add_collected_amount(-saved_total_amount)
+
+@receiver(post_save, sender=SaleReceipt)
+def update_receipt_summary(sender, instance, created, **kwargs):
+    """Move a created or edited receipt to its month and POS summary"""
+    summary_values = instance.get_summary_values()
+    saved_summary = getattr(instance, "saved_summary", None)
+
+    if created:
+        SaleReceiptSummary.add([(summary_values, 1)])
+    elif saved_summary is None:
+        # The saved receipt wasn't found, so every month could be changed.
+        SaleReceiptSummary.rebuild()
+    elif saved_summary != summary_values:
+        SaleReceiptSummary.add([(saved_summary, -1), (summary_values, 1)])
+
+    instance.saved_summary = summary_values
+
+@receiver(post_delete, sender=SaleReceipt)
+def subtract_receipt_summary(sender, instance, **kwargs):
+    """Subtract a deleted receipt from its month and POS summary"""
+    saved_summary = getattr(instance, "saved_summary", None)
+    SaleReceiptSummary.add([(saved_summary or instance.get_summary_values(), -1)])
+
+@receiver(post_save, sender=SaleInvoice)
+def update_sales_cube_invoice(sender, instance, created, **kwargs):
+    """Add a created invoice to the sales cube, or move an edited one"""
+    if created:
+        SalesCube.add([(instance.get_cube_key(), 1, {})])
+        instance.saved_cube_key = instance.get_cube_key()
+    elif getattr(instance, "saved_cube_key", None) is None:
+        # The saved invoice wasn't found, so any cell could be changed.
+        SalesCube.rebuild()
+        instance.saved_cube_key = instance.get_cube_key()
+    else:
+        SalesCube.move_invoices([instance])
+
+@receiver(pre_delete, sender=SaleInvoice)
+def subtract_sales_cube_invoice(sender, instance, **kwargs):
+    """Subtract a deleted invoice and its lines from the sales cube"""
+    # Lines are summed before they are deleted with the invoice.
+    amounts = instance.s_invoice_lines.aggregate(
+        **{field: Sum(field) for field in SALES_CUBE_AMOUNTS})
+    SalesCube.add([(
+        getattr(instance, "saved_cube_key", None) or instance.get_cube_key(), -1,
+        {field: -(amount or 0) for field, amount in amounts.items()}
+    )])
+
+@receiver(post_save, sender=SaleInvoiceLine)
+def update_sales_cube_line(sender, instance, created, **kwargs):
+    """Add the changes of a line's amounts to its invoice's cube cell"""
+    cube_values = instance.get_cube_values()
+    saved_cube_values = getattr(instance, "saved_cube_values", None)
+
+    if created:
+        SalesCube.add([get_line_cube_change(instance, cube_values)])
+    elif saved_cube_values is None:
+        # The saved line wasn't found, so any cell could be changed.
+        SalesCube.rebuild()
+    elif saved_cube_values != cube_values:
+        SalesCube.add([get_line_cube_change(instance, cube_values),
+            get_line_cube_change(instance, saved_cube_values, -1)])
+
+    instance.saved_cube_values = cube_values
+
+@receiver(post_delete, sender=SaleInvoiceLine)
+def subtract_sales_cube_line(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted line from its invoice's cube cell"""
+    # Lines deleted with their invoice are subtracted by the invoice.
+    if isinstance(origin, SaleInvoice) or getattr(origin, "model", None) is SaleInvoice:
+        return
+    SalesCube.add([get_line_cube_change(instance,
+        getattr(instance, "saved_cube_values", None) or instance.get_cube_values(),
+        -1)])
+
+def get_line_cube_change(line, cube_values, sign=1):
+    """
+    Get the sales cube change of a line's amounts.
+    Parameters:
+    - cube_values: (invoice id, amounts), as SaleInvoiceLine.get_cube_values.
+    - sign: 1 to add the amounts or -1 to subtract them.
+    """
+    invoice_id, *amounts = cube_values
+    if invoice_id == line.sale_invoice_id:
+        key = line.sale_invoice.get_cube_key()
+    else:
+        # The line was moved from other invoice
+        key = SaleInvoice.objects.values_list(*SALES_CUBE_FIELDS).get(pk=invoice_id)
+    return (key, 0, {field: sign * Decimal(str(amount or 0))
+        for field, amount in zip(SALES_CUBE_AMOUNTS, amounts)})
+
+@receiver(post_delete, sender=SaleInvoiceLine)
+@receiver(post_delete, sender=PurchaseInvoiceLine)
+def subtract_invoice_total(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted line from its invoice's total amount"""
+    # Lines deleted with their invoice don't need it.
+    invoice_model = instance._meta.get_field(instance.invoice_field).related_model
+    if isinstance(origin, invoice_model) or getattr(origin, "model", None) is invoice_model:
+        return
+    # If the saved total is unknown, the invoice's total is calculated again.
+    saved_total_amount = getattr(instance, "saved_total_amount", None)
+    instance.update_invoice_total(
+        -saved_total_amount if saved_total_amount is not None else None
+    )
+
+@receiver([post_save, post_delete], sender=CompanyClient)
+@receiver([post_save, post_delete], sender=PointOfSell)
+@receiver([post_save, post_delete], sender=DocumentType)
+@receiver([post_save, post_delete], sender=PaymentMethod)
+@receiver([post_save, post_delete], sender=PaymentTerm)
+@receiver([post_save, post_delete], sender=SaleInvoice)
+@receiver([post_save, post_delete], sender=SaleReceipt)
+def bump_table_version(sender, **kwargs):
+    """Invalidate the cached responses that include the changed table"""
+    TableVersion.bump(sender)
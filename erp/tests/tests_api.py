@@ -1,15 +1,23 @@
 """API tests for ERP app"""
-import datetime
+import datetime, json, tempfile
 from decimal import Decimal
+from unittest import mock
+from django.db.models import F
 from django.urls import reverse
-from django.test import tag
+from django.test import tag, override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from company.models import Company
+from company.models import Company, FinancialYear
 from utils.base_tests import APIBaseTest, CreateDbInstancesMixin
+from utils.utils_tests import get_file
+from ..jobs import run_import_job
 from ..models import (CompanyClient, Supplier, PaymentMethod, PaymentTerm,
-    PointOfSell, DocumentType, SaleInvoice, SaleInvoiceLine, SaleReceipt)
+    PointOfSell, DocumentType, SaleInvoice, SaleInvoiceLine, SaleReceipt, ImportJob,
+    ClientCurrentAccount, TableVersion)
+from ..serializers import SInvoiceDynamicSerializer, get_dynamic_serializer
+from ..utils_api import get_invoices_errors
+from ..views_api import SaleInvoicesAPI
 
 
 @tag("erp_api")
@@ -182,6 +190,112 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=2,
         )
 
+    def test_company_client_pagination_api(self):
+        url = reverse("erp:clients_api")
+        # Count the total
+        response = self.client.get(f"{url}?page_size=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertIn("page=2", response.json()["next"])
+        # Without counting the total
+        response = self.client.get(f"{url}?page_size=1&page=2&count=false")
+        self.assertNotIn("count", response.json())
+        self.assertEqual(response.json()["results"][0]["tax_number"], 
+            "99999999999")
+        self.assertIsNone(response.json()["next"])
+        self.assertIn("page=1", response.json()["previous"])
+        # Page out of range
+        response = self.client.get(f"{url}?page_size=1&page=3&count=false")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_company_client_ranking_api(self):
+        url = reverse("erp:clients_ranking_api")
+        # Client 2 gets the smallest invoice
+        invoice = SaleInvoice.objects.order_by("total_amount").first()
+        invoice.recipient = self.c_client2
+        invoice.save()
+        for invoice in SaleInvoice.objects.all():
+            invoice.update_current_account()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["tax_number"] for row in response.json()],
+            ["20361382481", "99999999999"])
+        self.assertEqual(response.json()[1]["transactions"], 1)
+        # Pages are read after the last row of the previous one
+        response = self.client.get(f"{url}?ranking=sales&page_size=1")
+        self.assertEqual(response.json()["results"][0]["tax_number"], "20361382481")
+        response = self.client.get(response.json()["next"])
+        self.assertEqual(response.json()["results"][0]["tax_number"], "99999999999")
+        self.assertIsNone(response.json()["next"])
+        # Wrong ranking
+        response = self.client.get(f"{url}?ranking=wrong")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("ranking", response.json())
+
+    def test_company_client_search_api(self):
+        self.check_api_get_response(
+            f"{reverse('erp:clients_search_api')}?q=client2",
+            page_content=["99999999999"],
+            wrong_content=["20361382481"],
+            count=1,
+        )
+        # Prefixes of the address and tax number
+        self.check_api_get_response(
+            "/erp/api/clients/search?q=chil", page_content=["20361382481"],
+            count=1,
+        )
+        self.check_api_get_response("/erp/api/clients/search?q=9999", count=1)
+        self.check_api_get_response("/erp/api/clients/search?q=cli srl", count=2)
+        self.check_api_get_response("/erp/api/clients/search?q=c", count=0)
+        self.check_api_get_response("/erp/api/clients/search?q=*", count=0)
+
+        # The index follows the changes of the clients
+        self.c_client2.name = "Renamed SA"
+        self.c_client2.save()
+        self.check_api_get_response("/erp/api/clients/search?q=client2", count=0)
+        self.check_api_get_response("/erp/api/clients/search?q=renam", count=1)
+        self.c_client2.delete()
+        self.check_api_get_response("/erp/api/clients/search?q=renam", count=0)
+
+    def test_company_client_update_multiple_api(self):
+        response = self.client.patch(reverse("erp:clients_api"), [
+            {"id": self.c_client1.pk, "name": "New name SA"},
+            {"id": self.c_client2.pk, "address": "new street 1"},
+        ], format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"], [
+            {"id": self.c_client1.pk, "status": "updated"},
+            {"id": self.c_client2.pk, "status": "updated"},
+        ])
+        # Fields are formatted as a single save does
+        self.c_client1.refresh_from_db()
+        self.c_client2.refresh_from_db()
+        self.assertEqual(self.c_client1.name, "NEW NAME SA")
+        self.assertEqual(self.c_client2.address, "New Street 1")
+        self.check_api_get_response("/erp/api/clients/search?q=new name",
+            count=1)
+
+    def test_company_client_update_multiple_wrong_api(self):
+        response = self.client.patch(reverse("erp:clients_api"), [
+            {"id": self.c_client1.pk, "name": "New name SA"},
+            {"id": self.c_client2.pk, "email": "wrong email"},
+            {"id": 0, "name": "Nobody"},
+            {"id": self.c_client1.pk, "name": "Repeated"},
+        ], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([result["status"] for result in response.json()["results"]],
+            ["updated", "invalid", "not_found", "invalid"])
+        self.assertIn("email", response.json()["results"][1]["errors"])
+        
+        # Nothing is saved if an item is wrong
+        self.c_client1.refresh_from_db()
+        self.assertEqual(self.c_client1.name, "CLIENT1 SRL")
+
+        response = self.client.patch(reverse("erp:clients_api"), {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_company_client_delete_multiple_api(self):
         self.create_company_clients()
         delete_object = {"ids": [self.c_client3.pk, self.c_client5.pk, self.c_client7.pk]}
@@ -243,6 +357,14 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=2,
         )
 
+    def test_supplier_search_api(self):
+        self.check_api_get_response(
+            f"{reverse('erp:suppliers_search_api')}?q=supplier1",
+            page_content=["SUPPLIER1 SA"],
+            wrong_content=["SUPPLIER2 SRL"],
+            count=1,
+        )
+
     def test_supplier_delete_multiple_api(self):
         delete_object = {"ids": [self.supplier1.pk, self.supplier2.pk]}
 
@@ -385,6 +507,32 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=3,
         )
 
+    def test_doc_types_not_modified_api(self):
+        url = reverse("erp:doc_types_api")
+        etag = self.client.get(url)["ETag"]
+
+        # Only the versions are read to answer
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Other process changes the table, without touching this process' cache
+        DocumentType.objects.filter(pk=self.doc_type1.pk).update(
+            description="OTHER PROCESS")
+        TableVersion.objects.filter(table="erp.documenttype").update(
+            version=F("version") + 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "OTHER PROCESS")
+        etag = response["ETag"]
+
+        # Saving a doc type invalidates the response
+        self.doc_type2.description = "New description"
+        self.doc_type2.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "NEW DESCRIPTION")
+
     def test_doc_type_api(self):
         self.check_api_get_response(
             f"/erp/api/document_types/{self.doc_type2.pk}",
@@ -450,6 +598,199 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=2,
         )
 
+    def test_doc_types_update_multiple_api(self):
+        response = self.client.patch(reverse("erp:doc_types_api"), [
+            {"id": doc_type.pk, "hide": True} for doc_type in 
+                [self.doc_type1, self.doc_type2]
+        ], format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DocumentType.objects.filter(hide=True).count(), 3)
+
+    def test_sale_invoices_update_multiple_api(self):
+        self.sale_invoice3.update_current_account()
+        self.sale_invoice4.update_current_account()
+        response = self.client.patch(reverse("erp:sale_invoices_api"), [
+            {"id": invoice.pk, "recipient": self.c_client2.pk,
+                "payment_term": self.pay_term2.pk}
+            for invoice in [self.sale_invoice3, self.sale_invoice4]
+        ], format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(SaleInvoice.objects.filter(recipient=self.c_client2,
+            payment_term=self.pay_term2).count(), 2)
+        # Current accounts follow the invoices' client
+        self.assertEqual(ClientCurrentAccount.objects.filter(
+            client=self.c_client2, invoice__isnull=False).count(), 2)
+
+    def test_sale_invoices_bulk_create_api(self):
+        FinancialYear.objects.create(year="2024", current=True)
+        line = {"description": "Product", "taxable_amount": "100",
+            "not_taxable_amount": 0, "vat_amount": "21.5"}
+        invoices = [
+            {"issue_date": "2024-01-25", "type": "1", "point_of_sell": "1",
+                "number": str(number), "recipient": "99999999999",
+                "payment_method": "cash", "payment_term": "0",
+                "lines": [line] * lines}
+            for number, lines in [(4, 2), (5, 1)]
+        ]
+        response = self.client.post(reverse("erp:sale_invoices_create_api"),
+            invoices, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {"created": 2})
+
+        invoice = SaleInvoice.objects.get(type=self.doc_type1,
+            point_of_sell=self.pos1, number="00000004")
+        self.assertEqual(invoice.sender, self.company)
+        self.assertEqual(invoice.recipient, self.c_client2)
+        self.assertEqual(invoice.total_amount, Decimal("243"))
+        self.assertEqual(invoice.s_invoice_lines.count(), 2)
+        self.assertEqual(ClientCurrentAccount.objects.get(invoice=invoice).amount,
+            Decimal("243"))
+
+    def test_sale_invoices_bulk_create_wrong_api(self):
+        FinancialYear.objects.create(year="2024", current=True)
+        invoice = {"issue_date": "2024-01-25", "type": "1", "point_of_sell": "1",
+            "number": "4", "recipient": "99999999999", "payment_method": "cash",
+            "payment_term": "0", "lines": [{"description": "Product",
+                "taxable_amount": "100", "not_taxable_amount": "0",
+                "vat_amount": "21"}]}
+        url = reverse("erp:sale_invoices_create_api")
+
+        # Invoices without lines
+        response = self.client.post(url, [{**invoice, "lines": []}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("lines", response.json()["0"])
+
+        # The second invoice is older than the first one
+        response = self.client.post(url, [invoice, {**invoice, "number": "5",
+            "issue_date": "2024-01-20"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [{"index": 1, "errors": {
+            "non_field_errors": ["Issue date can't be older than previous invoice."]
+        }}])
+        self.assertEqual(SaleInvoice.objects.count(), 4)
+
+        # Errors of the rows of an invoice's lines are shown once
+        response = self.client.post(url, [invoice, {**invoice, "number": "5",
+            "recipient": "12345678901", "lines": invoice["lines"] * 2}],
+            format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [{"index": 1, "errors": {
+            "recipient": ["This value doesn't exist in the records."]
+        }}])
+
+        # Errors of the lines' fields are listed by line
+        errors = get_invoices_errors({1: [("description", "Wrong.", "Row 3")]},
+            [invoice, {**invoice, "lines": invoice["lines"] * 2}])
+        self.assertEqual(errors, [{"index": 1, "errors": {
+            "lines": [{"index": 0, "errors": {"description": ["Wrong."]}}]
+        }}])
+
+    def test_sale_invoices_search_index_api(self):
+        # Versions and invoices with their related fields
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/erp/api/sale_invoices/search_index?collected=false")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 3)
+
+        invoice = next(invoice for invoice in response.json()
+            if invoice["display_name"] == "A 00001-00000002")
+        self.assertEqual(invoice["type"], "A")
+        self.assertEqual(invoice["point_of_sell"], "00001")
+        self.assertEqual(invoice["recipient"], "20361382481")
+        self.assertEqual(invoice["recipient_name"], "CLIENT1 SRL")
+
+    def test_sale_receipts_search_index_api(self):
+        self.check_api_get_response(
+            "/erp/api/sale_receipts/search_index",
+            "erp:sale_receipts_search_api",
+            page_content=["20361382481", "CLIENT1 SRL", "A 00001-00000001"],
+        )
+
+    def test_search_index_not_modified_api(self):
+        url = "/erp/api/sale_invoices/search_index"
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Changing a related table invalidates the response
+        self.c_client1.name = "New name"
+        self.c_client1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "NEW NAME")
+
+    def test_sale_invoices_streaming_api(self):
+        url = reverse("erp:sale_invoices_api")
+        # Rows are split in chunks
+        with mock.patch.object(SaleInvoicesAPI, "stream_chunk_size", 3):
+            response = self.client.get(f"{url}?stream=true")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            streamed = json.loads(b"".join(response.streaming_content))
+        # Same rows as the full list
+        self.assertEqual(streamed, self.client.get(url).json())
+        self.assertEqual(len(streamed), 4)
+
+    def test_sales_cube_api(self):
+        url = reverse("erp:sales_cube_api")
+        response = self.client.get(f"{url}?group_by=year,client&year=2024")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        invoices = SaleInvoice.objects.filter(issue_date__year=2024)
+        self.assertEqual(
+            [(row["year"], row["client"], row["invoices"], Decimal(row["total_amount"]))
+                for row in response.json()],
+            [(2024, self.c_client1.pk, invoices.count(), 
+                sum(invoice.total_amount for invoice in invoices))]
+        )
+        # Wrong dimensions and filters
+        response = self.client.get(f"{url}?group_by=day&client=a")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {"group_by", "client"})
+
+    def test_sale_invoices_search_filters_api(self):
+        url = "/erp/api/sale_invoices"
+        self.check_api_get_response(f"{url}?pos=1&client_name=client1", count=4)
+        self.check_api_get_response(f"{url}?client_name=client2", count=0)
+        self.check_api_get_response(f"{url}?client_tax_number=2036", count=4)
+        self.check_api_get_response(
+            f"{url}?number=00000002",
+            page_content=["A 00001-00000002"],
+            wrong_content=["A 00001-00000003"],
+            count=1,
+        )
+        self.check_api_get_response(
+            f"{url}?type=b&year=2024&month=1",
+            page_content=["B 00001-00000001"],
+            count=1,
+        )
+        self.check_api_get_response(
+            "/erp/api/sale_receipts?year=2024&month=2",
+            page_content=["600.01"],
+            count=1,
+        )
+
+    def test_sale_invoices_keyset_pagination_api(self):
+        response = self.client.get("/erp/api/sale_invoices?page_size=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual([invoice["id"] for invoice in first_page["results"]], [
+            self.sale_invoice4.pk, self.sale_invoice3.pk, self.sale_invoice2.pk])
+        
+        # Next page starts after the last invoice of the previous one
+        response = self.client.get(first_page["next"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            "next": None, "results": [
+                self.client.get(f"/erp/api/sale_invoices/{self.sale_invoice1.pk}"
+                    ).json()
+            ]
+        })
+        
+        response = self.client.get("/erp/api/sale_invoices?cursor=wrong")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_sale_invoices_dynamic_serializer_api(self):
         self.check_api_get_response(
             f"/erp/api/sale_invoices?fields=issue_date,number&collected=true",
@@ -512,6 +853,23 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=2, # Number of fields in the object
         )
 
+    def test_sale_invoice_dynamic_serializer_cache_api(self):
+        url = f"/erp/api/sale_invoices/{self.sale_invoice1.pk}"
+        self.client.get(f"{url}?fields=number,display_name")
+        response = self.client.get(f"{url}?fields=number,display_name")
+        self.assertEqual(response.json(),
+            {"number": "00000001", "display_name": "A 00001-00000001"})
+        # Classes are reused and the shared Meta isn't changed
+        self.assertIs(
+            get_dynamic_serializer(SInvoiceDynamicSerializer, ["number"]),
+            get_dynamic_serializer(SInvoiceDynamicSerializer, ["number"])
+        )
+        self.assertEqual(SInvoiceDynamicSerializer.Meta.fields, [])
+        # Unknown fields
+        response = self.client.get(f"{url}?fields=number,wrong")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("wrong", response.json()["fields"])
+
     def test_sale_receipts_api(self):
         self.check_api_get_response(
            "/erp/api/sale_receipts",
@@ -551,4 +909,69 @@ class APIErpTests(CreateDbInstancesMixin, APIBaseTest):
             count=2,
         )
 
- 
\ No newline at end of file
+ 
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_import_job_api(self):
+        file = get_file("erp/tests/files/clients/clients.csv")
+        response = self.client.post(reverse("erp:import_jobs_api"),
+            {"kind": "client", "file": file}, format="multipart")
+        
+        # The job is returned before importing the file
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()["status"], "pending")
+        self.assertEqual(CompanyClient.objects.count(), 2)
+
+        # Jobs are queued on commit, which doesn't happen in tests.
+        job_pk = response.json()["id"]
+        run_import_job(job_pk)
+
+        self.check_api_get_response(
+            f"/erp/api/import_jobs/{job_pk}",
+            ["erp:import_job_api", {"pk": job_pk}],
+            page_content=['"status":"done"', '"rows_processed":6', "throughput"],
+        )
+        self.assertEqual(CompanyClient.objects.count(), 8)
+        self.assertFalse(ImportJob.objects.get(pk=job_pk).file)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_import_job_api_wrong_data(self):
+        file = get_file("erp/tests/files/clients/clientsbad.csv")
+        response = self.client.post(reverse("erp:import_jobs_api"),
+            {"kind": "client", "file": file}, format="multipart")
+        run_import_job(response.json()["id"])
+
+        job = ImportJob.objects.get(pk=response.json()["id"])
+        self.assertEqual(job.status, "failed")
+        self.assertIn("must be only digits", job.errors)
+        self.assertEqual(job.rows_processed, 0)
+        self.assertEqual(CompanyClient.objects.count(), 2)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_import_job_retry_api(self):
+        file = get_file("erp/tests/files/clients/clientsbad.csv")
+        response = self.client.post(reverse("erp:import_jobs_api"),
+            {"kind": "client", "file": file}, format="multipart")
+        job_pk = response.json()["id"]
+        run_import_job(job_pk)
+
+        # Failed jobs keep their file to be queued again
+        response = self.client.post(reverse("erp:import_job_retry_api",
+            args=[job_pk]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()["status"], "pending")
+        self.assertEqual(response.json()["errors"], "")
+
+        # Only failed jobs can be retried
+        response = self.client.post(reverse("erp:import_job_retry_api",
+            args=[job_pk]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("Only failed imports", response.json()["detail"])
+
+    def test_import_job_api_wrong_kind(self):
+        file = get_file("erp/tests/files/clients/clients.csv")
+        response = self.client.post(reverse("erp:import_jobs_api"),
+            {"kind": "purchase_invoice", "file": file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ImportJob.objects.count(), 0)
+
@@ -1,17 +1,31 @@
-import datetime, os
+import datetime, os, subprocess, sys
 import pprint
+import tempfile
+from dateutil.relativedelta import relativedelta
 from decimal import Decimal
+from io import StringIO
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.test import TestCase, tag
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.db.models import F, QuerySet, Sum
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from unittest.mock import patch
 
 
 # Create your tests here.
 from ..models import (CompanyClient, Supplier, ClientCurrentAccount,
     SupplierCurrentAccount, PaymentMethod, PaymentTerm, SaleInvoice,
     SaleInvoiceLine, SaleReceipt, PurchaseInvoice, PurchaseInvoiceLine,
-    PurchaseReceipt, PointOfSell, DocumentType)
+    PurchaseReceipt, PointOfSell, DocumentType, ClientBalanceSnapshot,
+    SaleReceiptSummary, SalesCube, ClientStats, TableVersion, ImportJob)
+from ..importers import SaleInvoiceImporter
+from ..jobs import run_import_job, get_worker, STALE_JOB_TIMEOUT
+from ..search import search_persons
+from ..services import get_sales_dashboard, sum_receipts
+from ..utils import get_clients_balance
 from company.models import Company, FinancialYear
 
 from utils.utils_tests import get_file
@@ -20,6 +34,9 @@ from utils.base_tests import BackBaseTest, CreateDbInstancesMixin
 
 # Create your tests here.
 @tag("erp_db_views")
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+# Jobs are queued on commit, which doesn't happen in tests, so they run at once.
+@patch("erp.views.submit_import_job", lambda job: run_import_job(job.pk))
 class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
     @classmethod
     def setUpTestData(cls):
@@ -518,6 +535,94 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
         self.assertAlmostEqual(self.sale_invoice1.total_lines_sum(),
             Decimal("2509.01"))
 
+    def test_sale_invoice_total_amount_updated_by_lines(self):
+        # Edit a line
+        line = SaleInvoiceLine.objects.get(pk=self.sale_invoice1_line1.pk)
+        line.vat_amount = Decimal("10")
+        line.save()
+        invoice = SaleInvoice.objects.get(pk=self.sale_invoice1.pk)
+        self.assertEqual(invoice.total_amount, Decimal("2309.01"))
+
+        # Add a line
+        SaleInvoiceLine.objects.create(
+            sale_invoice = invoice,
+            description = "New product",
+            taxable_amount = Decimal("100"),
+            not_taxable_amount = Decimal("0.99"),
+            vat_amount = Decimal("21"),
+        )
+        self.assertEqual(invoice.total_amount, Decimal("2431.00"))
+
+        # Delete a line
+        SaleInvoiceLine.objects.filter(pk=self.sale_invoice1_line2.pk).delete()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal("1222.00"))
+
+        # Saving an old instance doesn't overwrite the total
+        self.sale_invoice1.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal("1222.00"))
+
+    def test_sale_invoice_collected_amount_updated_by_receipts(self):
+        invoice = SaleInvoice.objects.get(pk=self.sale_invoice1.pk)
+        self.assertEqual(invoice.collected_amount, Decimal("2509.01"))
+        self.assertEqual(invoice.outstanding_balance, Decimal("0"))
+
+        # Edit the receipt
+        receipt = SaleReceipt.objects.get(pk=self.sale_receipt1.pk)
+        receipt.total_amount = Decimal("1000")
+        receipt.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.collected_amount, Decimal("1000"))
+        self.assertEqual(invoice.outstanding_balance, Decimal("1509.01"))
+        self.assertEqual(invoice.collected, False)
+
+        # Lines change the balance too
+        SaleInvoiceLine.objects.filter(pk=self.sale_invoice1_line2.pk).delete()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.outstanding_balance, Decimal("300.01"))
+
+        # Move the receipt to other invoice
+        self.create_extra_invoices()
+        receipt.related_invoice = self.sale_invoice2
+        receipt.save()
+        invoice.refresh_from_db()
+        self.sale_invoice2.refresh_from_db()
+        self.assertEqual(invoice.collected_amount, Decimal("0"))
+        self.assertEqual(self.sale_invoice2.collected_amount, Decimal("1000"))
+        self.assertEqual(self.sale_invoice2.outstanding_balance, Decimal("209.10"))
+
+        # Delete the receipt
+        SaleReceipt.objects.get(pk=receipt.pk).delete()
+        self.sale_invoice2.refresh_from_db()
+        self.assertEqual(self.sale_invoice2.collected_amount, Decimal("0"))
+        self.assertEqual(self.sale_invoice2.collected, False)
+
+    def test_rebuild_search_index_command(self):
+        # Updates in bulk don't send the signals that index persons
+        CompanyClient.objects.filter(pk=self.c_client2.pk).update(
+            name="Renamed Client SA")
+        self.assertEqual(list(search_persons(CompanyClient, "renamed")), [])
+
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("CompanyClient: 2 persons indexed.", out.getvalue())
+        self.assertEqual(list(search_persons(CompanyClient, "renamed")),
+            [self.c_client2])
+
+    def test_invoice_totals_command(self):
+        SaleInvoice.objects.filter(pk=self.sale_invoice1.pk).update(
+            total_amount=Decimal("1"), collected_amount=Decimal("2"))
+
+        with self.assertRaises(CommandError):
+            call_command("invoice_totals", "--verify", stdout=StringIO())
+        call_command("invoice_totals", stdout=StringIO())
+        call_command("invoice_totals", "--verify", stdout=StringIO())
+        invoice = SaleInvoice.objects.get(pk=self.sale_invoice1.pk)
+        self.assertEqual(invoice.total_amount, Decimal("2509.01"))
+        self.assertEqual(invoice.collected_amount, Decimal("2509.01"))
+        self.assertEqual(invoice.collected, True)
+
     def test_sale_invoice_constraint(self):
         # Create invoice 2
         SaleInvoice.objects.create(
@@ -744,6 +849,86 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
             ]
         )
         
+    def create_before_update(self, instance, method="update"):
+        """
+        Patch a QuerySet method to save an instance as other process would do,
+        right after the first call of the method for the instance's model.
+        """
+        original = getattr(QuerySet, method)
+        saved = []
+
+        def call_before_other_process(queryset, *args, **kwargs):
+            result = original(queryset, *args, **kwargs)
+            if queryset.model is type(instance) and not saved:
+                instance.save()
+                saved.append(instance)
+            return result
+        return patch.object(QuerySet, method, call_before_other_process)
+
+    def test_client_stats(self):
+        self.create_extra_receipts()
+
+        def check_stats():
+            stats = list(ClientStats.objects.values_list("client", "total_sales",
+                "transactions", "balance", "last_activity"))
+            ClientStats.rebuild()
+            self.assertCountEqual(stats, list(ClientStats.objects.values_list(
+                "client", "total_sales", "transactions", "balance", "last_activity")))
+
+        check_stats()
+        # Last document moved to other client, date and amount
+        receipt = SaleReceipt.objects.get(pk=self.sale_receipt2.pk)
+        receipt.issue_date = datetime.date(2024, 1, 20)
+        receipt.total_amount = Decimal("100")
+        receipt.save()
+        check_stats()
+        invoice = SaleInvoice.objects.get(pk=self.sale_invoice6.pk)
+        invoice.recipient = self.c_client1
+        invoice.save()
+        invoice.update_current_account()
+        check_stats()
+        SaleInvoice.objects.get(pk=self.sale_invoice4.pk).delete()
+        check_stats()
+        # A movement not loaded from the DB is moved from its saved client too.
+        movement = ClientCurrentAccount.objects.filter(client=self.c_client1,
+            invoice__isnull=False).values().first()
+        movement["amount"] += 10
+        movement["client_id"] = self.c_client2.pk
+        ClientCurrentAccount(**movement).save()
+        check_stats()
+
+        stats = ClientStats.objects.get(client=self.c_client1)
+        movements = ClientCurrentAccount.objects.filter(client=self.c_client1)
+        self.assertEqual(stats.balance, 
+            movements.aggregate(balance=Sum("amount"))["balance"])
+        self.assertEqual(stats.transactions, 
+            movements.filter(invoice__isnull=False).count())
+        self.assertEqual(stats.last_activity, 
+            movements.exclude(invoice=None, receipt=None).latest("date").date)
+
+        # Stats created by other process meanwhile are added to.
+        new_clients = [CompanyClient.objects.create(tax_number=f"2033333333{digit}",
+            name=f"New client {digit}") for digit in range(2)]
+        date = datetime.date(2024, 6, 1)
+        totals = {"total_sales": Decimal("10"), "transactions": 1,
+            "balance": Decimal("10"), "last_activity": date, "removed": None}
+        def get_other_stats(client):
+            return ClientStats(client=client, total_sales=Decimal("1"),
+                transactions=1, balance=Decimal("1"), last_activity=date)
+
+        with self.create_before_update(get_other_stats(new_clients[0])):
+            ClientStats.add_totals({new_clients[0].pk: totals.copy()})
+        # A file's stats are added one by one if any of them was created.
+        with self.create_before_update(get_other_stats(new_clients[1]),
+                "bulk_update"):
+            ClientStats.add_totals({client.pk: totals.copy()
+                for client in new_clients})
+        self.assertCountEqual(ClientStats.objects.filter(client__in=new_clients
+            ).values_list("client", "total_sales", "transactions", "balance"), [
+                (new_clients[0].pk, Decimal("21"), 3, Decimal("21")),
+                (new_clients[1].pk, Decimal("11"), 2, Decimal("11")),
+            ])
+
     def test_client_new_get(self):
         self.check_page_get_response(
             "/erp/client/new", 
@@ -805,6 +990,41 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
 
         self.assertEqual(len(ClientCurrentAccount.objects.all()), 10)
     
+    def test_client_new_multiple_query_count(self):
+        file = get_file("erp/tests/files/clients/clients.csv")
+
+        # The file is checked and queued without saving any row.
+        with CaptureQueriesContext(connection) as queries, \
+                patch("erp.views.submit_import_job") as submit_import_job:
+            self.check_page_post_response(["erp:person_new_multiple",
+                {"person_type": "client"}], {"file": file}, 302, (CompanyClient, 2)
+            )
+        self.assertLess(len(queries), 6)
+
+        # Clients and their current accounts are saved in bulk.
+        with CaptureQueriesContext(connection) as queries:
+            run_import_job(submit_import_job.call_args.args[0].pk)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(CompanyClient.objects.count(), 8)
+
+        client_great = CompanyClient.objects.get(tax_number="20123456780")
+        current_account = ClientCurrentAccount.objects.get(client=client_great)
+        self.assertEqual(current_account.date, datetime.date(1991, 3, 10))
+        self.assertEqual(current_account.amount, Decimal("0"))
+        # Imported clients are added to the search index
+        self.assertEqual(list(search_persons(CompanyClient, "great sug")),
+            [client_great])
+
+    def test_client_new_multiple_post_company_tax_number(self):
+        file = get_file("erp/tests/files/clients/clients_company.csv")
+
+        page_content = self.check_page_post_response(["erp:person_new_multiple",
+            {"person_type": "client"}], {"file": file}, 400, (CompanyClient, 2)
+        )
+        self.assertIn("Row 3, tax_number: The tax number you're trying to add "
+            "belongs to the company.", page_content)
+        self.assertEqual(len(ClientCurrentAccount.objects.all()), 4)
+
     def test_client_new_multiple_post_xls(self):
         file = get_file("erp/tests/files/clients/clients.xls")
         
@@ -1049,6 +1269,112 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
             ]
         )
 
+    def test_sales_dashboard(self):
+        self.create_extra_invoices()
+        _, dashboard = get_sales_dashboard("calendar", 2024)
+        invoices = SaleInvoice.objects.filter(issue_date__year=2024)
+        uncollected = invoices.filter(collected=False)
+        self.assertEqual(dashboard["current"]["count"], invoices.count())
+        self.assertEqual(dashboard["current"]["count_uncollected"], 
+            uncollected.count())
+        self.assertEqual(dashboard["current"]["by_date"],
+            list(invoices.order_by("-issue_date", "-pk")[:10]))
+        self.assertEqual(dashboard["current"]["by_amount"],
+            list(invoices.order_by("-total_amount", "-issue_date", "-pk")[:10]))
+        self.assertEqual(dashboard["current"]["by_uncollected_oldest"],
+            list(uncollected.order_by("issue_date", "-pk")[:10]))
+        self.assertEqual(dashboard["previous"]["count"], 0)
+
+        # Cached until an invoice changes, only the versions are read
+        with self.assertNumQueries(1):
+            get_sales_dashboard("calendar", 2024)
+        self.sale_invoice2.delete()
+        _, dashboard = get_sales_dashboard("calendar", 2024)
+        self.assertNotIn(self.sale_invoice2, dashboard["current"]["by_date"])
+
+        # Other process changes an invoice, without touching this process' cache
+        SaleInvoice.objects.filter(pk=self.sale_invoice3.pk).update(
+            issue_date=datetime.date(2023, 1, 23))
+        TableVersion.objects.filter(table="erp.saleinvoice").update(
+            version=F("version") + 1)
+        _, dashboard = get_sales_dashboard("calendar", 2024)
+        self.assertNotIn(self.sale_invoice3, dashboard["current"]["by_date"])
+
+    def test_sales_cube(self):
+        self.create_extra_invoices()
+
+        def check_cube():
+            cells = list(SalesCube.objects.exclude(invoices=0).values_list(
+                "month", "client", "type", "point_of_sell", "payment_method",
+                "invoices", "total_amount").order_by("pk"))
+            SalesCube.rebuild()
+            self.assertCountEqual(cells, list(SalesCube.objects.values_list(
+                "month", "client", "type", "point_of_sell", "payment_method",
+                "invoices", "total_amount")))
+
+        check_cube()
+        # Invoice moved to other month, client and payment method
+        invoice = SaleInvoice.objects.get(pk=self.sale_invoice2.pk)
+        invoice.issue_date = datetime.date(2024, 3, 25)
+        invoice.recipient = self.c_client2
+        invoice.payment_method = self.pay_method1
+        invoice.save()
+        check_cube()
+        # Lines added, edited and deleted
+        line = SaleInvoiceLine.objects.create(
+            sale_invoice = self.sale_invoice3,
+            description = "Extra line",
+            taxable_amount = Decimal("10"),
+            not_taxable_amount = Decimal("0"),
+            vat_amount = Decimal("2.10"),
+        )
+        check_cube()
+        line.taxable_amount = Decimal("20")
+        line.save()
+        check_cube()
+        line.delete()
+        check_cube()
+        SaleInvoice.objects.get(pk=self.sale_invoice4.pk).delete()
+        check_cube()
+
+        # Objects not loaded from the DB are moved from their saved cells too.
+        invoice = SaleInvoice.objects.filter(pk=self.sale_invoice3.pk).values().get()
+        invoice["payment_method_id"] = self.pay_method1.pk
+        invoice["issue_date"] += relativedelta(months=1)
+        invoice["recipient_id"] = self.c_client1.pk
+        line = SaleInvoiceLine.objects.filter(sale_invoice=self.sale_invoice3
+            ).values().first()
+        line["taxable_amount"] += 5
+        for instance in [SaleInvoice(**invoice), SaleInvoiceLine(**line)]:
+            cells_pks = set(SalesCube.objects.values_list("pk", flat=True))
+            instance.save()
+            # Cells aren't built again.
+            self.assertLessEqual(cells_pks,
+                set(SalesCube.objects.values_list("pk", flat=True)))
+            check_cube()
+
+        # Cells created by other process meanwhile are added to.
+        month = datetime.date(2024, 6, 1)
+        cells = {client.pk: (month, client.pk, self.doc_type1.pk, self.pos1.pk,
+            self.pay_method1.pk) for client in [self.c_client1, self.c_client2]}
+        totals = {"invoices": 1, "total_amount": Decimal("10")}
+        def get_other_cell(client):
+            return SalesCube(month=month, client=client, type=self.doc_type1,
+                point_of_sell=self.pos1, payment_method=self.pay_method1,
+                invoices=1, total_amount=Decimal("1"))
+
+        with self.create_before_update(get_other_cell(self.c_client1)):
+            SalesCube.add_cells({cells[self.c_client1.pk]: totals.copy()})
+        # A file's cells are added one by one if any of them was created.
+        with self.create_before_update(get_other_cell(self.c_client2),
+                "bulk_update"):
+            SalesCube.add_cells({cell: totals.copy() for cell in cells.values()})
+        self.assertCountEqual(SalesCube.objects.filter(month=month).values_list(
+            "client", "invoices", "total_amount"), [
+                (self.c_client1.pk, 3, Decimal("21")),
+                (self.c_client2.pk, 2, Decimal("11")),
+            ])
+
     def test_sales_new_invoice_get_webpage(self):
         self.create_extra_pos()
         self.assertEqual(PointOfSell.objects.count(), 4)
@@ -1506,9 +1832,170 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
 
         self.assertIn("Row 2, general: You cannot include a disabled point of sell.",
             page_content)
-        
+
+        self.assertEqual(ClientCurrentAccount.objects.all().count(), 4)
+
+    def test_sales_new_massive_invoices_wrong_date_correlation(self):
+        file = get_file("erp/tests/files/sales/invoices_wrong_correlation.csv")
+
+        page_content = self.check_page_post_response("erp:sales_new_massive",
+            {"file": file}, 400, (SaleInvoice, 1))
+
+        # Previous invoice is in the same file
+        self.assertIn("Row 3, general: Issue date can't be older than previous invoice.",
+            page_content)
+        self.assertEqual(SaleInvoiceLine.objects.all().count(), 2)
         self.assertEqual(ClientCurrentAccount.objects.all().count(), 4)
 
+    def test_sales_new_massive_invoices_multiple_errors(self):
+        file = get_file("erp/tests/files/sales/invoices_multiple_errors.csv")
+
+        # The whole file is checked before writing, so all errors are shown.
+        with CaptureQueriesContext(connection) as queries:
+            page_content = self.check_page_post_response("erp:sales_new_massive",
+                {"file": file}, 400, (SaleInvoice, 1))
+        
+        for text in [
+            "Row 2, issue_date: The selected date is not within the current year.",
+            "Row 3, number: a must be only digits.",
+            "Row 4, taxable_amount: Ensure that there are no more than 2 decimal",
+            "The input in row 5 and column recipient doesn't exist in the records.",
+            "Row 6: Invoice 001-00002-00000003 already exists or repeated in file.",
+        ]:
+            self.assertIn(text, page_content)
+        self.assertFalse(any(query["sql"].startswith("INSERT") 
+            for query in queries))
+
+    def test_sales_new_massive_invoices_query_count(self):
+        file = get_file("erp/tests/files/sales/invoices_mixed.xlsx")
+
+        # The file is checked and queued without saving any row.
+        with CaptureQueriesContext(connection) as queries, \
+                patch("erp.views.submit_import_job") as submit_import_job:
+            self.check_page_post_response("erp:sales_new_massive",
+                {"file": file}, 302)
+        self.assertLess(len(queries), 10)
+
+        # Related objects, invoices and lines are queried and saved in bulk.
+        with CaptureQueriesContext(connection) as queries:
+            run_import_job(submit_import_job.call_args.args[0].pk)
+        self.assertLess(len(queries), 45)
+        self.assertEqual(SaleInvoice.objects.count(), 6)
+
+    def test_sales_new_massive_invoices_chunked_file(self):
+        file = get_file("erp/tests/files/sales/invoices_mixed.xlsx")
+
+        # Read the file in small chunks, so invoices' lines are split between them.
+        with patch("erp.utils.FILE_CHUNK_SIZE", 3):
+            self.check_page_post_response("erp:sales_new_massive",
+                {"file": file}, 302, (SaleInvoice, 6))
+
+        self.assertEqual(SaleInvoiceLine.objects.all().count(), 10)
+        self.assertEqual(len(ClientCurrentAccount.objects.all()), 9)
+        last_ca = ClientCurrentAccount.objects.last()
+        self.assertEqual(last_ca.amount, Decimal("595.98"))
+        self.assertEqual(ImportJob.objects.get().rows_processed, 8)
+
+    def test_sales_new_massive_invoices_retry(self):
+        file = get_file("erp/tests/files/sales/invoices_mixed.xlsx")
+        import_dataframe = SaleInvoiceImporter.import_dataframe
+
+        def stop_after_first_invoices(importer, df):
+            if importer.saved_rows:
+                raise ConnectionError("The server stopped.")
+            import_dataframe(importer, df)
+
+        # The import stops after committing the first chunks
+        with patch("erp.utils.FILE_CHUNK_SIZE", 3), patch.object(
+                SaleInvoiceImporter, "import_dataframe", stop_after_first_invoices):
+            self.check_page_post_response("erp:sales_new_massive",
+                {"file": file}, 302)
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, "failed")
+        self.assertTrue(job.file)
+        self.assertIn(f"The first {job.rows_processed} rows of the file were "
+            "imported.", job.errors)
+        self.assertEqual(SaleInvoiceLine.objects.count() - 2, job.rows_processed)
+
+        # The retry continues after the imported rows
+        response = self.client.post(reverse("erp:import_job_retry", args=[job.pk]))
+        self.assertRedirects(response, reverse("erp:import_job", args=[job.pk]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "pending")
+        with patch("erp.utils.FILE_CHUNK_SIZE", 3):
+            run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.errors, "")
+        self.assertEqual(job.rows_processed, 8)
+        self.assertFalse(job.file)
+        self.assertEqual(SaleInvoice.objects.count(), 6)
+        self.assertEqual(SaleInvoiceLine.objects.count(), 10)
+        self.assertEqual(ClientCurrentAccount.objects.count(), 9)
+
+        # Finished imports can't be retried
+        response = self.client.post(reverse("erp:import_job_retry", args=[job.pk]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_sales_new_massive_invoices_chunked_file_wrong_data(self):
+        self.create_extra_pay_methods()
+        self.create_extra_pay_terms()
+        file = get_file("erp/tests/files/sales/invoices_mixed_wrong.csv")
+
+        # Lines of an invoice are compared between chunks before saving any.
+        with patch("erp.utils.FILE_CHUNK_SIZE", 3):
+            page_content = self.check_page_post_response("erp:sales_new_massive",
+                {"file": file}, 400, (SaleInvoice, 1))
+        self.assertIn("Row 10: Your invoice's information doesn't match with row 9",
+            page_content)
+        self.assertEqual(SaleInvoiceLine.objects.all().count(), 2)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_import_job_webpage(self):
+        file = get_file("erp/tests/files/clients/clients.csv")
+
+        # Uploads are redirected to the status page of their import
+        response = self.client.post(reverse("erp:person_new_multiple",
+            kwargs={"person_type": "client"}), {"file": file})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse("erp:import_job", args=[job.pk]))
+
+        self.check_page_get_response(reverse("erp:import_job", args=[job.pk]),
+            ["erp:import_job", {"job_pk": job.pk}], "erp/import_job.html",
+            ["Status:</b> Done", "Imported rows:</b> 6"])
+        response = self.client.get(reverse("erp:import_job", args=[job.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_fail_import_jobs(self):
+        # Process that stopped
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()
+        stopped_worker = get_worker().rsplit(":", 1)[0] + f":{process.pid}"
+
+        pending_job = ImportJob.objects.create(kind="client", file="clients.csv",
+            worker=get_worker())
+        stopped_job = ImportJob.objects.create(kind="client", file="clients.csv",
+            status="running", worker=stopped_worker)
+        stale_job = ImportJob.objects.create(kind="client", file="clients.csv",
+            status="running", worker=get_worker())
+        ImportJob.objects.filter(pk=stale_job.pk).update(
+            updated_at=stale_job.updated_at - STALE_JOB_TIMEOUT)
+        done_job = ImportJob.objects.create(kind="client", status="done",
+            worker=stopped_worker)
+
+        # Only the jobs of stopped processes or without progress are failed.
+        out = StringIO()
+        call_command("fail_import_jobs", stdout=out)
+        self.assertIn("2 interrupted jobs failed", out.getvalue())
+        for job in [stopped_job, stale_job]:
+            job.refresh_from_db()
+            self.assertEqual(job.status, "failed")
+            self.assertIn("interrupted", job.errors)
+        for job, job_status in [(pending_job, "pending"), (done_job, "done")]:
+            job.refresh_from_db()
+            self.assertEqual(job.status, job_status)
+
     def test_sales_invoice_webpage(self):
         self.create_extra_invoices()
         self.check_page_get_response(
@@ -1582,6 +2069,8 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
         
         client_ca = ClientCurrentAccount.objects.get(invoice=self.sale_invoice1)
         self.assertEqual(client_ca.amount, Decimal("4099.36"))
+        self.assertEqual(SaleInvoice.objects.get(pk=self.sale_invoice1.pk
+            ).total_amount, Decimal("4099.36"))
         self.assertEqual(client_ca.date, datetime.date(2024, 1, 21))
         self.assertEqual(client_ca.receipt, None)
         self.assertEqual(client_ca.client, self.c_client2)
@@ -1604,6 +2093,32 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
                 "B 00001-00000001"]
         )
 
+    def test_list_pages_query_count(self):
+        urls = [
+            reverse("erp:sales_index"),
+            reverse("erp:invoice_list"),
+            reverse("erp:receivables_index"),
+            reverse("erp:receipt_list"),
+            reverse("erp:person_ca_detail", kwargs={"person_type": "client",
+                "person_pk": self.c_client1.pk}),
+            reverse("erp:person_rel_docs", kwargs={"person_type": "client",
+                "person_pk": self.c_client1.pk}),
+        ]
+        query_counts = {}
+        for url in urls:
+            # Balance snapshots are created by the first request.
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            query_counts[url] = len(queries)
+
+        # Related objects of new rows are got with the lists' queries.
+        self.create_extra_receipts()
+        for url in urls:
+            self.client.get(url)
+            with self.subTest(url=url), self.assertNumQueries(query_counts[url]):
+                self.client.get(url)
+
     def test_sales_list_get_webpage(self):
         self.check_page_get_response(
             "/erp/sales/invoices/list", 
@@ -1704,6 +2219,65 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
             "Last Receipts", "Highest Receipts", "Receipts: 6", "You haven't issued any receipt in 2023."]                   
         )
 
+    def test_receipt_summaries(self):
+        self.create_extra_receipts()
+
+        def check_summaries():
+            summaries = list(SaleReceiptSummary.objects.values_list(
+                "month", "point_of_sell", "count", "total_amount"))
+            SaleReceiptSummary.rebuild()
+            self.assertEqual(summaries, list(SaleReceiptSummary.objects.values_list(
+                "month", "point_of_sell", "count", "total_amount")))
+
+        check_summaries()
+        # Receipt moved to other month, POS and amount
+        receipt = SaleReceipt.objects.get(pk=self.sale_receipt2.pk)
+        receipt.issue_date = datetime.date(2024, 3, 25)
+        receipt.point_of_sell = self.pos2
+        receipt.number = "00000009"
+        receipt.total_amount = Decimal("100")
+        receipt.save()
+        check_summaries()
+        SaleReceipt.objects.get(pk=self.sale_receipt3.pk).delete()
+        check_summaries()
+
+        # Days of months partly in the range are summed from the receipts
+        months = list(SaleReceiptSummary.objects.values("month").annotate(
+            count=Sum("count"), total_amount=Sum("total_amount")).order_by("month"))
+        receipts = SaleReceipt.objects.filter(issue_date__range=(
+            datetime.date(2024, 1, 22), datetime.date(2024, 3, 24)))
+        self.assertEqual(
+            sum_receipts(months, datetime.date(2024, 1, 22), 
+                datetime.date(2024, 3, 24)),
+            (receipts.count(), receipts.aggregate(total=Sum("total_amount"))["total"])
+        )
+
+        # A receipt not loaded from the DB is moved from its saved month too.
+        receipt = SaleReceipt.objects.filter(pk=self.sale_receipt1.pk).values().get()
+        receipt["total_amount"] -= 1
+        receipt["issue_date"] += relativedelta(months=1)
+        other_summaries = SaleReceiptSummary.objects.exclude(month__in=[
+            receipt["issue_date"].replace(day=1),
+            receipt["issue_date"].replace(day=1) - relativedelta(months=1)])
+        other_summaries_pks = set(other_summaries.values_list("pk", flat=True))
+        SaleReceipt(**receipt).save()
+        self.assertEqual(set(other_summaries.values_list("pk", flat=True)),
+            other_summaries_pks)
+        check_summaries()
+        self.sale_receipt1.related_invoice.refresh_from_db()
+        self.assertEqual(self.sale_receipt1.related_invoice.collected_amount,
+            SaleReceipt.objects.filter(related_invoice=self.sale_receipt1.related_invoice
+            ).aggregate(total=Sum("total_amount"))["total"])
+
+        # A summary created by other process meanwhile is added to.
+        month = datetime.date(2024, 6, 1)
+        with self.create_before_update(SaleReceiptSummary(month=month,
+                point_of_sell=self.pos1, count=1, total_amount=Decimal("1"))):
+            SaleReceiptSummary.add([((datetime.date(2024, 6, 5), self.pos1.pk,
+                "10"), 1)])
+        summary = SaleReceiptSummary.objects.get(month=month, point_of_sell=self.pos1)
+        self.assertEqual((summary.count, summary.total_amount), (2, Decimal("11")))
+
     def test_receivables_new_receipt_get_webpage(self):
         self.create_extra_pos()
         self.assertEqual(PointOfSell.objects.count(), 4)
@@ -2072,6 +2646,39 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
             page_content)
         self.assertEqual(len(ClientCurrentAccount.objects.all()), 14)
 
+
+    def test_receivables_new_massive_receipt_post_wrong_accumulated_amount(self):
+        self.create_extra_invoices()
+        file = get_file(
+            "erp/tests/files/receivables/receipt_multiple_wrong_amount.csv"
+        )
+
+        page_content = self.check_page_post_response("erp:receivables_new_massive",
+            {"file": file}, 400, (SaleReceipt, 1))
+
+        # Receipts of the same file are added to the invoice's collected amount
+        self.assertIn("Row 3, general: The sum of your receipts cannot be higher",
+            page_content)
+        self.sale_invoice5.refresh_from_db()
+        self.assertEqual(self.sale_invoice5.collected, False)
+        self.assertEqual(len(ClientCurrentAccount.objects.all()), 14)
+
+    def test_receivables_new_massive_receipt_query_count(self):
+        self.create_extra_invoices()
+        file = get_file("erp/tests/files/receivables/receipt_multiple.xlsx")
+
+        # The file is checked and queued without saving any row.
+        with CaptureQueriesContext(connection) as queries, \
+                patch("erp.views.submit_import_job") as submit_import_job:
+            self.check_page_post_response("erp:receivables_new_massive",
+                {"file": file}, 302)
+        self.assertLess(len(queries), 10)
+
+        # Related invoices and receipts are queried and saved in bulk.
+        with CaptureQueriesContext(connection) as queries:
+            run_import_job(submit_import_job.call_args.args[0].pk)
+        self.assertLess(len(queries), 45)
+        self.assertEqual(SaleReceipt.objects.count(), 6)
     
     def test_receivables_receipt_webpage(self):
         self.check_page_get_response(
@@ -2291,6 +2898,41 @@ class ErpTestCase(CreateDbInstancesMixin, BackBaseTest):
         for page_content in ["25/01/2024", "25/01/2025", "$ 3817.11", "$ 138.09"]:
             self.assertContains(response, page_content)
 
+    def test_client_current_account_snapshots(self):
+        self.change_current_year(2025)
+        self.create_extra_receipts()
+        cutoff = datetime.date(2025, 1, 25)
+        snapshot_date = datetime.date(2024, 12, 31)
+
+        balances = get_clients_balance(cutoff)
+        self.assertEqual(sum(client["global_balance"] for client in balances),
+            Decimal("138.09"))
+        self.assertTrue(ClientBalanceSnapshot.objects.filter(
+            client=self.c_client1, date=snapshot_date).exists())
+
+        # A back-dated change deletes the snapshots after it
+        self.sale_receipt1.delete()
+        self.assertFalse(ClientBalanceSnapshot.objects.filter(
+            client=self.c_client1, date=snapshot_date).exists())
+        self.assertTrue(ClientBalanceSnapshot.objects.filter(
+            client=self.c_client2, date=snapshot_date).exists())
+
+        balances = get_clients_balance(cutoff)
+        self.assertEqual(sum(client["global_balance"] for client in balances),
+            Decimal("2647.10"))
+
+    def test_query_plans_command(self):
+        clients = CompanyClient.objects.count()
+        output = StringIO()
+        call_command("query_plans", "--rows", "400", "--repeat", "1",
+            stdout=output)
+
+        self.assertIn("USING INDEX sale_invoice_uncollected_idx", output.getvalue())
+        self.assertIn("USING COVERING INDEX client_ca_client_date_idx",
+            output.getvalue())
+        # Seeded rows are rolled back
+        self.assertEqual(CompanyClient.objects.count(), clients)
+
     def test_client_current_account_cutoff_error(self):
         self.create_extra_receipts()
 
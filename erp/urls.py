@@ -66,15 +66,25 @@ urlpatterns = [
         name="receivables_search"),
     # Show receipt list
     path("receivables/receipts/list", views.receivables_list, name="receipt_list"),
+    # Status of a massive upload
+    path("import_jobs/<int:job_pk>", views.import_job, name="import_job"),
+    path("import_jobs/<int:job_pk>/retry", views.import_job_retry,
+        name="import_job_retry"),
 
     # Clients APIs
     path("api/clients", views_api.CompanyClientAPI.as_view(), name="clients_api"),
+    path("api/clients/search", views_api.CompanyClientSearchAPI.as_view(),
+        name="clients_search_api"),
+    path("api/clients/ranking", views_api.CompanyClientRankingAPI.as_view(),
+        name="clients_ranking_api"),
     path("api/clients/bulk_delete", views_api.CompanyClientDeleteAPI.as_view(),
         name="clients_delete_api"),
     path("api/clients/<int:pk>", views_api.DetailCompanyClientAPI.as_view(), 
         name="client_api"),
     # Suppliers APIS
     path("api/suppliers", views_api.SupplierAPI.as_view(), name="suppliers_api"),
+    path("api/suppliers/search", views_api.SupplierSearchAPI.as_view(),
+        name="suppliers_search_api"),
     path("api/suppliers/bulk_delete", views_api.SupplierDeleteAPI.as_view(),
         name="suppliers_delete_api"),
     path("api/suppliers/<int:pk>", views_api.DetailSupplierAPI.as_view(), 
@@ -101,6 +111,10 @@ urlpatterns = [
     # Sale invoices APIs
     path("api/sale_invoices", views_api.SaleInvoicesAPI.as_view(), 
         name="sale_invoices_api"),
+    path("api/sale_invoices/search_index", views_api.SaleInvoicesSearchAPI.as_view(), 
+        name="sale_invoices_search_api"),
+    path("api/sale_invoices/bulk_create", views_api.SaleInvoicesBulkCreateAPI.as_view(), 
+        name="sale_invoices_create_api"),
     path("api/sale_invoices/bulk_delete", views_api.SaleInvoicesDeleteAPI.as_view(), 
         name="sale_invoices_delete_api"),
     path("api/sale_invoices/<int:pk>", views_api.SaleInvoiceAPI.as_view(), 
@@ -108,10 +122,22 @@ urlpatterns = [
     # Sale receipts APIs
     path("api/sale_receipts", views_api.SaleReceiptsAPI.as_view(), 
         name="sale_receipts_api"),
+    path("api/sale_receipts/search_index", views_api.SaleReceiptsSearchAPI.as_view(), 
+        name="sale_receipts_search_api"),
     path("api/sale_receipts/bulk_delete", views_api.SaleReceiptsDeleteAPI.as_view(), 
         name="sale_receipts_delete_api"),
     path("api/sale_receipts/<int:pk>", views_api.SaleReceiptAPI.as_view(), 
         name="sale_receipt_api"),
+    # Sales analytics APIs
+    path("api/sales_cube", views_api.SalesCubeAPI.as_view(), 
+        name="sales_cube_api"),
+    # Import jobs APIs
+    path("api/import_jobs", views_api.ImportJobsAPI.as_view(), 
+        name="import_jobs_api"),
+    path("api/import_jobs/<int:pk>", views_api.ImportJobAPI.as_view(), 
+        name="import_job_api"),
+    path("api/import_jobs/<int:pk>/retry", views_api.ImportJobRetryAPI.as_view(),
+        name="import_job_retry_api"),
 
 
 ]
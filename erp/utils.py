@@ -1,42 +1,92 @@
 """Reutilizable functions for views.py in ERP app"""
+import openpyxl
 import pandas as pd
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Sum
+from django.db import connection, models, transaction
+from django.db.models import Count, Sum
 from django.http import HttpResponseBadRequest
+from django.utils import timezone
+from itertools import chain, islice
 
 
 
-from company.models import Company
-from .models import (SaleInvoice, SaleInvoiceLine, PaymentMethod, PaymentTerm,
-    PointOfSell, DocumentType, CompanyClient, SaleReceipt)
+from company.utils import get_company
+from .models import (ClientCurrentAccount, ClientBalanceSnapshot, CompanyClient,
+    BATCH_SIZE)
+from .validators import validate_is_digit
 
-def update_invoice_collected_status(invoice):
-    """Check and update invoice's collected attribute"""
-    receipts = SaleReceipt.objects.filter(related_invoice=invoice
-    ).aggregate(total=Sum("total_amount")) 
-    
-    # If there's no instance
-    receipt_total = receipts["total"] or 0
-
-    if invoice.total_lines_sum() - receipt_total == 0:
-        return True
-    else:
-        return False
 
+# Max number of rows read from an uploaded file at once
+FILE_CHUNK_SIZE = 5000
 
-def read_uploaded_file(file, date_column=None):
-    """Read csv, xls or xlsx files"""
+def read_uploaded_file(file, date_column=None, chunksize=FILE_CHUNK_SIZE):
+    """
+    Read csv, xls or xlsx files in dataframes of chunksize rows, so csv and
+    xlsx files are never loaded completely. xls files can't be read by rows,
+    so they are loaded whole and then split, but they are limited to 65536
+    rows by their format.
+    """
     if(file.name.endswith(".csv")):
         if date_column:
             # Pandas truncate cells in csv files and read them as string,
             # therefore I read them as date types.
-            return pd.read_csv(file, parse_dates=[date_column], dayfirst=True)
+            yield from pd.read_csv(file, parse_dates=[date_column], dayfirst=True,
+                chunksize=chunksize)
         else:
-            return pd.read_csv(file)
+            yield from pd.read_csv(file, chunksize=chunksize)
+    elif(file.name.endswith(".xlsx")):
+        # Read only mode iterates the rows without loading the whole sheet.
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            columns = next(rows, ())
+            # Skip blank rows, as read_excel does.
+            rows = (
+                tuple(map(convert_excel_value, row)) for row in rows 
+                if any(value is not None for value in row)
+            )
+            start = 0
+            while True:
+                chunk = list(islice(rows, chunksize))
+                # Return at least an empty dataframe to check its columns.
+                if not chunk and start:
+                    break
+                yield pd.DataFrame(chunk, columns=columns,
+                    index=range(start, start + len(chunk)))
+                start += len(chunk)
+                if len(chunk) < chunksize:
+                    break
+        finally:
+            workbook.close()
     else:
-        return pd.read_excel(file)
+        df = pd.read_excel(file)
+        for start in range(0, max(len(df), 1), chunksize):
+            yield df[start:start + chunksize]
+
+def convert_excel_value(value):
+    """Convert integer floats of an excel cell into int, as read_excel does"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def read_standarized_chunks(file, columns_len, field_list, date_column=None):
+    """
+    Read an uploaded file in standarized chunks of FILE_CHUNK_SIZE rows.
+    The columns are checked with the first chunk, before importing any row.
+    Raises:
+    - ValueError: If the columns don't match the required format.
+    Returns:
+    - Iterator of standarized dataframes.
+    """
+    # Files can be read more than once, I.E. to check them before importing.
+    file.seek(0)
+    chunks = read_uploaded_file(file, date_column, chunksize=FILE_CHUNK_SIZE)
+    first_chunk = next(chunks)
+    check_column_len(first_chunk, columns_len)
+    first_chunk = standarize_dataframe(first_chunk)
+    check_column_names(first_chunk, field_list)
+    return chain([first_chunk], map(standarize_dataframe, chunks))
 
 def list_file_errors(error_type, row_index):
     """Catch and return all validation errors from a file row"""
@@ -73,56 +123,184 @@ def get_model_fields_name(model, *exclude):
             model_fields_name.remove(value)
     return model_fields_name
 
-def get_sale_invoice_objects(total_fields, total_fields_row, index,
-    commercial_document=""):
-    """Get all objects from fields that are related with other models"""
-    
-    get_object_from_subfield("point_of_sell", PointOfSell, total_fields,
-        total_fields_row, index, "pos_number", value_function=lambda x: x.zfill(5))
-    get_object_from_subfield("sender", Company, total_fields,
-        total_fields_row, index, "tax_number")
-    get_object_from_subfield("recipient", CompanyClient, total_fields,
-        total_fields_row, index, "tax_number")    
-    
-    if commercial_document == "invoice":
-        get_object_from_subfield("type", DocumentType, total_fields,
-        total_fields_row, index, "code", value_function=lambda x: x.zfill(3))
-        get_object_from_subfield("payment_method", PaymentMethod, total_fields,
-        total_fields_row, index, "pay_method", 
-        value_function=lambda x: x.capitalize())
-        get_object_from_subfield("payment_term", PaymentTerm, total_fields,
-        total_fields_row, index, "pay_term")
-      
-    elif commercial_document == "receipt":
-        get_object_from_subfield("ri_type", DocumentType, total_fields,
-        total_fields_row, index, "code", value_function=lambda x: x.zfill(3))
-        get_object_from_subfield("ri_pos", PointOfSell, total_fields,
-        total_fields_row, index, "pos_number", value_function=lambda x: x.zfill(5))
-        
-    return total_fields_row
-    
-    
-def get_object_from_subfield(column, model, columns, row, index, subfield,
-    value_function=None):
-    """Get the object of a model using subfields and raise ValueError with details
-    if it doesn't work."""
-    try:
+def get_dataframe_rows(df, fields):
+    """
+    Get the rows of a dataframe as lists of strings, to allow using validators.
+    Returns:
+    - Iterator of tuples: (row index, list of the row's values in fields order).
+    """
+    rows = df[fields].astype(str).itertuples(index=False, name=None)
+    return zip(df.index, map(list, rows))
+
+def get_objects_by_subfield(model, subfield, values):
+    """
+    Get all the objects of a model whose subfield is in values with one IN
+    query. Values are only split when they exceed the DB's parameters limit.
+    Returns:
+    - Dict: {subfield value: object}
+    """
+    values = list(set(values))
+    batch_size = connection.features.max_query_params or len(values) or 1
+
+    objects = {}
+    for start in range(0, len(values), batch_size):
+        # Create a dict to pass it dinamically as otherwise filter doesn't work.
+        lookup_field = {f"{subfield}__in": values[start:start + batch_size]}
+        for instance in model.objects.filter(**lookup_field):
+            objects[getattr(instance, subfield)] = instance
+    return objects
+
+def get_related_objects(related_fields, related_objects, column_values):
+    """
+    Get the objects of every related column in a file with one query per model.
+    Values whose objects were already got are not queried again.
+    Parameters:
+    - related_fields: Tuple of (column, model, subfield, value_function).
+    - related_objects: Dict of the objects got before. It's updated.
+    - column_values: Function that returns the raw values of a column.
+    Returns:
+    - Dict: {column: {formatted value: object}}
+    """
+    for column, model, subfield, value_function in related_fields:
+        values = column_values(column)
+        if value_function:
+            values = map(value_function, values)
+        objects = related_objects.setdefault(column, {})
+        objects.update(get_objects_by_subfield(model, subfield,
+            set(values) - objects.keys()))
+    return related_objects
+
+def replace_related_objects(related_fields, related_objects, columns, row, index):
+    """
+    Replace the related values of a row with the objects got in
+    get_related_objects and raise ValueError with details if one doesn't exist.
+    """
+    for column, _, _, value_function in related_fields:
         column_index = columns.index(column)
         value = row[column_index]
-        
         if value_function:
             value = value_function(value)
-        # Create a dict to pass it dinamically as otherwise objects.get doesn't work.
-        lookup_field = {f"{subfield}": value}
-        row[column_index] = model.objects.get(**lookup_field)
-        return row
-    except ObjectDoesNotExist:
-        error_message = (
-            f"The input in row {index + 2} and column "
-            f"{column} doesn't exist in the records."
+        try:
+            row[column_index] = related_objects[column][value]
+        except KeyError:
+            raise ValueError(get_missing_object_message(column, index))
+    return row
+
+def get_missing_object_message(column, index):
+    """Get the error of a related value that doesn't exist in the DB"""
+    return (
+        f"The input in row {index + 2} and column "
+        f"{column} doesn't exist in the records."
+    )
+
+def get_suspected_invalid_cells(values, field):
+    """
+    Get the cells of a column that may not pass a field's validation, checking
+    the whole column at once. The checks are wider than the field's validators,
+    so suspected cells must be confirmed with the field.
+    Parameters:
+    - values: Series of strings.
+    - field: CharField or DecimalField of a model.
+    Returns:
+    - Boolean series.
+    """
+    if isinstance(field, models.DecimalField):
+        numbers = values.str.strip().str.extract(r"^[+-]?0*(\d*)(?:\.(\d*))?$")
+        whole_digits = numbers[0].str.len()
+        decimal_places = numbers[1].fillna("").str.len()
+        return (
+            pd.to_numeric(values, errors="coerce").isna() | numbers[0].isna() |
+            (decimal_places > field.decimal_places) |
+            (whole_digits > field.max_digits - field.decimal_places)
         )
-        raise ValueError(error_message)
-    
+
+    suspected = pd.Series(False, index=values.index)
+    if not field.blank:
+        suspected |= values == ""
+    if isinstance(field, models.EmailField):
+        suspected |= ~values.str.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+    if field.max_length:
+        suspected |= values.str.len() > field.max_length
+    if validate_is_digit in field.validators:
+        suspected |= ~values.str.isdigit()
+    return suspected
+
+def get_snapshot_date(cutoff):
+    """Get the last month end on or before a cutoff date"""
+    next_day = cutoff + relativedelta(days=1)
+    if next_day.day == 1:
+        return cutoff
+    return cutoff.replace(day=1) - relativedelta(days=1)
+
+def get_balance_snapshots(snapshot_date):
+    """
+    Get the balance of every client at a month end, creating the snapshots that
+    don't exist yet or were invalidated.
+    Returns:
+    - Queryset of snapshots' dicts.
+    """
+    # Movements saved between the sums and the snapshots' creation would be
+    # missing from them, so both are done in one transaction.
+    with transaction.atomic():
+        missing_clients = list(CompanyClient.objects.exclude(
+            balance_snapshots__date=snapshot_date).values_list("pk", flat=True))
+        if missing_clients:
+            # Only the movements of clients without snapshot are added.
+            balances = {
+                row["client"]: row for row in ClientCurrentAccount.objects.filter(
+                    date__lte=snapshot_date).exclude(
+                        client__balance_snapshots__date=snapshot_date
+                    ).values("client").annotate(
+                        balance=Sum("amount"), movements=Count("id")
+                    ).order_by()
+            }
+            ClientBalanceSnapshot.objects.bulk_create([
+                ClientBalanceSnapshot(
+                    client_id = client,
+                    date = snapshot_date,
+                    balance = balances.get(client, {}).get("balance") or 0,
+                    movements = balances.get(client, {}).get("movements", 0),
+                ) for client in missing_clients
+            ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    return ClientBalanceSnapshot.objects.filter(date=snapshot_date).values(
+        "client", "client__name", "client__tax_number", "balance", "movements")
+
+def get_clients_balance(cutoff=None):
+    """
+    Get the current account balance of each client at a cutoff date, adding the
+    movements after the last month end to its balance snapshot.
+    Input:
+        - cutoff: Date of the balance. Without it, all movements are included.
+    Returns:
+        - List of dicts: {client, client__name, client__tax_number, 
+        global_balance}, of clients with movements and ordered by balance.
+    """
+    snapshot_date = get_snapshot_date(cutoff or timezone.localdate())
+    clients = {
+        snapshot["client"]: snapshot for snapshot in get_balance_snapshots(
+            snapshot_date)
+    }
+
+    movements = ClientCurrentAccount.objects.filter(date__gt=snapshot_date)
+    if cutoff:
+        movements = movements.filter(date__lte=cutoff)
+    for row in movements.values("client").annotate(
+        balance=Sum("amount"), movements=Count("id")).order_by():
+        clients[row["client"]]["balance"] += row["balance"]
+        clients[row["client"]]["movements"] += row["movements"]
+
+    clients_balance = [
+        {
+            "client": client["client"],
+            "client__name": client["client__name"],
+            "client__tax_number": client["client__tax_number"],
+            "global_balance": client["balance"],
+        } for client in clients.values() if client["movements"]
+    ]
+    return sorted(clients_balance, key=lambda client: client["global_balance"],
+        reverse=True)
+
 def get_financial_calendar_dates(year_type, current_year):
     """
     Get both financial and calendar dates.
@@ -132,7 +310,7 @@ def get_financial_calendar_dates(year_type, current_year):
     Returns:
         - Tuple of two dics: current year {start, end} and previous year {start, end}
     """
-    closing_date = Company.objects.first().closing_date
+    closing_date = get_company().closing_date
 
     # Set date range
     if year_type == "financial":
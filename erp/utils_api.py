@@ -1,7 +1,25 @@
 """Utils for ERP views_api"""
+import base64, json
+import pandas as pd
+from datetime import date
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.db.models.deletion import RestrictedError
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import TableVersion, BATCH_SIZE
+from .serializers import (baseDynamicSerializer, get_dynamic_serializer,
+    SaleInvoiceLineBatchSerializer)
 
 
 def handle_multiple_instances(self, request):
@@ -34,15 +52,147 @@ def return_conflict_status(message):
         "code": "restricted_error"
     }, status=status.HTTP_409_CONFLICT)
 
+def filter_collected(queryset, collected):
+    """Filter invoices by the collected query param, if it's true or false"""
+    if collected:
+        if collected.lower() == "true":
+            return queryset.filter(collected=True)
+        elif collected.lower() == "false":
+            return queryset.filter(collected=False)
+    return queryset
+
+def get_invoice_lines_dataframe(invoices, fields, sender):
+    """
+    Flatten invoices with nested lines into a dataframe with a row per line, as
+    the rows of an invoices file, to import them with SaleInvoiceImporter.
+    Parameters:
+    - invoices: List of validated data of SaleInvoiceBatchSerializer.
+    - fields: Columns of the importer.
+    - sender: Default sender's tax number.
+    Returns:
+    - Dataframe of strings.
+    """
+    rows = []
+    for invoice in invoices:
+        invoice_row = {field: str(value) for field, value in invoice.items()
+            if field != "lines"}
+        invoice_row.setdefault("sender", sender)
+        for line in invoice["lines"]:
+            rows.append({**invoice_row,
+                **{field: str(value) for field, value in line.items()}})
+    return pd.DataFrame(rows, columns=fields)
+
+def get_invoices_errors(file_errors, invoices):
+    """
+    Group the errors of the rows of an invoices file by their invoice.
+    Parameters:
+    - file_errors: Errors of FileError, by row.
+    - invoices: List of validated data of SaleInvoiceBatchSerializer, as they
+    were flattened by get_invoice_lines_dataframe.
+    Returns:
+    - List of {index, errors}, where errors are {field: [messages]} and errors
+    of the lines' fields are in lines as [{index, errors}].
+    """
+    # (invoice index, line index) of each row
+    rows = [(index, line_index) for index, invoice in enumerate(invoices)
+        for line_index, _ in enumerate(invoice["lines"])]
+    line_fields = SaleInvoiceLineBatchSerializer().fields.keys()
+    errors = {}
+    for row_index, row_errors in file_errors.items():
+        index, line_index = rows[row_index]
+        for column, message, _ in row_errors:
+            field = column if column not in (None, "general") else (
+                api_settings.NON_FIELD_ERRORS_KEY)
+            invoice_errors = errors.setdefault(index, {})
+            if field in line_fields:
+                invoice_errors = invoice_errors.setdefault("lines", {}).setdefault(
+                    line_index, {})
+            # Invoice fields are repeated in the rows of each line.
+            messages = invoice_errors.setdefault(field, [])
+            if message not in messages:
+                messages.append(message)
+
+    for invoice_errors in errors.values():
+        if "lines" in invoice_errors:
+            invoice_errors["lines"] = [{"index": index, "errors": line_errors}
+                for index, line_errors in sorted(invoice_errors["lines"].items())]
+    return [{"index": index, "errors": invoice_errors}
+        for index, invoice_errors in sorted(errors.items())]
+
+def get_prefix_filter(field, prefix):
+    """
+    Filter the values of a field that start with prefix as a range, so the
+    field's index can be used.
+    """
+    # Highest unicode character, so every value with the prefix is lower.
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + "\U0010ffff"})
+
+def filter_documents(queryset, params):
+    """
+    Filter invoices or receipts by the search query params. Text params are
+    prefixes, so they are searched as ranges of the indexes.
+    Parameters:
+    - queryset: SaleInvoice or SaleReceipt queryset.
+    - params: Query params. pos, number, client_name, client_tax_number, year,
+    month and type (only invoices).
+    Returns:
+    - Filtered queryset.
+    """
+    pos = params.get("pos", "").strip()
+    if pos.isdigit():
+        queryset = queryset.filter(point_of_sell__pos_number=pos.zfill(5))
+    
+    number = params.get("number", "").strip()
+    if number:
+        queryset = queryset.filter(get_prefix_filter("number", number))
+    
+    # Names are saved in upper case.
+    client_name = params.get("client_name", "").strip().upper()
+    if client_name:
+        queryset = queryset.filter(get_prefix_filter("recipient__name", client_name))
+    
+    tax_number = params.get("client_tax_number", "").strip()
+    if tax_number:
+        queryset = queryset.filter(get_prefix_filter("recipient__tax_number",
+            tax_number))
+
+    doc_type = params.get("type", "").strip().upper()
+    if doc_type and hasattr(queryset.model, "type"):
+        queryset = queryset.filter(type__type=doc_type)
+    
+    year = params.get("year", "").strip()
+    month = params.get("month", "").strip()
+    month = int(month) if month.isdigit() and 1 <= int(month) <= 12 else None
+    if year.isdigit() and 1 <= int(year) <= 9999:
+        # Dates are filtered as a range of the issue date index.
+        start = date(int(year), month or 1, 1)
+        if month and month < 12:
+            end = date(int(year), month + 1, 1)
+        elif int(year) < 9999:
+            end = date(int(year) + 1, 1, 1)
+        else:
+            end = None
+        queryset = queryset.filter(issue_date__gte=start)
+        if end:
+            queryset = queryset.filter(issue_date__lt=end)
+    elif month:
+        queryset = queryset.filter(issue_date__month=month)
+
+    return queryset
+
 class SerializerMixin:
     def get_serializer(self, *args, **kwargs):
-        # Add 'fields' to serializer init if picked SIDynamicSerilizer.
+        # Use the cached class with only the picked fields if picked a dynamic
+        # serializer.
+        serializer_class = self.get_serializer_class()
         fields = self.request.query_params.get("fields", None)
-        if fields:
-            kwargs['fields'] = fields.split(",")
+        if fields and issubclass(serializer_class, baseDynamicSerializer):
+            serializer_class = get_dynamic_serializer(serializer_class,
+                fields.split(","))
+        kwargs.setdefault("context", self.get_serializer_context())
         
         # Return an instance of the selected serializer class
-        return self.get_serializer_class()(*args, **kwargs)
+        return serializer_class(*args, **kwargs)
 
     def get_serializer_class(self):
         # Este método debe ser sobrescrito en la clase que lo hereda
@@ -71,6 +221,78 @@ class BulkDeleteMixin:
             {"Deletions": deleted_count}, status=status.HTTP_204_NO_CONTENT
         )
 
+class BulkUpdateMixin:
+    """
+    Mixin that allows the views to update multiple instances in one interaction.
+    The data is a list of {id, ...fields}, validated by the view's serializer as
+    partial updates. If every item is valid, they are saved with bulk_update in
+    one transaction, otherwise nothing is saved.
+    Returns:
+    - Response: {"results": [{id, status, errors}]} with status 200, or 400
+    if any item is wrong.
+    """
+    # Max number of items updated in one request
+    max_bulk_update = 1000
+
+    def patch(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"error": "No items provided"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > self.max_bulk_update:
+            return Response(
+                {"error": f"Up to {self.max_bulk_update} items can be updated."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ids = [item.get("id") for item in items if isinstance(item, dict)]
+        instances = self.get_queryset().in_bulk(
+            [pk for pk in ids if isinstance(pk, int)])
+        results, updated, fields, seen_ids = [], [], set(), set()
+        for item in items:
+            pk = item.get("id") if isinstance(item, dict) else None
+            if pk not in instances:
+                results.append({"id": pk, "status": "not_found"})
+                continue
+            if pk in seen_ids:
+                results.append({"id": pk, "status": "invalid",
+                    "errors": {"id": ["This id is repeated."]}})
+                continue
+            seen_ids.add(pk)
+            serializer = self.get_serializer(instances[pk], data=item, partial=True)
+            if not serializer.is_valid():
+                results.append({"id": pk, "status": "invalid",
+                    "errors": serializer.errors})
+                continue
+            for field, value in serializer.validated_data.items():
+                setattr(instances[pk], field, value)
+            if hasattr(instances[pk], "format_fields"):
+                instances[pk].format_fields()
+            fields.update(serializer.validated_data)
+            updated.append(instances[pk])
+            results.append({"id": pk, "status": "updated"})
+
+        if len(updated) < len(items):
+            return Response({"results": results},
+                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                if fields:
+                    self.perform_bulk_update(updated, sorted(fields))
+        except IntegrityError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def perform_bulk_update(self, instances, fields):
+        """
+        Save the changed fields of the instances. Signals aren't sent by
+        bulk_update, so the cached responses of the model are invalidated here.
+        """
+        model = self.get_queryset().model
+        model.objects.bulk_update(instances, fields, batch_size=BATCH_SIZE)
+        TableVersion.bump(model)
+
 class DeleteConflictMixin:
     """
     Mixin that handle different deletion conflicts according to the error type.
@@ -83,4 +305,223 @@ class DeleteConflictMixin:
         try:
             return super().destroy(request, *args, **kwargs)
         except RestrictedError as e:
-            return return_conflict_status(RestrictedError)
\ No newline at end of file
+            return return_conflict_status(RestrictedError)
+
+class ConditionalGetMixin:
+    """
+    Mixin that answers GET requests with 304 Not Modified while the tables of
+    the response don't change. ETag and Last-Modified are got from the versions
+    of versioned_models, so unchanged responses aren't built again.
+    """
+    versioned_models = []
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = TableVersion.get_state(*self.versioned_models)
+        response = condition(
+            etag_func=lambda request, *args, **kwargs: etag,
+            last_modified_func=lambda request, *args, **kwargs: last_modified,
+        )(super().get)(request, *args, **kwargs)
+        # Browsers must check the version before using their copy.
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class StreamingListMixin:
+    """
+    Mixin that streams a list as a JSON array when stream=true is in the query
+    params. Rows are read with an iterator and serialized by chunks, so a big
+    list doesn't have to fit in memory and the first rows are sent right away.
+    """
+    stream_query_param = "stream"
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param) != "true":
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self.stream_rows(queryset),
+            content_type="application/json")
+
+    def stream_rows(self, queryset):
+        """
+        Yield a JSON array of the serialized queryset.
+        Returns:
+        - Generator of bytes.
+        """
+        renderer = JSONRenderer()
+        yield b"["
+        chunk = []
+        first = True
+        for row in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.stream_chunk_size:
+                yield (b"" if first else b",") + self.render_chunk(renderer, chunk)
+                chunk, first = [], False
+        if chunk:
+            yield (b"" if first else b",") + self.render_chunk(renderer, chunk)
+        yield b"]"
+
+    def render_chunk(self, renderer, rows):
+        """Get the serialized rows as JSON, without the brackets of the array"""
+        return renderer.render(self.get_serializer(rows, many=True).data)[1:-1]
+
+
+class PagePagination(PageNumberPagination):
+    """
+    Paginate a queryset by page number. It's the default pagination of the
+    list APIs. Lists are only paginated when page or page_size are in the query
+    params, so the JS lists still get the whole table.
+    With count=false the total isn't counted, as counting a big table costs
+    more than getting a page. Then, only next and previous are returned.
+    """
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (self.page_query_param not in params
+            and self.page_size_query_param not in params):
+            return None
+        # Pages of an unordered queryset could repeat rows.
+        if not queryset.ordered:
+            queryset = queryset.order_by("pk")
+
+        self.counted = params.get(self.count_query_param) != "false"
+        if self.counted:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.number = int(params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound("Invalid page.")
+        if self.number < 1:
+            raise NotFound("Invalid page.")
+
+        # Get one more row to know if there is a next page.
+        start = (self.number - 1) * page_size
+        rows = list(queryset[start:start + page_size + 1])
+        if not rows and self.number > 1:
+            raise NotFound("Invalid page.")
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.counted:
+            return super().get_paginated_response(data)
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_next_link(self):
+        if self.counted:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+            self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.counted:
+            return super().get_previous_link()
+        if self.number == 1:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+            self.page_query_param, self.number - 1)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate a queryset by the values of its ordering fields in the last row of
+    the page, so every page is a range search no matter how deep it is.
+    The ordering must identify each row, I.E. end with a complete number.
+    Lists are only paginated when page_size or cursor are in the query params.
+    """
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    default_page_size = 100
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (self.page_size_query_param not in params 
+            and self.cursor_query_param not in params):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(params)
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        # (field name, attribute name, descending)
+        self.ordering = [
+            (name.lstrip("-"), queryset.model._meta.get_field(
+                name.lstrip("-")).attname, name.startswith("-"))
+            for name in ordering
+        ]
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_after_filter(
+                self.decode_cursor(cursor)))
+
+        # Get one more row to know if there is a next page.
+        rows = list(queryset[:self.page_size + 1])
+        self.next_values = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_values = [getattr(rows[-1], attname)
+                for _, attname, _ in self.ordering]
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        cursor = base64.urlsafe_b64encode(json.dumps(self.next_values,
+            cls=DjangoJSONEncoder).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(),
+            self.cursor_query_param, cursor)
+
+    def get_page_size(self, params):
+        """Get the page size of the query params, limited by max_page_size"""
+        try:
+            page_size = int(params.get(self.page_size_query_param, 
+                self.default_page_size))
+        except ValueError:
+            return self.default_page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, cursor):
+        """Get the ordering values of the previous page's last row"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor.")
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound("Invalid cursor.")
+        return values
+
+    def get_after_filter(self, values):
+        """Filter the rows after the given ordering values"""
+        after = Q()
+        equal = Q()
+        for (name, _, descending), value in zip(self.ordering, values):
+            lookup = "lt" if descending else "gt"
+            after |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return after
@@ -3,8 +3,6 @@ from datetime import datetime
 from decimal import Decimal
 from django.core.exceptions import ValidationError
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Sum
-from django.apps import apps
 
 
 def validate_is_digit(value):
@@ -19,10 +17,10 @@ def validate_file_extension(value):
 
 def validate_in_current_year(value):
     """Check that the inpt year is in the current financial year"""
-    financial_year = apps.get_model("company", "FinancialYear")
-    try:
-        current_year = financial_year.objects.get(current=True)
-    except ObjectDoesNotExist:
+    # Imported here, as company models use these validators.
+    from company.utils import get_current_year
+    current_year = get_current_year()
+    if current_year is None:
         raise ValidationError("First you have to set the current financial year.")
     
     if value.year != int(current_year.year):
@@ -88,11 +86,10 @@ def validate_receipt_total_amount(model, instance):
         )
 
     """Check validator"""
-    receipts = model.objects.filter(related_invoice=instance.related_invoice
-        ).exclude(pk=instance.pk).aggregate(total=Sum("total_amount")
-    )
-    # Case: First receipt
-    receipts_total = receipts["total"] or 0
+    receipts_total = instance.related_invoice.collected_amount
+    # An edited receipt is already included in its saved invoice.
+    if getattr(instance, "saved_related_invoice_id", None) == instance.related_invoice.pk:
+        receipts_total -= instance.saved_total_amount
   
     if (receipts_total + instance.total_amount) > invoice_total:
         raise ValidationError(
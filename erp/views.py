@@ -2,12 +2,10 @@ import csv, os
 import pandas as pd
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
-from decimal import Decimal
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
-from django.db import transaction, IntegrityError
-from django.db.models import Sum, F, Count
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models import Sum, F
 from django.http import HttpResponseRedirect, Http404, HttpResponseBadRequest
 from django.shortcuts import render
 from django.urls import reverse
@@ -15,56 +13,42 @@ from pathlib import Path
 
 
 
-from company.models import FinancialYear, PersonModel
+from company.models import FinancialYear
+from company.utils import get_current_year
 from .forms import (CclientForm, SupplierForm, PaymentMethodForm, PaymentTermForm, 
     PointOfSellForm, SaleInvoiceForm, SaleInvoiceLineFormSet, SearchInvoiceForm,
     AddPersonFileForm, AddSaleInvoicesFileForm, SearchByYearForm, SearchByDateForm,
     SaleReceiptForm, SearchReceiptForm, AddSaleReceiptsFileForm, cutOffDateForm)
 from .models import (Company, CompanyClient, Supplier, PaymentMethod, 
-    PaymentTerm, PointOfSell, DocumentType, SaleInvoice, SaleInvoiceLine,
-    SaleReceipt, PurchaseInvoice, PurchaseReceipt, ClientCurrentAccount)
-from .utils import (read_uploaded_file, check_column_len, standarize_dataframe,
-check_column_names, list_file_errors, get_model_fields_name, get_sale_invoice_objects,
-update_invoice_collected_status, get_financial_calendar_dates)
-
+    PaymentTerm, PointOfSell, DocumentType, SaleInvoice, SaleReceipt,
+    PurchaseInvoice, PurchaseReceipt, ImportJob)
+from .importers import get_file_importer
+from .jobs import submit_import_job, retry_import_job
+from .services import (get_sales_dashboard, get_receivables_dashboard,
+    get_clients_dashboard)
+from .utils import read_standarized_chunks, get_clients_balance
+
+
+# Related objects shown in each row of the lists, got with the rows' query
+INVOICE_LIST_RELATED = ("type", "point_of_sell", "recipient", "payment_method",
+    "payment_term")
+RECEIPT_LIST_RELATED = ("point_of_sell", "recipient", "related_invoice__type",
+    "related_invoice__point_of_sell")
+MOVEMENT_LIST_RELATED = ("invoice__type", "invoice__point_of_sell",
+    "receipt__point_of_sell")
 
 # Create your views here.
 
 def client_index(request):
     """Client's overview page"""
 
-    # Get total clients
-    clients = CompanyClient.objects.all()
-
-    # Get global sums of sales and receuvables
-    total_sales = SaleInvoice.objects.aggregate(
-        lines_sum=Sum("s_invoice_lines__total_amount")
-    )["lines_sum"] or 0
-    total_receivables = SaleReceipt.objects.aggregate(
-        total_sum=Sum("total_amount")
-    )["total_sum"] or 0
-
-    # Add sales and transaction to each client
-    clients_with_sales = ClientCurrentAccount.objects.exclude(
-        invoice__isnull=True).values(
-            "client__id", "client__name", "client__tax_number").annotate(
-                total_sales=Coalesce(Sum("amount"), Decimal(0)),
-                transactions=Coalesce(Count('id'), 0)
-            )
-    # If there are clients, create a dict to contain all the necessary data
-    if clients:
-        clients_dict = {
-            "total_sales": total_sales,
-            "total_receivables": total_receivables,
-            "uncollected_amount": ClientCurrentAccount.objects.aggregate(
-                total_sum=Sum("amount"))["total_sum"] or 0,
-            "by_last_added": clients,
-            "by_amount": clients_with_sales.order_by("-total_sales"),
-            "by_transactions": clients_with_sales.order_by("-transactions"),
-        }
+    # Totals and rankings are read from the clients stats
+    clients_dict = None
+    if CompanyClient.objects.exists():
+        clients_dict = get_clients_dashboard()
     
     return render(request, "erp/client_index.html", {
-        "clients_dict": clients_dict or None,
+        "clients_dict": clients_dict,
     })
 
 
@@ -100,53 +84,28 @@ def person_new_multiple(request, person_type):
         if file_form.is_valid():
             file = request.FILES["file"]
             
-            # Read file according to the extension    
-            df = read_uploaded_file(file)
-            
-            # Check all columns exist and Standarize columns names and blanks
+            # Read file in chunks according to the extension, checking all
+            # columns exist and standarizing columns names and blanks
             try: 
-                check_column_len(df, 5)
-                df = standarize_dataframe(df)
-                person_fields = get_model_fields_name(PersonModel)
-                check_column_names(df, person_fields)
+                importer, columns_len, date_column = get_file_importer(person_type)
+                chunks = read_standarized_chunks(file, columns_len, importer.fields,
+                    date_column)
             except ValueError:
                 return HttpResponseBadRequest(
                     f"The columns in your file don't match the required format."
                 )
             
 
-            # Pass all values in model
+            # Reject wrong files before queuing them
             try:
-                with transaction.atomic():
-                    for index, row in df.iterrows():
-                        # Convert number fields into string to allow me using
-                        # validators
-                        person_fields_row = list(map(str, row[person_fields]))
-
-                        if person_type == "client":
-                            person_model = CompanyClient
-                        elif person_type == "supplier":
-                            person_model = Supplier
-                        new_person = person_model(
-                            tax_number = person_fields_row[0],
-                            name = person_fields_row[1],
-                            address = person_fields_row[2],    
-                            email = person_fields_row[3],
-                            phone = person_fields_row[4],
-                        )
-                        
-                        # Execute validators before saving, and show error if exists,
-                        try:
-                            new_person.full_clean()
-                            new_person.save()
-                        except ValidationError as ve:
-                            # Value error is raised for atomic transaction
-                            raise ValueError(list_file_errors(ve, index))
+                importer.check_file(chunks)
             except ValueError as ve:
                 return HttpResponseBadRequest(str(ve))
 
-            # If everything is correct
-            return HttpResponseRedirect(reverse(f"erp:{person_type}_index"))
+            # Rows are saved in background, as big files take long to import
+            job = ImportJob.objects.create(kind=person_type, file=file)
+            submit_import_job(job)
+            return HttpResponseRedirect(reverse("erp:import_job", args=[job.pk]))
         else:
             return HttpResponseBadRequest("Invalid file.")
     else:
@@ -205,8 +164,10 @@ def person_related_docs(request, person_type, person_pk):
         rec_model = PurchaseReceipt
 
     person = person_model.objects.get(pk=person_pk)
-    invoice_list = inv_model.objects.filter(recipient=person)
-    receipt_list = rec_model.objects.filter(recipient=person)
+    invoice_list = inv_model.objects.filter(recipient=person).select_related(
+        "type", "point_of_sell")
+    receipt_list = rec_model.objects.filter(recipient=person).select_related(
+        "point_of_sell")
 
     return render(request, "erp/person_related_docs.html", {
         "person_type": person_type,
@@ -217,7 +178,7 @@ def person_related_docs(request, person_type, person_pk):
 
 def person_current_account(request, person_type):
     """Clients/Supplier's current account"""
-    financial_year = FinancialYear.objects.filter(current=True).first()
+    financial_year = get_current_year()
     cur_year = int(financial_year.year)
     prev_year = int(financial_year.year) - 1
 
@@ -237,41 +198,18 @@ def person_current_account(request, person_type):
                 day = 31
                 month = 12
 
-            clients_current_ca = ClientCurrentAccount.objects.filter(
-                    date__lte=datetime(cur_year, month, day)
-            ).values("client", "client__name", 'client__tax_number').annotate(
-                global_balance=Coalesce(Sum("amount"), Decimal(0))
-            ).order_by("-date")
-        
-            clients_prev_ca = ClientCurrentAccount.objects.filter(
-                    date__lte=datetime(prev_year, month, day)
-            ).values("client", "client__name", 'client__tax_number').annotate(
-                global_balance=Coalesce(Sum("amount"), Decimal(0))
-            ).order_by("-date")
-            
-       
     else:
-        # current year cca
-        day = 31
-        month = 12
-        clients_current_ca = ClientCurrentAccount.objects.filter(
-            date__lte=datetime(cur_year, month, day)
-        ).values("client", "client__name", 'client__tax_number').annotate(
-            global_balance=Coalesce(Sum("amount"), Decimal(0))
-        ).order_by("-global_balance")
-        # previous year cca
-        clients_prev_ca = ClientCurrentAccount.objects.filter(
-            date__lte=datetime(prev_year, month, day)
-        ).values("client", "client__name", 'client__tax_number').annotate(
-            global_balance=Coalesce(Sum("amount"), Decimal(0))
-        ).order_by("-global_balance")
         # new cutoff form
         form_cutoff = cutOffDateForm()
+        day = 31
+        month = 12
+
+    # Balances are got from the month end snapshots.
+    clients_current_ca = get_clients_balance(date(cur_year, month, day))
+    clients_prev_ca = get_clients_balance(date(prev_year, month, day))
 
-    total_clients_cur = clients_current_ca.aggregate(total_sum=Sum(
-        "global_balance"))["total_sum"] or 0
-    total_clients_prev = clients_prev_ca.aggregate(total_sum=Sum(
-        "global_balance"))["total_sum"] or 0
+    total_clients_cur = sum(client["global_balance"] for client in clients_current_ca)
+    total_clients_prev = sum(client["global_balance"] for client in clients_prev_ca)
 
 
     return render(request, "erp/person_current_account.html", {
@@ -289,7 +227,8 @@ def person_ca_detail(request, person_type, person_pk):
     """Clients/Supplier's current account"""
     # current year cca
     client = CompanyClient.objects.get(pk=person_pk)
-    client_ca = client.current_account.order_by("-date")
+    movements = client.current_account.select_related(*MOVEMENT_LIST_RELATED)
+    client_ca = movements.order_by("-date")
     if request.method == "POST":
         # Search between dates
         if request.POST["form_type"] == "date":
@@ -303,7 +242,7 @@ def person_ca_detail(request, person_type, person_pk):
                     form_date.add_error(
                         "date_from", "'From' should be older than 'To'."
                     )
-                client_ca = client.current_account.filter(
+                client_ca = movements.filter(
                         date__range=(date_from, date_to)
                     ).order_by("-date")
              # Search by year
@@ -313,7 +252,7 @@ def person_ca_detail(request, person_type, person_pk):
             if form_year.is_valid():
                 input_year=form_year.cleaned_data["year"]
             
-                client_ca = client.current_account.filter(date__year=input_year).order_by(
+                client_ca = movements.filter(date__year=input_year).order_by(
                     "-date"
                 )       
     # Get method
@@ -333,7 +272,7 @@ def person_ca_detail(request, person_type, person_pk):
 
 def supplier_index(request):
     """Supplier's overview page"""
-    financial_year = FinancialYear.objects.filter(current=True).first()
+    financial_year = get_current_year()
     suppliers = Supplier.objects.all()
 
     return render(request, "erp/supplier_index.html", {
@@ -394,48 +333,19 @@ def load_doc_types():
 
 def sales_index(request):
     """Sales overview webpage"""
-    current_financial_year = int(FinancialYear.objects.filter(current=True).first().year)
-    invoice_list = SaleInvoice.objects.all()
+    current_financial_year = int(get_current_year().year)
     year_type = request.GET.get("date_at", "calendar")
 
-    # Set date range
-    cutoff_years = get_financial_calendar_dates(
+    # Counts and top lists of both cutoff years
+    cutoff_years, invoice_dicts = get_sales_dashboard(
         year_type, current_financial_year
     )
 
-    # Create cutoff invoice dicts  
-    invoice_dicts = {}
-    cutoff_statuses = ["current", "previous"]
-    for cutoff_year, cutoff_status in zip(cutoff_years, cutoff_statuses):
-        cutoff_invoice_list = invoice_list.filter(
-            issue_date__range=(cutoff_year["start"], cutoff_year["end"])
-        )
-        cutoff_invoice_list = cutoff_invoice_list.annotate(
-                lines_sum=Sum("s_invoice_lines__total_amount")
-        ) # Include total amount in each invoice
-        cutoff_invoice_list_uncollected = cutoff_invoice_list.filter(collected=False)
-        
-        # Populate dict
-        invoice_dicts[cutoff_status] = {
-            "count": len(cutoff_invoice_list),
-            "count_uncollected": len(cutoff_invoice_list_uncollected),
-            "uncollected_amount": ClientCurrentAccount.objects.filter(
-                date__lte=cutoff_year["end"]).aggregate(
-                global_amount=Sum("amount"))["global_amount"] or 0, 
-            "by_date": cutoff_invoice_list.order_by("-issue_date")[:10],
-            "by_amount": cutoff_invoice_list.order_by("-lines_sum")[:10],
-            "by_uncollected_newest": cutoff_invoice_list_uncollected.order_by(
-            "-issue_date")[:10],
-            "by_uncollected_oldest": cutoff_invoice_list_uncollected.order_by(
-            "issue_date")[:10]
-        }
-
     return render(request, "erp/sales_index.html", {
         "financial_year": current_financial_year,
         "end_date": {
             "current": cutoff_years[0]["end"], "previous": cutoff_years[1]["end"]
         },
-        "sale_invoices": invoice_list,
         "invoice_dicts": invoice_dicts
     })
 
@@ -477,125 +387,27 @@ def sales_new_massive(request):
         if document_file_form.is_valid():
             file = request.FILES["file"]
                       
-            # Read file according to the extension
-            df = read_uploaded_file(file, "issue_date")
-           
             try:
-                # Check all columns exist   
-                check_column_len(df, 12)
-                # Standarize and check all columns have the right name
-                df = standarize_dataframe(df)
-                document_fields = get_model_fields_name(SaleInvoice, "collected")
-                line_fields = get_model_fields_name(SaleInvoiceLine, "total_amount",
-                    "sale_invoice"
-                )
-                total_fields = document_fields + line_fields
-                check_column_names(df, total_fields)
+                importer, columns_len, date_column = get_file_importer("sale_invoice")
+                # Read file in chunks according to the extension, checking all
+                # columns exist and have the right name
+                chunks = read_standarized_chunks(file, columns_len, importer.fields,
+                    date_column)
             except ValueError:   
                 return HttpResponseBadRequest(
                     f"The columns in your file don't match the required format."
                 )
      
-            # Pass all values in model
+            # Reject wrong files before queuing them
             try:
-                with transaction.atomic():
-                    last_invoice = None
-                    for index, row in df.iterrows():
-                        # Convert all fields into string to allow me using
-                        # validators.
-                        total_fields_row = list(map(str, row[total_fields]))
-                        date_index = total_fields.index("issue_date")
-                        type_index = total_fields.index("type")
-                        pos_index = total_fields.index("point_of_sell")
-                        number_index = total_fields.index("number")
-                        sender_index = total_fields.index("sender")
-                        recipient_index = total_fields.index("recipient")
-                        pay_method_index = total_fields.index("payment_method")
-                        pay_term_index = total_fields.index("payment_term")
-
-                        if last_invoice:
-                            current_invoice = (
-                                f"{total_fields_row[type_index].zfill(3)}"
-                                f"{total_fields_row[pos_index].zfill(5)}"
-                                f"{total_fields_row[number_index].zfill(8)}"
-                            )
-                        
-                        # Get objects from related fields                
-                        total_fields_row = get_sale_invoice_objects(
-                            total_fields, total_fields_row, index, "invoice")
-                        
-                        # Control if it's new invoice or line
-                        if index == 0 or last_invoice_id != current_invoice:
-                            new_invoice = SaleInvoice(
-                                issue_date = total_fields_row[date_index][0:10],
-                                type = total_fields_row[type_index],
-                                point_of_sell = total_fields_row[pos_index],
-                                number = total_fields_row[number_index],
-                                sender = total_fields_row[sender_index],
-                                recipient = total_fields_row[recipient_index],
-                                payment_method = total_fields_row[pay_method_index],
-                                payment_term = total_fields_row[pay_term_index]
-                            )
-                            
-                            # Execute validators before saving, and show error if exists,
-                            try:
-                                new_invoice.full_clean()
-                                new_invoice.save()
-                                # Save invoice data for next row
-                                last_invoice = new_invoice
-                                last_invoice_id = (
-                                    f"{new_invoice.type.code}"
-                                    f"{new_invoice.point_of_sell.pos_number}"
-                                    f"{new_invoice.number}"
-                                )
-                            except ValidationError as ve:
-                                raise ValueError(list_file_errors(ve, index))
-                            except IntegrityError:
-                                raise ValueError(
-                                    f"Invoice {new_invoice.type.type} "
-                                    f"{new_invoice.point_of_sell.pos_number}-"
-                                    f"{new_invoice.number} already exists or "
-                                    f"repeated in file."
-                                )
-                        # Control that invoice's info for new line is consistent
-                        else:                        
-                            if (
-                            str(last_invoice.issue_date) != total_fields_row[date_index][0:10] or    
-                            last_invoice.recipient != total_fields_row[recipient_index] or
-                            last_invoice.payment_method != total_fields_row[pay_method_index] or
-                            last_invoice.payment_term != total_fields_row[pay_term_index]):
-                                raise ValueError(
-                                    f"Row {index + 2}: Your invoice's information"
-                                    f" doesn't match with row {index + 1}."
-                                )
-
-                        # Add invoice line form
-                        new_line = SaleInvoiceLine(
-                            sale_invoice = new_invoice,
-                            description = total_fields_row[
-                                total_fields.index("description")],
-                            taxable_amount = total_fields_row[
-                                total_fields.index("taxable_amount")],
-                            not_taxable_amount = total_fields_row[
-                                total_fields.index("not_taxable_amount")],
-                            vat_amount = total_fields_row[
-                                total_fields.index("vat_amount")],
-                            # Total amount is added to don't raise validation error
-                            # in full_clean(), then it's updated in saving.
-                            total_amount = "0",
-                        )
-                        try:
-                            new_line.full_clean()
-                            new_line.save()
-                        except ValidationError as ve:
-                            raise ValueError(list_file_errors(ve, index))
-                        # Update client's current account
-                        new_invoice.update_current_account()
+                importer.check_file(chunks)
             except ValueError as e:
                  return HttpResponseBadRequest(str(e))   
                     
-            # If everything is correct
-            return HttpResponseRedirect(reverse(f"erp:sales_index"))
+            # Rows are saved in background, as big files take long to import
+            job = ImportJob.objects.create(kind="sale_invoice", file=file)
+            submit_import_job(job)
+            return HttpResponseRedirect(reverse("erp:import_job", args=[job.pk]))
         else:
             return HttpResponseBadRequest("Invalid file.")
     # Get method
@@ -609,7 +421,8 @@ def sales_new_massive(request):
 
 def sales_invoice(request, inv_pk):
     """Specific invoice webpage"""
-    invoice = SaleInvoice.objects.get(pk=inv_pk)
+    invoice = SaleInvoice.objects.select_related(*INVOICE_LIST_RELATED, "sender"
+        ).prefetch_related("s_invoice_lines").get(pk=inv_pk)
 
     return render(request, "erp/sales_invoice.html", {
         "invoice": invoice,
@@ -654,8 +467,10 @@ def sales_edit(request, inv_pk):
 
 def sales_related_receipts(request, inv_pk):
     """Show a list of specific invoice's related receipts."""
-    invoice = SaleInvoice.objects.get(pk=inv_pk)
-    receipts = SaleReceipt.objects.filter(related_invoice=invoice)
+    invoice = SaleInvoice.objects.select_related("type", "point_of_sell").get(
+        pk=inv_pk)
+    receipts = SaleReceipt.objects.filter(related_invoice=invoice).select_related(
+        "point_of_sell")
 
     return render(request, "erp/sales_related_receipts.html", {
         "invoice": invoice,
@@ -666,9 +481,10 @@ def sales_related_receipts(request, inv_pk):
 def sales_list(request):
     """Show a list of invoices in a specific range webpage"""
     # Get list general case, it gets overwritten if it changes
-    financial_year = FinancialYear.objects.filter(current=True).first()
+    financial_year = get_current_year()
     if not financial_year:    
         return HttpResponseRedirect(reverse("company:year"))
+    invoices = SaleInvoice.objects.select_related(*INVOICE_LIST_RELATED)
     
     if request.method == "POST":
         # Search between dates
@@ -683,7 +499,7 @@ def sales_list(request):
                     form_date.add_error(
                         "date_from", "'From' should be older than 'To'."
                     )
-                invoice_list = SaleInvoice.objects.filter(
+                invoice_list = invoices.filter(
                         issue_date__range=(date_from, date_to)
                     )
         # Search by year
@@ -698,14 +514,14 @@ def sales_list(request):
                     form_year.add_error(
                         "year", f"The year {input_year} doesn't exist in the records."
                     )
-                    financial_year = FinancialYear.objects.get(current=True)
-                invoice_list = SaleInvoice.objects.filter(
+                    financial_year = get_current_year()
+                invoice_list = invoices.filter(
                     issue_date__year=financial_year.year
                 )
     else:
         form_date = SearchByDateForm()
         form_year = SearchByYearForm()
-        invoice_list = SaleInvoice.objects.filter(
+        invoice_list = invoices.filter(
             issue_date__year=financial_year.year
         )
 
@@ -718,45 +534,15 @@ def sales_list(request):
 
 def receivables_index(request):
     """Overview of receivables webpage"""
-    current_financial_year = int(FinancialYear.objects.filter(current=True).first().year)
-    receipt_list = SaleReceipt.objects.all()
+    current_financial_year = int(get_current_year().year)
     year_type = request.GET.get("date_at", "calendar")
 
-    # Set date range
-    current_year, previous_year = get_financial_calendar_dates(
+    # Counts, totals and top lists of both cutoff years
+    (current_year, previous_year), receipt_dicts = get_receivables_dashboard(
         year_type, current_financial_year
     )
     
-    # Divide receipt list by year
-    cur_receipt_list = receipt_list.filter(
-        issue_date__range=(current_year["start"], current_year["end"])
-    )
-    prev_receipt_list = receipt_list.filter(
-        issue_date__range=(previous_year["start"], previous_year["end"])
-    )
-    
-    # Determine receipt lists sorts (max 10) and include them in a dictionary for
-    # both current and previous financial year.
-    receipt_dicts = {}
-    for cutoff_status, cutoff_receipt_list, cutoff_year in zip(
-        ["current", "previous"], 
-        [cur_receipt_list, prev_receipt_list],
-        [current_year, previous_year]
-    ):
-        receipt_dicts[cutoff_status] = {
-            "count": len(cutoff_receipt_list),
-            "total_amount": cutoff_receipt_list.aggregate(
-                total_sum=Sum("total_amount")
-            )["total_sum"] or 0,
-            "accumulated_amount": receipt_list.filter(
-                issue_date__lte=cutoff_year["end"]
-            ).aggregate(total=Sum("total_amount"))["total"] or 0,
-            "by_date": cutoff_receipt_list.order_by("-issue_date")[:10],
-            "by_amount": cutoff_receipt_list.order_by("-total_amount")[:10]
-        }
-    
     return render(request, "erp/receivables_index.html", {
-        "receipt_list": receipt_list,
         "financial_year": current_financial_year,
         "receipt_dicts": receipt_dicts,
         "end_date": {
@@ -787,83 +573,26 @@ def receivables_new_massive(request):
         if document_file_form.is_valid():
             file = request.FILES["file"]
                       
-            # Read file according to the extension
-            df = read_uploaded_file(file, "issue_date")
-           
             try:
-                # Check all columns exist   
-                check_column_len(df, 10)
-                # Standarize and check all columns have the right name
-                df = standarize_dataframe(df)
-                document_fields = get_model_fields_name(SaleReceipt, "related_invoice")
-                for field in ["ri_type", "ri_pos", "ri_number"]:
-                    document_fields.append(field)
-                check_column_names(df, document_fields)
+                importer, columns_len, date_column = get_file_importer("sale_receipt")
+                # Read file in chunks according to the extension, checking all
+                # columns exist and have the right name
+                chunks = read_standarized_chunks(file, columns_len, importer.fields,
+                    date_column)
             except ValueError:   
                  return HttpResponseBadRequest(
                         f"The columns in your file don't match the required format."
                     )
-            # Pass all values in model
+            # Reject wrong files before queuing them
             try:
-                with transaction.atomic():
-                    for index, row in df.iterrows():
-                        # Convert all fields into string to allow me using
-                        # validators.
-                        total_fields_row = list(map(str, row[document_fields]))
-                        
-                        # Get objects from related fields                
-                        total_fields_row = get_sale_invoice_objects(
-                            document_fields, total_fields_row, index, "receipt")
-                        
-                        # Get related invoice
-                        try:
-                            related_invoice_field = SaleInvoice.objects.get(
-                                type=total_fields_row[7], 
-                                point_of_sell=total_fields_row[8],
-                                number=total_fields_row[9].zfill(8)
-                            )
-                        except ObjectDoesNotExist:
-                            error_message = (
-                                f"The related invoice in row {index + 2} "
-                                f"doesn't exist in the records."
-                            )
-                            raise ValueError(error_message)
-                        # Control if it's new invoice or line
-                        try:
-                            new_receipt = SaleReceipt(
-                                issue_date = total_fields_row[
-                                    document_fields.index("issue_date")][0:10],
-                                point_of_sell = total_fields_row[
-                                    document_fields.index("point_of_sell")],
-                                number = total_fields_row[
-                                    document_fields.index("number")],
-                                sender = total_fields_row[
-                                    document_fields.index("sender")],
-                                recipient = total_fields_row[
-                                    document_fields.index("recipient")],
-                                description = total_fields_row[
-                                    document_fields.index("description")],
-                                total_amount = total_fields_row[
-                                    document_fields.index("total_amount")],
-                                related_invoice = related_invoice_field
-                            )
-                            # Execute validators before saving, and show error if exists,
-                            new_receipt.full_clean()
-                            new_receipt.save()      
-                        except ValidationError as ve:
-                            raise ValueError(list_file_errors(ve, index))
-                        except IntegrityError:
-                            raise ValueError(
-                                f"Receipt {new_receipt.point_of_sell.pos_number}-"
-                                f"{new_receipt.number} already exists or "
-                                f"repeated in file."
-                            )
-                        
+                importer.check_file(chunks)
             except ValueError as e:
                  return HttpResponseBadRequest(str(e))   
                     
-            # If everything is correct
-            return HttpResponseRedirect(reverse(f"erp:receivables_index"))
+            # Rows are saved in background, as big files take long to import
+            job = ImportJob.objects.create(kind="sale_receipt", file=file)
+            submit_import_job(job)
+            return HttpResponseRedirect(reverse("erp:import_job", args=[job.pk]))
         else:
             return HttpResponseBadRequest("Invalid file.")
     # Get method
@@ -877,7 +606,9 @@ def receivables_new_massive(request):
 
 def receivables_receipt(request, rec_pk):
     """Specific receipt webpage"""
-    receipt = SaleReceipt.objects.get(pk=rec_pk)
+    receipt = SaleReceipt.objects.select_related(*RECEIPT_LIST_RELATED, "sender",
+        "related_invoice__payment_method", "related_invoice__payment_term"
+        ).get(pk=rec_pk)
     return render(request, "erp/receivables_receipt.html", {
         "receipt": receipt,
     })
@@ -888,19 +619,10 @@ def receivables_edit(request, rec_pk):
 
     if request.method == "POST":
         receipt_form = SaleReceiptForm(instance=receipt, data=request.POST)
-        # keep old ri before updating instance
-        old_r_invoice = receipt.related_invoice
 
         if receipt_form.is_valid():
-            receipt_edited = receipt_form.save()
-            invoice = receipt_edited.related_invoice
-
-            # If related invoice was modified, I have to update old invoice first.
-            if old_r_invoice != invoice:
-                old_r_invoice.collected = update_invoice_collected_status(
-                    old_r_invoice)
-                old_r_invoice.save()   
-
+            # The old and new related invoices are updated by the signals.
+            receipt_form.save()
             return HttpResponseRedirect(reverse("erp:receivables_receipt", 
                 args=[receipt.pk]
             ))
@@ -926,9 +648,10 @@ def receivables_search(request):
 def receivables_list(request):
     """Show a list of receipts in a specific range webpage"""
     # Get list general case, it gets overwritten if it changes
-    financial_year = FinancialYear.objects.filter(current=True).first()
+    financial_year = get_current_year()
     if not financial_year:
         return HttpResponseRedirect(reverse("company:year"))
+    receipts = SaleReceipt.objects.select_related(*RECEIPT_LIST_RELATED)
     
     if request.method == "POST":
         # Search between dates
@@ -943,7 +666,7 @@ def receivables_list(request):
                     form_date.add_error(
                         "date_from", "'From' should be older than 'To'."
                     )
-                receipt_list = SaleReceipt.objects.filter(
+                receipt_list = receipts.filter(
                         issue_date__range=(date_from, date_to)
                     )
         # Search by year
@@ -959,16 +682,50 @@ def receivables_list(request):
                         "year", f"The year {input_year} doesn't exist in the records."
                     )
                     # Go back to current year in search
-                    financial_year = FinancialYear.objects.get(current=True)
-                receipt_list = SaleReceipt.objects.filter(issue_date__year=financial_year.year)
+                    financial_year = get_current_year()
+                receipt_list = receipts.filter(issue_date__year=financial_year.year)
     else:
         form_date = SearchByDateForm()
         form_year = SearchByYearForm()
-        receipt_list = SaleReceipt.objects.filter(issue_date__year=financial_year.year)
+        receipt_list = receipts.filter(issue_date__year=financial_year.year)
 
     return render(request, "erp/receivables_list.html", {
         "com_document": "receipt",
         "receipt_list": receipt_list,
         "form_date": form_date,
         "form_year": form_year, 
-    })
\ No newline at end of file
+    })
+
+def import_job(request, job_pk):
+    """Status of a massive upload imported in background"""
+    try:
+        job = ImportJob.objects.get(pk=job_pk)
+    except ObjectDoesNotExist:
+        raise Http404("The import doesn't exist.")
+
+    index_url = {
+        "client": "erp:client_index",
+        "supplier": "erp:supplier_index",
+        "sale_invoice": "erp:sales_index",
+        "sale_receipt": "erp:receivables_index",
+    }[job.kind]
+    return render(request, "erp/import_job.html", {
+        "job": job,
+        "index_url": index_url,
+    })
+
+
+def import_job_retry(request, job_pk):
+    """Continue a failed massive upload after its imported rows"""
+    if request.method != "POST":
+        return HttpResponseRedirect(reverse("erp:import_job", args=[job_pk]))
+    try:
+        job = ImportJob.objects.get(pk=job_pk)
+    except ObjectDoesNotExist:
+        raise Http404("The import doesn't exist.")
+
+    try:
+        retry_import_job(job)
+    except ValueError as ve:
+        return HttpResponseBadRequest(str(ve))
+    return HttpResponseRedirect(reverse("erp:import_job", args=[job.pk]))
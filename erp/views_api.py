@@ -1,27 +1,66 @@
 """API Views from erp app"""
+from django.db import transaction
 from django.db.models.deletion import RestrictedError
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 
+from company.utils import get_company
 from .models import (CompanyClient, Supplier, PaymentMethod, PaymentTerm,
-    PointOfSell, DocumentType, SaleInvoice, SaleReceipt)
+    PointOfSell, DocumentType, SaleInvoice, SaleReceipt, ImportJob, SalesCube)
+from .importers import FileError, get_file_importer
+from .jobs import submit_import_job, retry_import_job
+from .search import index_persons, search_persons
+from .services import (SALES_CUBE_DIMENSIONS, CLIENT_RANKINGS, get_sales_cube,
+    get_clients_ranking)
 from .serializers import (CClientSerializer, SupplierSerializer, 
     PaymentMethodSerializer, PaymentTermSerializer, PointOfSellSerializer,
     DocTypesSerializer, SaleInvoicesSerializer, SaleReceiptsSerializer, 
     SInvoiceDynamicSerializer, DocTypeDynamicSerializer, CClientDynamicSerializer,
-    POSDynamicSerializer, SaleReceiptsDynamicSerializer)
+    POSDynamicSerializer, SaleReceiptsDynamicSerializer, ImportJobSerializer,
+    SaleInvoiceSearchSerializer, SaleReceiptSearchSerializer,
+    SaleInvoiceBatchSerializer, SalesCubeSerializer, ClientStatsSerializer)
+from .utils import FILE_CHUNK_SIZE
 
 from .utils_api import (handle_multiple_instances, SerializerMixin, BulkDeleteMixin, 
-    DeleteConflictMixin)
+    BulkUpdateMixin, DeleteConflictMixin, ConditionalGetMixin, StreamingListMixin,
+    KeysetPagination, filter_collected, filter_documents, get_invoice_lines_dataframe,
+    get_invoices_errors)
 
 
-class CompanyClientAPI(generics.ListAPIView):
-    """Show API list of clients"""
+class CompanyClientAPI(BulkUpdateMixin, generics.ListAPIView):
+    """Show API list of clients and update many of them"""
     queryset = CompanyClient.objects.all()
     serializer_class = CClientSerializer
+
+    def perform_bulk_update(self, instances, fields):
+        super().perform_bulk_update(instances, fields)
+        index_persons(CompanyClient, instances)
     
+class CompanyClientSearchAPI(generics.ListAPIView):
+    """Search clients by the start of the words of their name, address or tax number"""
+    serializer_class = CClientSerializer
+
+    def get_queryset(self):
+        return search_persons(CompanyClient, self.request.query_params.get("q", ""))
+
+class CompanyClientRankingAPI(generics.ListAPIView):
+    """
+    Rank clients by their sales, transactions, balance or last activity.
+    I.E. ?ranking=sales&page_size=10. Pages are read in the order of an index.
+    """
+    serializer_class = ClientStatsSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        ranking = self.request.query_params.get("ranking", "sales")
+        if ranking not in CLIENT_RANKINGS:
+            raise ValidationError({"ranking": 
+                f"Invalid ranking. Options: {', '.join(CLIENT_RANKINGS)}"})
+        return get_clients_ranking(ranking)
+
 class CompanyClientDeleteAPI(BulkDeleteMixin, generics.GenericAPIView):
     """API delete a list of clients"""
     queryset = CompanyClient.objects.all()
@@ -39,11 +78,22 @@ class DetailCompanyClientAPI(SerializerMixin, DeleteConflictMixin, generics.Retr
         else:
             return CClientSerializer 
 
-class SupplierAPI(generics.ListAPIView):
-    """Show API list of suppliers"""
+class SupplierAPI(BulkUpdateMixin, generics.ListAPIView):
+    """Show API list of suppliers and update many of them"""
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
 
+    def perform_bulk_update(self, instances, fields):
+        super().perform_bulk_update(instances, fields)
+        index_persons(Supplier, instances)
+
+class SupplierSearchAPI(generics.ListAPIView):
+    """Search suppliers by the start of the words of their name, address or tax number"""
+    serializer_class = SupplierSerializer
+
+    def get_queryset(self):
+        return search_persons(Supplier, self.request.query_params.get("q", ""))
+
 class SupplierDeleteAPI(BulkDeleteMixin, generics.GenericAPIView):
     """API delete a list of suppliers"""
     queryset = Supplier.objects.all()
@@ -53,10 +103,11 @@ class DetailSupplierAPI(DeleteConflictMixin, generics.RetrieveUpdateDestroyAPIVi
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
 
-class PaymentMethodAPI(generics.ListCreateAPIView):
+class PaymentMethodAPI(ConditionalGetMixin, generics.ListCreateAPIView):
     """CRUD API of payment methods"""
     queryset = PaymentMethod.objects.all()
     serializer_class = PaymentMethodSerializer
+    versioned_models = [PaymentMethod]
 
     def create(self, request, *args, **kwargs):
         """Handle single or multiple instances in one request"""
@@ -66,15 +117,18 @@ class PaymentMethodAPI(generics.ListCreateAPIView):
             return super().create(request, *args, **kwargs)
 
 
-class DetailPaymentMethodAPI(DeleteConflictMixin, generics.RetrieveUpdateDestroyAPIView):
+class DetailPaymentMethodAPI(ConditionalGetMixin, DeleteConflictMixin, 
+    generics.RetrieveUpdateDestroyAPIView):
     """CRUD API of specific payment method"""
     queryset = PaymentMethod.objects.all()
     serializer_class = PaymentMethodSerializer
+    versioned_models = [PaymentMethod]
 
-class PaymentTermAPI(generics.ListCreateAPIView):
+class PaymentTermAPI(ConditionalGetMixin, generics.ListCreateAPIView):
     """CRUD API of payment terms"""
     queryset = PaymentTerm.objects.all()
     serializer_class = PaymentTermSerializer
+    versioned_models = [PaymentTerm]
 
     def create(self, request, *args, **kwargs):
         """Handle single or multiple instances in one request"""
@@ -84,21 +138,26 @@ class PaymentTermAPI(generics.ListCreateAPIView):
             return super().create(request, *args, **kwargs)
 
 
-class DetailPaymentTermAPI(DeleteConflictMixin, generics.RetrieveUpdateDestroyAPIView):
+class DetailPaymentTermAPI(ConditionalGetMixin, DeleteConflictMixin,
+    generics.RetrieveUpdateDestroyAPIView):
     """CRUD API of specific payment term"""
     queryset = PaymentTerm.objects.all()
     serializer_class = PaymentTermSerializer
+    versioned_models = [PaymentTerm]
 
 
-class PointOfSellAPI(generics.ListCreateAPIView):
+class PointOfSellAPI(ConditionalGetMixin, BulkUpdateMixin, generics.ListCreateAPIView):
     """CRUD API of Point of sells"""
     queryset = PointOfSell.objects.all()
     serializer_class = PointOfSellSerializer
+    versioned_models = [PointOfSell]
 
 
-class DetailPointOfSellAPI(SerializerMixin, generics.RetrieveUpdateAPIView):
+class DetailPointOfSellAPI(ConditionalGetMixin, SerializerMixin, 
+    generics.RetrieveUpdateAPIView):
     """CRUD API of specific POS"""
     queryset = PointOfSell.objects.all()
+    versioned_models = [PointOfSell]
 
     def get_serializer_class(self):
         # Pick serializer acording to request
@@ -110,15 +169,17 @@ class DetailPointOfSellAPI(SerializerMixin, generics.RetrieveUpdateAPIView):
             return PointOfSellSerializer 
 
 
-class DocTypesAPI(generics.ListAPIView):
-    """View API of doc types"""
+class DocTypesAPI(ConditionalGetMixin, BulkUpdateMixin, generics.ListAPIView):
+    """View API of doc types and update many of them"""
     queryset = DocumentType.objects.all()
     serializer_class = DocTypesSerializer
+    versioned_models = [DocumentType]
 
 
-class DocTypeAPI(SerializerMixin, generics.RetrieveUpdateAPIView):
+class DocTypeAPI(ConditionalGetMixin, SerializerMixin, generics.RetrieveUpdateAPIView):
     """Vies API of especific doc type"""
     queryset = DocumentType.objects.all()
+    versioned_models = [DocumentType]
 
     def get_serializer_class(self):
         # Pick serializer acording to request
@@ -130,21 +191,22 @@ class DocTypeAPI(SerializerMixin, generics.RetrieveUpdateAPIView):
             return DocTypesSerializer
 
 
-class SaleInvoicesAPI(SerializerMixin, generics.ListCreateAPIView):
+class SaleInvoicesAPI(SerializerMixin, BulkUpdateMixin, StreamingListMixin,
+    generics.ListCreateAPIView):
     """CRUD API of sale invoices"""
+    pagination_class = KeysetPagination
+
     def get_queryset(self):
         # Get full list or only collected invoices.
         collected = self.request.query_params.get("collected", None)
         exclude_inv_pk = self.request.query_params.get("exclude_inv_pk", None)
         
-        queryset = SaleInvoice.objects.all()
+        # Display names include the type and the POS.
+        queryset = SaleInvoice.objects.select_related("type", "point_of_sell")
 
         # Apply filters and exclusions
-        if collected:
-            if collected.lower() == "true":
-                queryset = queryset.filter(collected=True)
-            elif collected.lower() == "false":
-                queryset = queryset.filter(collected=False)
+        queryset = filter_collected(queryset, collected)
+        queryset = filter_documents(queryset, self.request.query_params)
     
         if exclude_inv_pk and exclude_inv_pk.isdigit():
             queryset = queryset.exclude(pk=int(exclude_inv_pk))
@@ -159,7 +221,68 @@ class SaleInvoicesAPI(SerializerMixin, generics.ListCreateAPIView):
         # Default Serializer
         else:
             return SaleInvoicesSerializer
+
+    def perform_bulk_update(self, instances, fields):
+        super().perform_bulk_update(instances, fields)
+        if "issue_date" in fields or "recipient" in fields:
+            SaleInvoice.bulk_update_current_accounts(instances)
+        # Signals aren't sent by bulk_update.
+        SalesCube.move_invoices(instances)
         
+class SaleInvoicesSearchAPI(ConditionalGetMixin, generics.ListAPIView):
+    """Show sale invoices with the related fields of the search page"""
+    serializer_class = SaleInvoiceSearchSerializer
+    pagination_class = KeysetPagination
+    # Collected status is changed by the receipts.
+    versioned_models = [SaleInvoice, SaleReceipt, CompanyClient, PointOfSell,
+        DocumentType]
+
+    def get_queryset(self):
+        queryset = SaleInvoice.objects.select_related(
+            "type", "point_of_sell", "recipient")
+        queryset = filter_collected(queryset,
+            self.request.query_params.get("collected", None))
+        return filter_documents(queryset, self.request.query_params)
+
+class SaleInvoicesBulkCreateAPI(generics.GenericAPIView):
+    """
+    Create a list of sale invoices with their lines in one request. They are
+    checked and saved in bulk as an invoices file, so every invoice is saved or
+    none. Errors are listed by the index of their invoice in the request.
+    """
+    serializer_class = SaleInvoiceBatchSerializer
+    # Max number of invoices created in one request
+    max_invoices = 10000
+
+    def post(self, request, *args, **kwargs):
+        if isinstance(request.data, list) and len(request.data) > self.max_invoices:
+            return Response(
+                {"detail": f"Up to {self.max_invoices} invoices can be created."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        importer, _, _ = get_file_importer("sale_invoice")
+        company = get_company()
+        sender = company.tax_number if company else None
+        df = get_invoice_lines_dataframe(serializer.validated_data,
+            importer.fields, sender)
+        chunks = [df[start:start + FILE_CHUNK_SIZE]
+            for start in range(0, max(len(df), 1), FILE_CHUNK_SIZE)]
+        try:
+            # Reject wrong invoices before writing any of them
+            importer.check_file(chunks)
+            with transaction.atomic():
+                importer.import_file(chunks)
+        except FileError as e:
+            return Response(get_invoices_errors(e.errors, serializer.validated_data),
+                status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"created": len(serializer.validated_data)},
+            status=status.HTTP_201_CREATED)
+
 class SaleInvoicesDeleteAPI(BulkDeleteMixin, generics.GenericAPIView):
     """API delete a list of sale invoices"""
     queryset = SaleInvoice.objects.all()
@@ -177,10 +300,26 @@ class SaleInvoiceAPI(SerializerMixin, DeleteConflictMixin, generics.RetrieveUpda
         else:
             return SaleInvoicesSerializer
     
-class SaleReceiptsAPI(generics.ListCreateAPIView):
+class SaleReceiptsAPI(StreamingListMixin, generics.ListCreateAPIView):
     """CRUD API of sale receipts"""
-    queryset = SaleReceipt.objects.all()
     serializer_class = SaleReceiptsSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return filter_documents(SaleReceipt.objects.all(),
+            self.request.query_params)
+
+class SaleReceiptsSearchAPI(ConditionalGetMixin, generics.ListAPIView):
+    """Show sale receipts with the related fields of the search page"""
+    serializer_class = SaleReceiptSearchSerializer
+    pagination_class = KeysetPagination
+    versioned_models = [SaleReceipt, SaleInvoice, CompanyClient, PointOfSell,
+        DocumentType]
+
+    def get_queryset(self):
+        queryset = SaleReceipt.objects.select_related("point_of_sell",
+            "recipient", "related_invoice__type", "related_invoice__point_of_sell")
+        return filter_documents(queryset, self.request.query_params)
 
 class SaleReceiptsDeleteAPI(BulkDeleteMixin, generics.GenericAPIView):
     """API delete a list of sale receipts"""
@@ -197,4 +336,79 @@ class SaleReceiptAPI(SerializerMixin, generics.RetrieveUpdateDestroyAPIView):
             return SaleReceiptsDynamicSerializer
         # Default Serializer
         else:
-            return SaleReceiptsSerializer
\ No newline at end of file
+            return SaleReceiptsSerializer
+
+class SalesCubeAPI(APIView):
+    """
+    Sum the sales by month, year, client, doc type, point of sell or payment
+    method, read from the sales cube. I.E. ?group_by=year,client&year=2024,2025
+    """
+    # {query param: cube lookup} of the filters
+    filters = {
+        "year": "month__year__in",
+        "client": "client__in",
+        "type": "type__in",
+        "point_of_sell": "point_of_sell__in",
+        "payment_method": "payment_method__in",
+    }
+
+    def get(self, request, *args, **kwargs):
+        group_by = [name.strip() for name in 
+            request.query_params.get("group_by", "").split(",") if name.strip()]
+        errors = {}
+        wrong_dimensions = [name for name in group_by
+            if name not in SALES_CUBE_DIMENSIONS]
+        if wrong_dimensions:
+            errors["group_by"] = f"Invalid dimensions: {', '.join(wrong_dimensions)}"
+
+        filters = {}
+        for param, lookup in self.filters.items():
+            values = request.query_params.get(param, None)
+            if values is None:
+                continue
+            values = [value.strip() for value in values.split(",")]
+            if not all(value.isdigit() for value in values):
+                errors[param] = "Values must be integers separated by commas."
+            else:
+                filters[lookup] = [int(value) for value in values]
+        
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = get_sales_cube(dict.fromkeys(group_by), **filters)
+        return Response(SalesCubeSerializer(rows, many=True).data)
+
+
+class ImportJobsAPI(generics.CreateAPIView):
+    """Upload a file to be imported in background"""
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+
+    def perform_create(self, serializer):
+        submit_import_job(serializer.save())
+
+    def create(self, request, *args, **kwargs):
+        """Return the job right away, as the file is imported later"""
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+
+class ImportJobAPI(generics.RetrieveAPIView):
+    """Show the progress of an import job"""
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+
+
+class ImportJobRetryAPI(generics.GenericAPIView):
+    """Continue a failed import job after the rows it already imported"""
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+
+    def post(self, request, *args, **kwargs):
+        job = self.get_object()
+        try:
+            retry_import_job(job)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED)
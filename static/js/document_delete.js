@@ -4,9 +4,6 @@ async function deleteComDocument(commercialDocument, cDocObject, redirectUrl)
 
     if (commercialDocument === "receipt") {
         cDocObject.type = "";
-        var rTotalAmount = await getSubFields(
-            `/erp/api/sale_receipts/${cDocObject.id}`, ['total_amount']
-        );
     }
     
     const msg = generateDeleteMsg(commercialDocument, cDocObject);
@@ -31,14 +28,7 @@ async function deleteComDocument(commercialDocument, cDocObject, redirectUrl)
             return false;
         }
 
-
-        // If a receipt was deleted, update collected status in invoice
-        if(commercialDocument === 'receipt' && rTotalAmount !== 0) {
-    
-            const updateUrl = `/erp/api/sale_invoices/${cDocObject.related_invoice}`; // crud.js
-            await changeOneAttribute(updateUrl, 'collected', false); // crud.js
-
-        }
+        // The collected status of the invoice is updated by the server.
         
         // element to append the popup
         showPopUp('animation', redirectUrl,
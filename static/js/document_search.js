@@ -74,8 +74,8 @@ document.addEventListener('DOMContentLoaded', function() {
 async function preloadComDocuments(comDocument, comDocumentList, collectedField) {
     // Preload the invoices to allow fast searching
     
-    // Get the list.
-    let url = `/erp/api/sale_${comDocument}s`;
+    // Get the list with its related fields in one request.
+    let url = `/erp/api/sale_${comDocument}s/search_index`;
     if (comDocument === 'invoice') {
         let collectedStatus = collectedField.value;
         if(collectedStatus === 'op1') {
@@ -90,16 +90,6 @@ async function preloadComDocuments(comDocument, comDocumentList, collectedField)
 
     comDocumentList = await getList(url);
 
-    // Get the subfields of each field
-    const fieldsSubfields = await Promise.all([
-        getCommonFieldsInfo(comDocumentList),
-        getParticularFieldsInfo(comDocument, comDocumentList)
-    ]);
-
-    // Convert invoice's ids fields
-    comDocumentList = convertDocumentFields(comDocument, comDocumentList,
-        fieldsSubfields);
-
     return comDocumentList;
 
 }
@@ -301,100 +291,6 @@ function filterCDocumentList(comDocument, cDocumentList, ...fields) {
 }
 
 
-async function getCommonFieldsInfo(comDocumentList) {
-
-    // Create a list of posIds and clientIds 
-    let posIdList = comDocumentList.map(cDocument => cDocument.point_of_sell);
-    posIdList = [...new Set(posIdList)];
-    
-    let clientIdList = comDocumentList.map(cDocument => cDocument.recipient);
-    clientIdList = [...new Set(clientIdList)];
-
-    // Get pos numbers and clients tax and name for each id in parallel mode.
-    const [posNumbers, clientsInfo] = await Promise.all([
-
-        Promise.all(posIdList.map(posId => 
-            getSubFields(`/erp/api/points_of_sell/${posId}`, ['id', 'pos_number'])
-        )),
-        
-        Promise.all(clientIdList.map(clientId => 
-            getSubFields(
-                `/erp/api/clients/${clientId}`, ['id', 'name', 'tax_number']
-            )
-        ))
-    ])
-
-    return [posNumbers, clientsInfo];
-
-}
-
-async function getParticularFieldsInfo(comDocument, comDocumentList) {
-    // Create typeIds, and related_invoiceIds depending on the document
-    if (comDocument === 'invoice') {
-
-        let typeIdList = comDocumentList.map(invoice => invoice.type);
-        typeIdList = [...new Set(typeIdList)];
-
-        // Get invoice types for each id
-        return await Promise.all(typeIdList.map(typeId => 
-            getSubFields(
-                `/erp/api/document_types/${typeId}`, ['id', 'type'])
-            )
-        );
-    } else if (comDocument === 'receipt') {
-        let rInvoiceIdList = comDocumentList.map(receipt => receipt.related_invoice);
-        rInvoiceIdList = [...new Set(rInvoiceIdList)];
-
-        // Get invoice name
-        let relatedInvoices = await Promise.all(rInvoiceIdList.map(InvoiceId => 
-            getSubFields(
-                `/erp/api/sale_invoices/${InvoiceId}`, ['id', 'display_name']
-            )
-        ));
-
-        return relatedInvoices;
-    }
-}
-
-function convertDocumentFields(comDocument, cDocumentList, fieldsSubfields) {
-    // Convert document attributes from id to real values 
-    
-    cDocumentList.forEach(cDocument => {
-
-        // Common fields        
-        for (const posNumber of fieldsSubfields[0][0]) {
-            if (posNumber.id === cDocument.point_of_sell) {
-                cDocument.point_of_sell = posNumber.pos_number;
-            }
-        }
-
-        for (const saleClient of fieldsSubfields[0][1]) {
-            if (saleClient.id === cDocument.recipient) {
-                cDocument.recipient = saleClient.tax_number;
-                cDocument.recipient_name = saleClient.name;
-            }
-        }
-
-        // particular fields
-        if (comDocument === 'invoice') {
-            for (const typeType of fieldsSubfields[1]) {
-                if (typeType.id === cDocument.type) {
-                    cDocument.type = typeType.type;
-                }
-            }
-        } else if (comDocument === 'receipt') {
-            for (const rInvoice of fieldsSubfields[1]) {
-                if (rInvoice.id === cDocument.related_invoice) {
-                    cDocument.related_invoice_info = rInvoice.display_name;
-                }
-            }
-        }
-    });
-
-    return cDocumentList;
-
-}
-
 function createHeaders(container, headers) {
     // Create headers for search section
 
@@ -1,11 +1,13 @@
 """Base classes for tests"""
 import datetime
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from company.models import Company, FinancialYear
+from company.utils import clear_cached_instance
 from erp.models import (PaymentTerm, PaymentMethod, CompanyClient, Supplier,
     PointOfSell)
 
@@ -111,6 +113,12 @@ class CreateDbInstancesMixin:
 
 class BackBaseTest(TestCase):
     """Common Properties and functions for Backend tests"""
+    def setUp(self):
+        # Cached responses and instances could belong to rolled back tests.
+        cache.clear()
+        clear_cached_instance(Company)
+        clear_cached_instance(FinancialYear)
+
     @classmethod
     def setUpTestData(cls):
         """Populate DB for testing ERP models"""
@@ -202,6 +210,12 @@ class BackBaseTest(TestCase):
 
 class APIBaseTest(APITestCase):
     """Common functions for API tests"""
+    def setUp(self):
+        # Cached responses and instances could belong to rolled back tests.
+        cache.clear()
+        clear_cached_instance(Company)
+        clear_cached_instance(FinancialYear)
+
     def check_api_get_response(self, url, url_name=None, page_content=None, 
             wrong_content=None, count=None):
         """